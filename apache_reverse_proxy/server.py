@@ -1,4 +1,7 @@
+import os
+import sys
 from flask import Flask
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
 
 app = Flask(__name__)
 
@@ -11,4 +14,10 @@ def hidden_test():
     return "Hidden Test OK\n", 200
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    workers = int(os.environ.get("SERVER_WORKERS", "0"))
+    if workers > 0:
+        import prefork
+        prefork.serve(app, host='0.0.0.0', port=5000, workers=workers)
+    else:
+        # Il debugger/reloader solo se richiesto esplicitamente
+        app.run(host='0.0.0.0', port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
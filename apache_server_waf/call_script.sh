@@ -1,8 +1,8 @@
 #!/bin/bash
 
-echo "Script executed at $(date)" >> /var/log/modsec_payload.log
-
-# Legge il payload dallo stdin
+# Payload dalla variabile d'ambiente impostata da custom_rules.conf (setenv:MODSEC_PAYLOAD).
+# Il kernel limita ogni stringa dell'ambiente a 128 KiB (MAX_ARG_STRLEN) quando ModSecurity esegue
+# lo script: un corpo più lungo di 131072 - 16 byte ("MODSEC_PAYLOAD=" e il terminatore) non arriva qui
 PAYLOAD="${MODSEC_PAYLOAD}"
 
 # Verifica se il payload è vuoto
@@ -11,18 +11,23 @@ if [ -z "$PAYLOAD" ]; then
   exit 1
 fi
 
-echo "Received payload: $PAYLOAD" >> /var/log/modsec_payload.log
+# Le decisioni (con payload troncato e hash) sono registrate dal demone nel log JSON lines,
+# senza scritture sincrone su file a ogni richiesta
 
-# Passa il payload allo script Python
-output = $(/usr/local/bin/python3.9 /etc/modsecurity/decision_script.py "$PAYLOAD")
+# Passa il payload al demone di decisione (decision_daemon.py) tramite il client leggero,
+# evitando di avviare un nuovo processo Python con modello ed estrattore a ogni richiesta.
+# Il payload arriva al client su stdin (printf è un builtin): non viene copiato negli argomenti e,
+# con env -u, nemmeno nell'ambiente del processo python3.9; limiti di lunghezza e pre-filtro sono
+# applicati dal demone (payload_policy.py)
+output=$(printf '%s' "$PAYLOAD" | env -u MODSEC_PAYLOAD /usr/local/bin/python3.9 -S /etc/modsecurity/decision_client.py -)
 
 if [ "$output" == "Blocked" ]; then
     # Se il classificatore segnala un attacco
-    echo "ModSecurity+ML: Potential SQL Injection detected. Blocking query: $PAYLOAD"
+    echo "ModSecurity+ML: Potential SQL Injection detected. Blocking query: ${PAYLOAD:0:256}"
     exit 1
-elif [ "$output" == "Allow" ]; then
+elif [ "$output" == "Allowed" ]; then
     # Query consentita
-    echo "Allowed: Query is safe. Payload: $PAYLOAD"
+    echo "Allowed: Query is safe. Payload: ${PAYLOAD:0:256}"
     exit 0
 else
     # Caso in cui l'output non sia riconosciuto (errore)
@@ -0,0 +1,142 @@
+"""
+Decisione a cascata: un modello lineare economico decide i payload certi.
+
+Il primo stadio usa le feature CRS già estratte e un modello lineare L1
+(SparseLinearModel, somma dei pesi delle sole regole attivate): se lo score
+è sotto `allow_below` il payload è Allowed, se è sopra `block_above` è
+Blocked. Solo i payload incerti, con lo score tra le due soglie, passano al
+percorso completo: ModSecurity e il modello richiesto (RF, inf_svm, ...),
+che riusa le feature del primo stadio.
+
+Le soglie vanno calibrate offline sugli insiemi di test con
+testing_scripts/calibrate_cascade.py, che sceglie la coppia con meno payload
+inoltrati a parità di accuratezza e di recall sugli attacchi (anche
+avversari) del percorso completo, e la salva in un file JSON insieme al
+report (quota inoltrata, latenza risparmiata).
+
+Nei risultati i payload decisi dal primo stadio hanno ModSecurity "Not
+evaluated" e come verdetto ML quello del modello economico.
+
+    cascade = Cascade.load("data/cascade_modsec_inf_svm.json")
+    waf, ml, combined = cascade.score_batch(payloads, extractor, escalate)
+"""
+
+import json
+import threading
+import time
+
+import numpy as np
+
+import metrics
+import scoring
+from linear_model import SparseLinearModel
+
+CASCADE_VERSION = 1
+# Esito del primo stadio per ciascun payload
+ESCALATE = -1
+ALLOWED = 0
+BLOCKED = 1
+STAGES = {ALLOWED: "cheap_allowed", BLOCKED: "cheap_blocked", ESCALATE: "escalated"}
+
+
+def load_cheap_model(path):
+    """Modello lineare del primo stadio: .npz esportato da linear_model.py o .joblib lineare."""
+    if path.endswith(".npz"):
+        return SparseLinearModel.load(path)
+    import joblib
+
+    return SparseLinearModel.from_model(joblib.load(path))
+
+
+class Cascade:
+    """Primo stadio lineare con soglie sullo score; i payload incerti vanno al percorso completo."""
+
+    def __init__(self, cheap_model, allow_below, block_above, cheap_model_path=None, info=None):
+        if allow_below > block_above:
+            raise ValueError(f"Soglie non valide: allow_below {allow_below} > block_above {block_above}")
+        self.cheap_model = cheap_model
+        self.allow_below = float(allow_below)
+        self.block_above = float(block_above)
+        self.cheap_model_path = cheap_model_path
+        self.info = info or {}
+        self._counts = {stage: 0 for stage in STAGES.values()}
+        self._seconds = {"cheap": 0.0, "escalated": 0.0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        if config.get("version") != CASCADE_VERSION:
+            raise ValueError(f"Versione della calibrazione non supportata: {config.get('version')}")
+        return cls(load_cheap_model(config["cheap_model"]), config["allow_below"], config["block_above"],
+                   cheap_model_path=config["cheap_model"], info=config.get("report"))
+
+    def save(self, path, report=None):
+        config = {"version": CASCADE_VERSION, "cheap_model": self.cheap_model_path,
+                  "allow_below": self.allow_below, "block_above": self.block_above, "report": report or self.info}
+        with open(path, "w") as f:
+            json.dump(config, f, indent=2)
+
+    def triage(self, active):
+        """(esiti ALLOWED/BLOCKED/ESCALATE, score del modello economico) dagli indici delle regole attivate."""
+        scores = self.cheap_model.decision_function_active(active)
+        stages = np.full(len(scores), ESCALATE, dtype=int)
+        stages[scores < self.allow_below] = ALLOWED
+        stages[scores > self.block_above] = BLOCKED
+        return stages, scores
+
+    def score_batch(self, payloads, extractor, escalate):
+        """Come scoring.score_batch: (waf, ml, combined); `escalate(payloads, active)` -> (waf, ml)
+        viene chiamata solo sui payload incerti, con le feature già estratte."""
+        payloads = list(payloads)
+        n = len(payloads)
+        start = time.perf_counter()
+        with metrics.timed("features"):
+            active = extractor.extract_active(payloads)
+        with metrics.timed("cascade_cheap"):
+            stages, _ = self.triage(active)
+        cheap_seconds = time.perf_counter() - start
+
+        waf_pred = np.full(n, scoring.NOT_EVALUATED, dtype=int)
+        ml_pred = np.where(stages == ESCALATE, scoring.NOT_EVALUATED, stages)
+        combined_pred = stages.copy()
+        pending = np.flatnonzero(stages == ESCALATE)
+        start = time.perf_counter()
+        if len(pending):
+            waf, ml = escalate([payloads[i] for i in pending], [active[i] for i in pending])
+            waf_pred[pending] = waf
+            ml_pred[pending] = ml
+            combined_pred[pending] = (np.asarray(waf) == 1) | (np.asarray(ml) == 1)
+        escalated_seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._seconds["cheap"] += cheap_seconds
+            self._seconds["escalated"] += escalated_seconds
+            for stage, name in STAGES.items():
+                self._counts[name] += int(np.sum(stages == stage))
+        for stage, name in STAGES.items():
+            count = int(np.sum(stages == stage))
+            if count:
+                metrics.registry.inc("cascade", count, stage=name)
+        return waf_pred, ml_pred, combined_pred
+
+    def stats(self):
+        with self._lock:
+            counts, seconds = dict(self._counts), dict(self._seconds)
+        total = sum(counts.values())
+        return {
+            "allow_below": self.allow_below,
+            "block_above": self.block_above,
+            "cheap_model": self.cheap_model_path,
+            "payloads": total,
+            "escalated_rate": round(counts["escalated"] / total, 4) if total else 0.0,
+            "stages": counts,
+            "cheap_ms_per_payload": round(seconds["cheap"] / total * 1000, 4) if total else 0.0,
+            "escalated_ms_per_payload": round(seconds["escalated"] / counts["escalated"] * 1000, 4)
+            if counts["escalated"] else 0.0,
+            "calibration": self.info,
+        }
+
+
+metrics.registry.describe("cascade", "Payloads decided by the cheap first stage or escalated to the full path")
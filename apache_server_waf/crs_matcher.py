@@ -0,0 +1,810 @@
+"""
+Matcher precompilato e con pre-filtro per le regole SQLi del CRS.
+
+PyModSecurity e ModSecurityFeaturesExtractor valutano le regole una alla
+volta su ogni payload. Qui le regole SQLi (crs_sqli_ids, fino al PL
+indicato) vengono compilate una volta sola a partire dai metadati di
+crs_rules: variabili, trasformazioni e operatore di ciascuna regola (e delle
+regole in chain). Per ogni regola @rx/@pm si ricava dall'albero della regex
+un insieme di letterali di cui almeno uno deve comparire in ogni match: il
+pre-filtro cerca questi letterali (minuscoli) nel testo trasformato, una
+volta per catena di trasformazioni, e le regex vengono eseguite solo per le
+regole con un letterale presente. Per i payload benigni la maggior parte
+delle regole viene saltata.
+
+Le regex sono eseguite in modalità bytes (come PCRE senza UTF in
+libmodsecurity, con DOTALL e MULTILINE) dopo una traduzione della sintassi
+PCRE (\\z, \\h, classi POSIX). Gruppi atomici e quantificatori possessivi
+restano tali solo con Python >= 3.11, che li implementa come PCRE; con
+versioni precedenti la regola è Unsupported (renderli greedy cambia i match:
+\\d++1 non trova mai "11"). Le regole con operatori, variabili o
+trasformazioni non riproducibili sono elencate in `unsupported` e il matcher
+non è `exact`. FeatureService usa il matcher solo se è `verified`: exact e
+con una verifica di parità senza differenze registrata nel file da
+testing_scripts/benchmark_crs_matcher.py --matcher <file>.
+
+Il risultato della compilazione (regex tradotte, letterali, gruppi del
+pre-filtro) è salvato su disco con l'identità del ruleset e degli id SQLi:
+gli avvii successivi saltano parsing e analisi finché i file non cambiano.
+Il file è un pickle (con il risultato della verifica di parità): viene
+caricato solo se file e cartella sono privati dell'utente effettivo
+(private_files.py) e scritto con permessi 0600.
+
+    matcher = load_or_build("./coreruleset/rules/", "data/crs_sqli_ids_4.0.0.json", pl=4,
+                            path=f"{private_files.DEFAULT_CACHE_DIR}/crs_sqli_pl4.matcher")
+    matcher.match("1' or 1=1 -- ")          # id delle regole attivate
+    matcher.profile(payloads)                # costo per regola
+
+    python3 crs_matcher.py --crs-path ./coreruleset/rules --ids data/crs_sqli_ids_4.0.0.json --output /var/tmp/modsec_crs_cache-$(id -u)/crs_sqli_pl4.matcher
+"""
+
+import argparse
+import base64
+import json
+import os
+import pickle
+import re
+import sys
+import time
+import warnings
+from urllib.parse import quote_from_bytes
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+import crs_rules
+from private_files import check_private_file, dump_private
+from verdict_cache import file_identity
+
+MATCHER_VERSION = 2
+# re di Python implementa gruppi atomici e quantificatori possessivi (semantica PCRE) dalla 3.11
+NATIVE_ATOMIC = sys.version_info >= (3, 11)
+# Letterali più corti non filtrano abbastanza: la regola viene sempre valutata
+MIN_LITERAL_LENGTH = 2
+# Flag di compilazione di libmodsecurity v3 (PCRE_DOTALL | PCRE_MULTILINE)
+REGEX_FLAGS = re.DOTALL | re.MULTILINE
+WHITESPACE = b" \t\n\r\f\v\xa0"
+
+
+class Unsupported(Exception):
+    """Regola che il matcher non riproduce in modo esatto."""
+
+
+# --- trasformazioni (t:...) su bytes, come in libmodsecurity ---
+
+_HEX = b"0123456789abcdefABCDEF"
+
+
+def _is_hex(value, length):
+    return len(value) == length and all(c in _HEX for c in value)
+
+
+def _url_decode(value, unicode=False):
+    out = bytearray()
+    i, n = 0, len(value)
+    while i < n:
+        c = value[i]
+        if c == 0x25 and unicode and value[i + 1:i + 2] in (b"u", b"U") and _is_hex(value[i + 2:i + 6], 4):
+            code = int(value[i + 4:i + 6], 16)
+            # ASCII a larghezza piena (%uff01 - %uff5e): come libmodsecurity aggiunge 0x20
+            if 0 < code < 0x5f and value[i + 2:i + 4].lower() == b"ff":
+                code += 0x20
+            out.append(code)
+            i += 6
+        elif c == 0x25 and _is_hex(value[i + 1:i + 3], 2):
+            out.append(int(value[i + 1:i + 3], 16))
+            i += 3
+        else:
+            out.append(0x20 if c == 0x2b else c)
+            i += 1
+    return bytes(out)
+
+
+def _utf8_to_unicode(value):
+    """Sequenze UTF-8 multibyte valide -> %uHHHH (come t:utf8toUnicode); i byte non validi restano invariati."""
+    out = bytearray()
+    i, n = 0, len(value)
+    while i < n:
+        c = value[i]
+        length = 2 if 0xc2 <= c <= 0xdf else 3 if 0xe0 <= c <= 0xef else 4 if 0xf0 <= c <= 0xf4 else 1
+        if length > 1:
+            try:
+                char = value[i:i + length].decode("utf-8")
+            except UnicodeDecodeError:
+                length = 1
+            else:
+                out += b"%%u%04x" % ord(char)
+                i += length
+                continue
+        out.append(c)
+        i += length
+    return bytes(out)
+
+
+_HTML_ENTITY = re.compile(rb"&(?:#[xX]([0-9a-fA-F]+)|#([0-9]+)|(quot|amp|lt|gt|nbsp));?")
+_NAMED_ENTITIES = {b"quot": b'"', b"amp": b"&", b"lt": b"<", b"gt": b">", b"nbsp": b"\xa0"}
+
+
+def _html_entity_decode(value):
+    def replace(match):
+        if match.group(1):
+            return bytes([int(match.group(1), 16) & 0xff])
+        if match.group(2):
+            return bytes([int(match.group(2)) & 0xff])
+        return _NAMED_ENTITIES[match.group(3).lower()]
+    return _HTML_ENTITY.sub(replace, value)
+
+
+_JS_ESCAPE = re.compile(rb"\\(?:u([0-9a-fA-F]{4})|x([0-9a-fA-F]{2})|([0-7]{1,3})|(.))", re.DOTALL)
+_JS_SIMPLE = {b"a": b"\x07", b"b": b"\x08", b"f": b"\x0c", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"v": b"\x0b"}
+
+
+def _js_decode(value):
+    def replace(match):
+        if match.group(1):
+            code = int(match.group(1)[2:], 16)
+            if 0 < code < 0x5f and match.group(1)[:2].lower() == b"ff":
+                code += 0x20
+            return bytes([code])
+        if match.group(2):
+            return bytes([int(match.group(2), 16)])
+        if match.group(3):
+            return bytes([int(match.group(3), 8) & 0xff])
+        return _JS_SIMPLE.get(match.group(4), match.group(4))
+    return _JS_ESCAPE.sub(replace, value)
+
+
+def _replace_comments(value):
+    out = re.sub(rb"/\*.*?\*/", b" ", value, flags=re.DOTALL)
+    start = out.find(b"/*")
+    return out if start < 0 else out[:start] + b" "
+
+
+def _remove_comments(value):
+    out = re.sub(rb"/\*.*?(?:\*/|$)|<!--.*?(?:-->|$)", b"", value, flags=re.DOTALL)
+    cut = min((i for i in (out.find(b"--"), out.find(b"#")) if i >= 0), default=-1)
+    return out if cut < 0 else out[:cut]
+
+
+def _remove_comments_char(value):
+    for token in (b"/*", b"*/", b"<!--", b"-->", b"--", b"#"):
+        value = value.replace(token, b"")
+    return value
+
+
+def _sql_hex_decode(value):
+    return re.sub(rb"0[xX]((?:[0-9a-fA-F]{2})+)", lambda m: bytes.fromhex(m.group(1).decode("ascii")), value)
+
+
+def _cmd_line(value):
+    value = re.sub(rb"[\\\"'^]", b"", value)
+    value = re.sub(rb"[\s,;]+", b" ", value)
+    value = re.sub(rb" (?=[/(])", b"", value)
+    return value.lower()
+
+
+def _base64_decode(value):
+    try:
+        return base64.b64decode(value + b"=" * (-len(value) % 4))
+    except ValueError:
+        return value
+
+
+def _normalize_path(value, windows=False):
+    if windows:
+        value = value.replace(b"\\", b"/")
+    parts = []
+    for part in value.split(b"/"):
+        if part == b"..":
+            if parts and parts[-1] not in (b"", b".."):
+                parts.pop()
+            continue
+        if part == b"." and parts:
+            continue
+        parts.append(part)
+    return b"/".join(parts)
+
+
+TRANSFORMATIONS = {
+    "lowercase": bytes.lower,
+    "uppercase": bytes.upper,
+    "removenulls": lambda v: v.replace(b"\x00", b""),
+    "replacenulls": lambda v: v.replace(b"\x00", b" "),
+    "removewhitespace": lambda v: bytes(c for c in v if c not in WHITESPACE),
+    "compresswhitespace": lambda v: re.sub(rb"[ \t\n\r\f\v\xa0]+", b" ", v),
+    "trim": lambda v: v.strip(WHITESPACE),
+    "trimleft": lambda v: v.lstrip(WHITESPACE),
+    "trimright": lambda v: v.rstrip(WHITESPACE),
+    "urldecode": _url_decode,
+    "urldecodeuni": lambda v: _url_decode(v, unicode=True),
+    "utf8tounicode": _utf8_to_unicode,
+    "htmlentitydecode": _html_entity_decode,
+    "jsdecode": _js_decode,
+    "replacecomments": _replace_comments,
+    "removecomments": _remove_comments,
+    "removecommentschar": _remove_comments_char,
+    "sqlhexdecode": _sql_hex_decode,
+    "cmdline": _cmd_line,
+    "base64decode": _base64_decode,
+    "base64decodeext": _base64_decode,
+    "hexdecode": lambda v: bytes.fromhex(v.decode("latin-1")) if re.fullmatch(rb"(?:[0-9a-fA-F]{2})*", v) else v,
+    "normalizepath": _normalize_path,
+    "normalisepath": _normalize_path,
+    "normalizepathwin": lambda v: _normalize_path(v, windows=True),
+    "normalisepathwin": lambda v: _normalize_path(v, windows=True),
+    "length": lambda v: str(len(v)).encode("ascii"),
+}
+
+
+def apply_transformations(value, chain):
+    for name in chain:
+        value = TRANSFORMATIONS[name](value)
+    return value
+
+
+# --- traduzione PCRE -> re (bytes) ---
+
+_POSIX_CLASSES = {
+    "alpha": r"a-zA-Z", "digit": r"0-9", "alnum": r"a-zA-Z0-9", "upper": r"A-Z", "lower": r"a-z",
+    "space": r" \t\n\r\f\v", "blank": r" \t", "punct": r"!-/:-@\[-`{-~", "xdigit": r"0-9A-Fa-f",
+    "word": r"\w", "cntrl": r"\x00-\x1f\x7f", "print": r"\x20-\x7e", "graph": r"\x21-\x7e",
+}
+_PYTHON_ESCAPES = set("dDsSwWbBAZnrtfvxa")
+_QUANTIFIER = re.compile(r"\{\d*(?:,\d*)?\}")
+
+
+def translate_pcre(pattern):
+    """Sintassi PCRE -> re di Python; solleva Unsupported per i costrutti senza equivalente."""
+    out = []
+    i, n = 0, len(pattern)
+    in_class = False
+    while i < n:
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 >= n:
+                raise Unsupported("trailing backslash")
+            nxt = pattern[i + 1]
+            if nxt == "Q":
+                end = pattern.find("\\E", i + 2)
+                literal = pattern[i + 2:end if end >= 0 else n]
+                out.append("".join("\\" + ch if not ch.isalnum() else ch for ch in literal))
+                i = end + 2 if end >= 0 else n
+                continue
+            if nxt == "E":
+                i += 2
+                continue
+            if nxt == "z" and not in_class:
+                out.append(r"\Z")
+            elif nxt == "Z" and not in_class:
+                out.append(r"(?=\n?\Z)")
+            elif nxt == "h":
+                out.append(r"\t \xa0" if in_class else r"[\t \xa0]")
+            elif nxt == "H" and not in_class:
+                out.append(r"[^\t \xa0]")
+            elif nxt == "e":
+                out.append(r"\x1b")
+            elif nxt == "x" and i + 2 < n and pattern[i + 2] == "{":
+                end = pattern.find("}", i + 3)
+                code = int(pattern[i + 3:end], 16)
+                if code > 0xff:
+                    raise Unsupported(f"\\x{{{pattern[i + 3:end]}}} outside the byte range")
+                out.append(r"\x%02x" % code)
+                i = end + 1
+                continue
+            elif nxt.isalpha() and nxt not in _PYTHON_ESCAPES:
+                raise Unsupported(f"escape \\{nxt}")
+            else:
+                out.append(pattern[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if pattern.startswith("[:", i):
+                end = pattern.find(":]", i)
+                name = pattern[i + 2:end]
+                negated = name.startswith("^")
+                if negated or name not in _POSIX_CLASSES:
+                    raise Unsupported(f"POSIX class [:{name}:]")
+                out.append(_POSIX_CLASSES[name])
+                i = end + 2
+                continue
+            if c == "]":
+                in_class = False
+            elif c == "[":
+                out.append("\\")
+            out.append(c)
+            i += 1
+            continue
+        if c == "[":
+            in_class = True
+            out.append(c)
+            i += 1
+            if i < n and pattern[i] == "^":
+                out.append("^")
+                i += 1
+            if i < n and pattern[i] == "]":
+                out.append(r"\]")
+                i += 1
+            continue
+        if c == "(" and pattern.startswith("(?>", i):
+            if not NATIVE_ATOMIC:
+                raise Unsupported("atomic group (?>...) requires Python 3.11")
+            out.append("(?>")
+            i += 3
+            continue
+        if c == "(" and pattern.startswith("(?<", i) and i + 3 < n and pattern[i + 3] not in "=!":
+            out.append("(?P<")
+            i += 3
+            continue
+        if c == "(" and pattern.startswith("(?", i) and i > 0:
+            flags = re.match(r"\(\?[a-zA-Z-]+\)", pattern[i:])
+            if flags:
+                raise Unsupported("inline flags after the start of the pattern")
+        if c == "{":
+            quantifier = _QUANTIFIER.match(pattern, i)
+            if quantifier:
+                out.append(quantifier.group(0))
+                i = quantifier.end()
+                if i < n and pattern[i] == "+":
+                    if not NATIVE_ATOMIC:
+                        raise Unsupported("possessive quantifier requires Python 3.11")
+                    out.append("+")
+                    i += 1
+                continue
+        if c in "*+?" and i + 1 < n and pattern[i + 1] == "+" and out and out[-1] not in ("(", "|"):
+            # Quantificatore possessivo: non restituisce caratteri, quindi non equivale a quello greedy
+            if not NATIVE_ATOMIC:
+                raise Unsupported("possessive quantifier requires Python 3.11")
+            out.append(c + "+")
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def compile_regex(pattern):
+    translated = translate_pcre(pattern)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            return re.compile(translated.encode("utf-8"), REGEX_FLAGS)
+        except (re.error, DeprecationWarning, FutureWarning) as e:
+            raise Unsupported(f"regex: {e}")
+
+
+# --- letterali necessari (pre-filtro) ---
+
+def _better(a, b):
+    """Insieme di letterali più selettivo tra a e b (lunghezza minima maggiore, poi meno alternative)."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    key_a = (min(map(len, a)), -len(a))
+    key_b = (min(map(len, b)), -len(b))
+    return a if key_a >= key_b else b
+
+
+def _required(items):
+    """Letterali (minuscoli) di cui almeno uno compare in ogni match della sequenza, o None."""
+    best = None
+    run = bytearray()
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(av)
+            continue
+        if run:
+            best = _better(best, frozenset([bytes(run).lower()]))
+            run = bytearray()
+        if op is sre_constants.SUBPATTERN:
+            best = _better(best, _required(av[-1]))
+        elif op is sre_constants.BRANCH:
+            alternatives = [_required(branch) for branch in av[1]]
+            if all(alternative is not None for alternative in alternatives):
+                best = _better(best, frozenset().union(*alternatives))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or \
+                getattr(sre_constants, "POSSESSIVE_REPEAT", None) is op:
+            if av[0] >= 1:
+                best = _better(best, _required(av[2]))
+        elif op is sre_constants.ASSERT and av[0] == 1:
+            best = _better(best, _required(av[1]))
+        elif getattr(sre_constants, "ATOMIC_GROUP", None) is op:
+            best = _better(best, _required(av))
+    if run:
+        best = _better(best, frozenset([bytes(run).lower()]))
+    return best
+
+
+def required_literals(regex):
+    literals = _required(sre_parse.parse(regex.pattern, regex.flags))
+    if literals is None or min(map(len, literals)) < MIN_LITERAL_LENGTH:
+        return None
+    return literals
+
+
+# --- variabili della richiesta ---
+
+# Collezioni vuote nella transazione del motore di riferimento (una GET con il payload in query string)
+EMPTY_COLLECTIONS = {"REQUEST_COOKIES", "REQUEST_COOKIES_NAMES", "REQUEST_HEADERS", "REQUEST_HEADERS_NAMES",
+                     "REQUEST_BODY", "XML", "FILES", "FILES_NAMES", "ARGS_POST", "ARGS_POST_NAMES"}
+MATCHED_COLLECTIONS = {"MATCHED_VAR", "MATCHED_VARS", "MATCHED_VAR_NAME", "MATCHED_VARS_NAMES"}
+TX_VARIABLES = ("detection_paranoia_level", "executing_paranoia_level")
+
+
+def request_collections(payload, param="q", path="/", pl=4):
+    """Collezioni ModSecurity di una GET `path?param=<payload url-encoded>`: {nome: [(chiave, valore)]}."""
+    value = payload if isinstance(payload, bytes) else payload.encode("utf-8", errors="surrogateescape")
+    name = param.encode("utf-8")
+    query = name + b"=" + quote_from_bytes(value, safe=b"").encode("ascii")
+    uri = path.encode("utf-8") + b"?" + query
+    return {
+        "ARGS": [(param, value)],
+        "ARGS_GET": [(param, value)],
+        "ARGS_NAMES": [(param, name)],
+        "ARGS_GET_NAMES": [(param, name)],
+        "QUERY_STRING": [("QUERY_STRING", query)],
+        "REQUEST_URI": [("REQUEST_URI", uri)],
+        "REQUEST_URI_RAW": [("REQUEST_URI_RAW", uri)],
+        "REQUEST_LINE": [("REQUEST_LINE", b"GET " + uri + b" HTTP/1.1")],
+        "REQUEST_FILENAME": [("REQUEST_FILENAME", path.encode("utf-8"))],
+        "REQUEST_BASENAME": [("REQUEST_BASENAME", path.rsplit("/", 1)[-1].encode("utf-8"))],
+        "REQUEST_METHOD": [("REQUEST_METHOD", b"GET")],
+        "REQUEST_PROTOCOL": [("REQUEST_PROTOCOL", b"HTTP/1.1")],
+        # Solo le variabili TX lette dalle regole di controllo del paranoia level
+        "TX": [(name, str(pl).encode("ascii")) for name in TX_VARIABLES],
+    }
+
+
+def _parse_variables(variables):
+    """[(collezione, selettore)] incluse ed escluse; il selettore è None, un nome o una regex compilata."""
+    included, excluded = [], []
+    for token in variables:
+        if token.startswith("&"):
+            raise Unsupported(f"variable count {token}")
+        target = excluded if token.startswith("!") else included
+        collection, _, selector = token.lstrip("!").partition(":")
+        collection = collection.upper()
+        if collection not in EMPTY_COLLECTIONS and collection not in MATCHED_COLLECTIONS and \
+                collection not in request_collections(""):
+            raise Unsupported(f"variable {collection}")
+        if collection == "TX" and selector.lower() not in TX_VARIABLES:
+            raise Unsupported(f"variable {token.lstrip('!')}")
+        if selector.startswith("/") and selector.endswith("/") and len(selector) > 1:
+            selector = re.compile(selector[1:-1], re.IGNORECASE)
+        elif selector:
+            selector = selector.lower()
+        else:
+            selector = None
+        target.append((collection, selector))
+    return included, excluded
+
+
+def _selected(key, selector):
+    if selector is None:
+        return True
+    if isinstance(selector, str):
+        return key.lower() == selector
+    return selector.search(key) is not None
+
+
+# --- operatori ---
+
+def _number(value):
+    match = re.match(rb"\s*[-+]?\d+", value)
+    return int(match.group(0)) if match else 0
+
+
+def _detect_sqli():
+    try:
+        import libinjection
+    except ImportError:
+        raise Unsupported("@detectSQLi requires the libinjection Python bindings")
+    return lambda value: bool(libinjection.is_sql_injection(value.decode("latin-1"))["is_sqli"])
+
+
+def _compile_operator(name, argument, rules_dir):
+    """(funzione valore -> bool, letterali necessari o None)."""
+    name = name.lower()
+    if "%{" in argument:
+        raise Unsupported("macro expansion in the operator argument")
+    if name == "rx":
+        regex = compile_regex(argument)
+        return (lambda value: regex.search(value) is not None), required_literals(regex)
+    if name in ("pm", "pmfromfile", "pmf"):
+        if name == "pm":
+            phrases = argument.split()
+        else:
+            phrases = []
+            for file_name in argument.split():
+                try:
+                    with open(os.path.join(rules_dir, file_name), encoding="utf-8", errors="replace") as f:
+                        phrases += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+                except OSError:
+                    raise Unsupported(f"@{name} file {file_name} not found")
+        phrases = frozenset(phrase.encode("utf-8").lower() for phrase in phrases)
+        literals = phrases if phrases and min(map(len, phrases)) >= MIN_LITERAL_LENGTH else None
+        return (lambda value: any(phrase in value.lower() for phrase in phrases)), literals
+    if name == "detectsqli":
+        return _detect_sqli(), None
+    encoded = argument.encode("utf-8")
+    simple = {
+        "contains": (lambda value: encoded in value, frozenset([encoded.lower()]) if len(encoded) >= 2 else None),
+        "streq": (lambda value: value == encoded, None),
+        "beginswith": (lambda value: value.startswith(encoded), None),
+        "endswith": (lambda value: value.endswith(encoded), None),
+        "within": (lambda value: value in encoded, None),
+        "eq": (lambda value: _number(value) == _number(encoded), None),
+        "ne": (lambda value: _number(value) != _number(encoded), None),
+        "lt": (lambda value: _number(value) < _number(encoded), None),
+        "le": (lambda value: _number(value) <= _number(encoded), None),
+        "gt": (lambda value: _number(value) > _number(encoded), None),
+        "ge": (lambda value: _number(value) >= _number(encoded), None),
+        "unconditionalmatch": (lambda value: True, None),
+        "nomatch": (lambda value: False, None),
+    }
+    if name not in simple:
+        raise Unsupported(f"operator @{name}")
+    return simple[name]
+
+
+class _Condition:
+    """Una condizione (regola o elemento della chain): variabili, trasformazioni e operatore compilati."""
+
+    def __init__(self, condition, rules_dir):
+        self.rules_dir = rules_dir
+        self.variables = condition["variables"]
+        self.included, self.excluded = _parse_variables(condition["variables"])
+        self.transformations = tuple(name.lower() for name in condition["transformations"])
+        for name in self.transformations:
+            if name not in TRANSFORMATIONS:
+                raise Unsupported(f"transformation t:{name}")
+        self.operator = condition["operator"]
+        self.argument = condition["argument"]
+        self.negated = condition["negated"]
+        self.test, literals = _compile_operator(condition["operator"], condition["argument"], rules_dir)
+        # Con l'operatore negato l'assenza del letterale non esclude il match
+        self.literals = None if self.negated else literals
+
+    def __getstate__(self):
+        # Le funzioni degli operatori sono ricostruite al caricamento, il resto viene riusato
+        state = dict(self.__dict__)
+        del state["test"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.test, _ = _compile_operator(self.operator, self.argument, self.rules_dir)
+
+    def targets(self, collections, matched):
+        values = []
+        for collection, selector in self.included:
+            if collection in MATCHED_COLLECTIONS:
+                # MATCHED_VAR(_NAME): l'ultima variabile della condizione precedente, MATCHED_VARS(_NAMES): tutte
+                use_names = "NAME" in collection
+                entries = [(key, key.encode("utf-8") if use_names else value) for key, value in matched]
+                if not collection.startswith("MATCHED_VARS"):
+                    entries = entries[-1:]
+            else:
+                entries = collections.get(collection, ())
+            for key, value in entries:
+                if not _selected(key, selector):
+                    continue
+                if any(excluded == collection and _selected(key, excluded_selector)
+                       for excluded, excluded_selector in self.excluded):
+                    continue
+                values.append((collection, key, value))
+        return values
+
+    def evaluate(self, collections, matched, transformed):
+        """Variabili per cui la condizione è vera; `transformed` memorizza i valori già trasformati."""
+        hits = []
+        for collection, key, value in self.targets(collections, matched):
+            cache_key = (collection, key, self.transformations)
+            result = transformed.get(cache_key)
+            if result is None:
+                result = transformed[cache_key] = apply_transformations(value, self.transformations)
+            if self.test(result) != self.negated:
+                hits.append((key, value))
+        return hits
+
+
+class _Rule:
+    def __init__(self, rule, rules_dir):
+        if rule.get("multi_match"):
+            raise Unsupported("multiMatch")
+        self.id = rule["id"]
+        self.paranoia_level = rule["paranoia_level"]
+        self.conditions = [_Condition(rule, rules_dir)] + [_Condition(c, rules_dir) for c in rule["chain"]]
+        self.literals = self.conditions[0].literals
+
+
+class CrsMatcher:
+    """Regole SQLi del CRS compilate, con pre-filtro a letterali per catena di trasformazioni."""
+
+    def __init__(self, rules, rule_ids, pl=4, rules_dir="", param="q", path="/", identity=None):
+        self.pl = pl
+        self.param = param
+        self.path = path
+        self.identity = identity
+        self.rule_ids = [str(rule_id) for rule_id in rule_ids]
+        # Verifica di parità con il motore di riferimento (benchmark_crs_matcher.py): {"payloads", "mismatches"}
+        self.parity = None
+        self.unsupported = {}
+        self.rules = []
+        for rule_id in self.rule_ids:
+            rule = rules.get(rule_id)
+            if rule is None:
+                self.unsupported[rule_id] = "rule not found in the CRS files"
+                continue
+            if rule["paranoia_level"] is not None and rule["paranoia_level"] > pl:
+                continue
+            try:
+                self.rules.append(_Rule(rule, rules_dir))
+            except Unsupported as e:
+                self.unsupported[rule_id] = str(e)
+        self._build_groups()
+
+    def _build_groups(self):
+        # Gruppi del pre-filtro: regole con la stessa catena di trasformazioni e le stesse variabili
+        groups = {}
+        for index, rule in enumerate(self.rules):
+            first = rule.conditions[0]
+            key = (first.transformations, tuple(first.variables))
+            group = groups.setdefault(key, {"condition": first, "literals": set(), "filtered": [], "always": []})
+            if rule.literals is None:
+                group["always"].append(index)
+            else:
+                group["literals"].update(rule.literals)
+                group["filtered"].append(index)
+        self.groups = list(groups.values())
+
+    @property
+    def exact(self):
+        return not self.unsupported
+
+    @property
+    def verified(self):
+        """Exact e con una verifica di parità senza differenze sugli insiemi di test."""
+        return self.exact and self.parity is not None and self.parity["mismatches"] == 0 and self.parity["payloads"] > 0
+
+    def _candidates(self, collections, transformed):
+        candidates = []
+        for group in self.groups:
+            candidates += group["always"]
+            if not group["filtered"]:
+                continue
+            condition = group["condition"]
+            texts = []
+            for collection, key, value in condition.targets(collections, []):
+                cache_key = (collection, key, condition.transformations)
+                result = transformed.get(cache_key)
+                if result is None:
+                    result = transformed[cache_key] = apply_transformations(value, condition.transformations)
+                texts.append(result.lower())
+            if not texts:
+                continue
+            found = {literal for literal in group["literals"] if any(literal in text for text in texts)}
+            if found:
+                candidates += [index for index in group["filtered"] if not found.isdisjoint(self.rules[index].literals)]
+        return sorted(candidates)
+
+    def _evaluate(self, rule, collections, transformed):
+        matched = []
+        for condition in rule.conditions:
+            hits = condition.evaluate(collections, matched, transformed)
+            if not hits:
+                return False
+            matched = hits
+        return True
+
+    def match(self, payload, profile=None):
+        """Id delle regole attivate dal payload (in ordine di regola)."""
+        collections = request_collections(payload, self.param, self.path, self.pl)
+        transformed = {}
+        candidates = self._candidates(collections, transformed)
+        hits = []
+        for index in candidates:
+            rule = self.rules[index]
+            if profile is None:
+                if self._evaluate(rule, collections, transformed):
+                    hits.append(rule.id)
+                continue
+            start = time.perf_counter()
+            hit = self._evaluate(rule, collections, transformed)
+            entry = profile[rule.id]
+            entry["evaluations"] += 1
+            entry["seconds"] += time.perf_counter() - start
+            if hit:
+                entry["hits"] += 1
+                hits.append(rule.id)
+        return hits
+
+    def match_batch(self, payloads):
+        return [self.match(payload) for payload in payloads]
+
+    def profile(self, payloads):
+        """Costo per regola su `payloads`, dalla più costosa: valutazioni, saltate dal pre-filtro, hit, tempo."""
+        profile = {rule.id: {"rule": rule.id, "paranoia_level": rule.paranoia_level, "evaluations": 0, "hits": 0,
+                             "seconds": 0.0} for rule in self.rules}
+        n = 0
+        for payload in payloads:
+            self.match(payload, profile)
+            n += 1
+        for entry in profile.values():
+            entry["skipped"] = n - entry["evaluations"]
+            entry["us_per_evaluation"] = entry["seconds"] / entry["evaluations"] * 1e6 if entry["evaluations"] else 0.0
+        return sorted(profile.values(), key=lambda entry: -entry["seconds"])
+
+    def describe(self):
+        return {"rules": len(self.rules), "unsupported": len(self.unsupported), "groups": len(self.groups),
+                "always_evaluated": sum(len(group["always"]) for group in self.groups), "pl": self.pl,
+                "param": self.param}
+
+    def save(self, path):
+        dump_private(path, {"version": MATCHER_VERSION, "matcher": self})
+
+
+def _identity(crs_path, crs_ids_path, pl, param, path):
+    # La traduzione delle regex dipende dalla versione di Python (gruppi atomici, possessivi)
+    return (file_identity(crs_path), file_identity(crs_ids_path), pl, param, path, sys.version_info[:2])
+
+
+def build(crs_path, crs_ids_path, pl=4, param="q", path="/", cache_path=None):
+    """Compila le regole SQLi (id in crs_ids_path) del CRS in crs_path fino al paranoia level `pl`."""
+    with open(crs_ids_path) as f:
+        rule_ids = json.load(f)["rules_ids"]
+    rules = crs_rules.load_rules(crs_path, cache_path)
+    return CrsMatcher(rules, rule_ids, pl=pl, rules_dir=crs_path, param=param, path=path,
+                      identity=_identity(crs_path, crs_ids_path, pl, param, path))
+
+
+def load_or_build(crs_path, crs_ids_path, pl=4, path=None, param="q", request_path="/"):
+    """Matcher salvato in `path` se il ruleset non è cambiato, altrimenti lo compila e lo salva."""
+    identity = _identity(crs_path, crs_ids_path, pl, param, request_path)
+    if path:
+        try:
+            check_private_file(path)
+        except PermissionError as e:
+            # Non si carica (pickle) né si sovrascrive un file che altri utenti possono modificare
+            print(f"⚠️ CRS matcher file not used: {e}")
+            path = None
+    if path and os.path.isfile(path):
+        try:
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+            if saved.get("version") == MATCHER_VERSION and saved["matcher"].identity == identity:
+                return saved["matcher"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, Unsupported):
+            pass
+    matcher = build(crs_path, crs_ids_path, pl=pl, param=param, path=request_path)
+    if path:
+        matcher.save(path)
+    return matcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the precompiled CRS SQLi matcher")
+    parser.add_argument("--crs-path", required=True)
+    parser.add_argument("--ids", required=True, help="crs_sqli_ids JSON file")
+    parser.add_argument("--pl", type=int, default=4)
+    parser.add_argument("--param", default="q", help="query parameter carrying the payload")
+    parser.add_argument("--output", default=None, help="where to save the compiled matcher")
+    parser.add_argument("--payload", action="append", default=[], help="print the rules hit by a payload")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matcher = load_or_build(args.crs_path, args.ids, pl=args.pl, path=args.output, param=args.param)
+    print(f"🧩 {json.dumps(matcher.describe())} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for rule_id, reason in sorted(matcher.unsupported.items()):
+        print(f"   ⚠️ {rule_id}: {reason}")
+    for payload in args.payload:
+        print(f"🔹 {payload!r}: {matcher.match(payload)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Parsing dei file .conf del Core Rule Set.
+
+Estrae per ogni regola con id i metadati che servono al percorso di decisione
+(file, fase, paranoia level, punteggio di anomalia, variabili, operatore,
+trasformazioni). Il parsing viene salvato su disco (pickle) insieme
+all'identità dei file del CRS, così gli avvii successivi lo saltano finché
+il ruleset non cambia. Il pickle viene letto solo se file e cartella sono
+privati dell'utente effettivo (private_files.py): un file in una cartella
+condivisa come /tmp potrebbe eseguire codice arbitrario quando viene caricato.
+
+    rules = load_rules("./coreruleset/rules/", cache_path=f"{private_files.DEFAULT_CACHE_DIR}/crs_rules.pkl")
+    rules["942100"]["paranoia_level"]
+"""
+
+import glob
+import os
+import pickle
+import re
+
+from private_files import check_private_file, dump_private
+from verdict_cache import file_identity
+
+CACHE_VERSION = 2
+
+# Punteggi di anomalia del CRS (tx.*_anomaly_score)
+SEVERITY_SCORES = {"critical": 5, "error": 4, "warning": 3, "notice": 2}
+
+_PL_SETVAR = re.compile(r"tx\.inbound_anomaly_score_pl(\d)\s*=\s*\+%\{tx\.(\w+?)_anomaly_score\}", re.IGNORECASE)
+_PL_TAG = re.compile(r"paranoia-level/(\d)")
+
+
+def _logical_lines(text):
+    """Unisce le righe continuate con '\\' e scarta i commenti."""
+    buffer = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not buffer and (not stripped or stripped.startswith("#")):
+            continue
+        if stripped.endswith("\\"):
+            buffer.append(stripped[:-1])
+            continue
+        buffer.append(stripped)
+        yield " ".join(buffer)
+        buffer = []
+    if buffer:
+        yield " ".join(buffer)
+
+
+def _tokenize(line):
+    """Divide una direttiva in token, rispettando le stringhe tra doppi apici."""
+    tokens = []
+    i, n = 0, len(line)
+    while i < n:
+        if line[i].isspace():
+            i += 1
+            continue
+        if line[i] == '"':
+            i += 1
+            token = []
+            while i < n and line[i] != '"':
+                if line[i] == "\\" and i + 1 < n and line[i + 1] == '"':
+                    token.append('"')
+                    i += 2
+                    continue
+                token.append(line[i])
+                i += 1
+            tokens.append("".join(token))
+            i += 1
+        else:
+            start = i
+            while i < n and not line[i].isspace():
+                i += 1
+            tokens.append(line[start:i])
+    return tokens
+
+
+def _split_actions(actions):
+    """Divide la lista di azioni sulle virgole non racchiuse tra apici singoli."""
+    parts, current, quoted = [], [], False
+    i = 0
+    while i < len(actions):
+        c = actions[i]
+        if c == "\\" and i + 1 < len(actions):
+            current.append(actions[i:i + 2])
+            i += 2
+            continue
+        if c == "'":
+            quoted = not quoted
+        if c == "," and not quoted:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(c)
+        i += 1
+    if current:
+        parts.append("".join(current).strip())
+    return [p for p in parts if p]
+
+
+def _parse_actions(actions):
+    parsed = []
+    for action in _split_actions(actions):
+        name, _, value = action.partition(":")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == "'" and value[-1] == "'":
+            value = value[1:-1]
+        parsed.append((name.strip().lower(), value))
+    return parsed
+
+
+def _parse_operator(operator):
+    negated = operator.startswith("!")
+    if negated:
+        operator = operator[1:]
+    if operator.startswith("@"):
+        name, _, argument = operator[1:].partition(" ")
+    else:
+        # Senza operatore esplicito ModSecurity usa @rx
+        name, argument = "rx", operator
+    return name, argument, negated
+
+
+def parse_rules_file(path):
+    """Restituisce i metadati delle regole di un file .conf (le regole in chain sono annidate)."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+
+    rules = {}
+    parent = None
+    for line in _logical_lines(text):
+        tokens = _tokenize(line)
+        if not tokens or tokens[0] != "SecRule" or len(tokens) < 3:
+            continue
+        operator, argument, negated = _parse_operator(tokens[2])
+        actions = _parse_actions(tokens[3]) if len(tokens) > 3 else []
+        action_names = [name for name, _ in actions]
+        condition = {
+            "variables": tokens[1].split("|"),
+            "operator": operator,
+            "argument": argument,
+            "negated": negated,
+            "transformations": [value for name, value in actions if name == "t" and value != "none"],
+        }
+
+        if parent is not None:
+            # Regola in chain: condizione aggiuntiva della regola precedente
+            parent["chain"].append(condition)
+            if "chain" not in action_names:
+                parent = None
+            continue
+
+        values = dict(actions)
+        rule_id = values.get("id")
+        if rule_id is None:
+            continue
+
+        paranoia_level, score = None, 0
+        for name, value in actions:
+            if name == "setvar":
+                match = _PL_SETVAR.search(value)
+                if match:
+                    paranoia_level = int(match.group(1))
+                    score = SEVERITY_SCORES.get(match.group(2).lower(), 0)
+            elif name == "tag" and paranoia_level is None:
+                match = _PL_TAG.search(value)
+                if match:
+                    paranoia_level = int(match.group(1))
+
+        rule = dict(condition)
+        rule.update({
+            "id": rule_id,
+            "file": os.path.basename(path),
+            "phase": int(values.get("phase", "2")) if values.get("phase", "2").isdigit() else values.get("phase"),
+            "paranoia_level": paranoia_level,
+            "anomaly_score": score,
+            "severity": values.get("severity", "").lower(),
+            "capture": "capture" in action_names,
+            "multi_match": "multimatch" in action_names,
+            "chain": [],
+        })
+        rules[rule_id] = rule
+        parent = rule if "chain" in action_names else None
+    return rules
+
+
+def parse_rules_dir(crs_path):
+    rules = {}
+    for path in sorted(glob.glob(os.path.join(crs_path, "*.conf"))):
+        rules.update(parse_rules_file(path))
+    return rules
+
+
+def load_rules(crs_path, cache_path=None):
+    """Metadati delle regole del CRS, letti dalla cache su disco se il ruleset non è cambiato."""
+    identity = file_identity(crs_path)
+    if cache_path:
+        try:
+            check_private_file(cache_path)
+        except PermissionError as e:
+            print(f"⚠️ CRS rules cache not used: {e}")
+            cache_path = None
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") == CACHE_VERSION and cached.get("identity") == identity:
+                return cached["rules"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    rules = parse_rules_dir(crs_path)
+    if cache_path:
+        dump_private(cache_path, {"version": CACHE_VERSION, "identity": identity, "rules": rules})
+    return rules
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3.9
+"""
+Client leggero per decision_daemon.py.
+
+Usa solo la libreria standard, quindi si avvia in pochi millisecondi al posto
+di decision_script.py. Stampa solo la decisione combinata ("Blocked"/"Allowed"),
+oppure "Error" se il demone non risponde.
+
+    decision_client.py "<payload>"
+    printf '%s' "$PAYLOAD" | decision_client.py -      (payload da stdin, non copiato in argv)
+    decision_client.py --json "<payload>"
+    decision_client.py --stats
+    decision_client.py --metrics
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.environ.get("MODSEC_DECISION_SOCKET", "/tmp/modsec_decision.sock")
+DEFAULT_TIMEOUT = 5.0
+
+
+def query(request, socket_path=DEFAULT_SOCKET, timeout=DEFAULT_TIMEOUT):
+    """Invia una richiesta JSON al demone e restituisce la risposta."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client for the ModSecurity+ML decision daemon")
+    parser.add_argument("payload", nargs="?", default=None, help='payload, or "-" to read it from stdin')
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--json", action="store_true", help="print the full daemon response")
+    parser.add_argument("--stats", action="store_true", help="print warm latency statistics")
+    parser.add_argument("--metrics", action="store_true", help="print stage timings and counters (Prometheus text)")
+    args = parser.parse_args()
+
+    try:
+        if args.stats:
+            print(json.dumps(query({"cmd": "stats"}, args.socket, args.timeout)))
+            return 0
+        if args.metrics:
+            sys.stdout.write(query({"cmd": "metrics"}, args.socket, args.timeout)["metrics"])
+            return 0
+        if args.payload is None:
+            print("Error")
+            return 2
+        if args.payload == "-":
+            args.payload = sys.stdin.buffer.read().decode("utf-8", errors="surrogateescape")
+        response = query({"payload": args.payload}, args.socket, args.timeout)
+    except (OSError, ValueError) as e:
+        print("Error")
+        print(f"Decision daemon unavailable: {e}", file=sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(response))
+    else:
+        print(response.get("combined_decision", "Error"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3.9
+"""
+Servizio di decisione persistente.
+
+Carica una sola volta il modello, l'estrattore di feature e ModSecurity
+(importando decision_script) e risponde alle richieste di combined_decision
+su un socket Unix. Il protocollo è a righe JSON:
+
+    -> {"payload": "..."}
+    <- {"waf_decision": "...", "ml_decision": "...", "combined_decision": "...", "latency_ms": 1.23}
+
+    -> {"payloads": ["...", "..."]}
+    <- {"results": [{...}, {...}], "latency_ms": 4.56}
+
+    -> {"cmd": "stats"}
+    <- {"requests": N, "mean_ms": ..., "p50_ms": ..., "p95_ms": ..., "p99_ms": ..., "max_ms": ..., "cache": {...}}
+
+    -> {"cmd": "metrics"}
+    <- {"metrics": "<testo in formato Prometheus>"}
+
+Avvio:
+    python3.9 /etc/modsecurity/decision_daemon.py [--socket /tmp/modsec_decision.sock]
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SOCKET = os.environ.get("MODSEC_DECISION_SOCKET", "/tmp/modsec_decision.sock")
+
+# Numero di latenze recenti usate per i percentili
+LATENCY_WINDOW = 10000
+# Dimensione massima di una richiesta JSON (un payload da 128 KB con escape \uXXXX resta sotto)
+MAX_REQUEST_BYTES = 4 * 1024 * 1024
+
+
+class LatencyStats:
+    """Tiene traccia delle latenze a caldo delle ultime richieste."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = collections.deque(maxlen=window)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms):
+        with self._lock:
+            self._samples.append(latency_ms)
+            self._count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self._count
+        if not samples:
+            return {"requests": count}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+        return {
+            "requests": count,
+            "mean_ms": round(sum(samples) / len(samples), 3),
+            "p50_ms": round(percentile(50), 3),
+            "p95_ms": round(percentile(95), 3),
+            "p99_ms": round(percentile(99), 3),
+            "max_ms": round(samples[-1], 3),
+        }
+
+
+class DecisionHandler(socketserver.StreamRequestHandler):
+    """Gestisce una connessione: una richiesta JSON per riga."""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+            if not line:
+                break
+            if len(line) > MAX_REQUEST_BYTES:
+                # Richiesta troppo grande: la connessione viene chiusa senza leggere il resto
+                self.wfile.write(json.dumps({"error": "request too large"}).encode("utf-8") + b"\n")
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(request)
+            except Exception as e:
+                logging.exception("Decision daemon error")
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class DecisionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, decide, decide_batch, extra_stats=None, render_metrics=None):
+        self.decide = decide
+        self.decide_batch = decide_batch
+        self.extra_stats = extra_stats
+        self.render_metrics = render_metrics
+        self.stats = LatencyStats()
+        # Il modello e l'estrattore condividono lo stato di ModSecurity: una decisione alla volta
+        self._decision_lock = threading.Lock()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, DecisionHandler)
+        # Apache (www-data) deve poter scrivere sul socket
+        os.chmod(socket_path, 0o666)
+
+    def dispatch(self, request):
+        if request.get("cmd") == "stats":
+            summary = self.stats.summary()
+            if self.extra_stats is not None:
+                summary.update(self.extra_stats())
+            return summary
+        if request.get("cmd") == "metrics":
+            return {"metrics": self.render_metrics() if self.render_metrics is not None else ""}
+        if request.get("cmd") == "ping":
+            return {"status": "ok"}
+
+        if "payloads" in request:
+            with self._decision_lock:
+                start = time.perf_counter()
+                results = self.decide_batch(list(request["payloads"]))
+                latency_ms = (time.perf_counter() - start) * 1000.0
+            return {"results": results, "latency_ms": round(latency_ms, 3)}
+
+        payload = request.get("payload", "")
+        with self._decision_lock:
+            start = time.perf_counter()
+            result = self.decide(payload)
+            latency_ms = (time.perf_counter() - start) * 1000.0
+        self.stats.add(latency_ms)
+        result = dict(result)
+        result["latency_ms"] = round(latency_ms, 3)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent ModSecurity+ML decision daemon")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--metrics-file", default=os.environ.get("MODSEC_METRICS_FILE"),
+                        help="write Prometheus text metrics to this file periodically (node_exporter textfile)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="seconds between metrics dumps")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # L'import carica modello, estrattore e ModSecurity una sola volta
+    import decision_script
+    load_ms = (time.perf_counter() - start) * 1000.0
+    print(f"🚀 Decision daemon ready on {args.socket} (cold start {load_ms:.0f} ms)")
+    logging.info(f"Decision daemon started on {args.socket} (cold start {load_ms:.0f} ms)")
+
+    server = DecisionServer(args.socket, decision_script.decide, decision_script.combined_decision_batch,
+                            extra_stats=lambda: {"cache": decision_script.verdict_cache.stats(),
+                                                 "decision_log": decision_script.decision_log.stats(),
+                                                 "strategy": decision_script.decision_strategy,
+                                                 "payload_policy": decision_script.payload_policy.describe(),
+                                                 "engines": decision_script.scoring.engine_stats.summary()},
+                            render_metrics=decision_script.metrics.registry.render)
+    decision_script.metrics.registry.add_collector(
+        decision_script.metrics.stats_collector("daemon_latency_ms", server.stats.summary))
+    metrics_dump = None
+    if args.metrics_file:
+        metrics_dump = decision_script.metrics.PeriodicDump(args.metrics_file, interval=args.metrics_interval)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("📊 Latency stats:", json.dumps(server.stats.summary()))
+        server.server_close()
+        decision_script.decision_log.close()
+        if metrics_dump is not None:
+            metrics_dump.stop()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
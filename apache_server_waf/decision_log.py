@@ -0,0 +1,235 @@
+"""
+Log strutturato delle decisioni (JSON lines) scritto in background.
+
+Le richieste mettono il record in una coda e tornano subito; un thread
+scrive i record a blocchi (batch_size record o flush_interval secondi) e
+ruota il file quando supera max_bytes, tenendo `backups` file .1 .. .N.
+
+Ogni record contiene l'hash SHA-256 del payload completo, la sua lunghezza e
+il payload troncato a max_payload caratteri, così il file non cresce con
+payload arbitrariamente lunghi ma resta possibile correlare richieste uguali.
+Le decisioni "Allowed" possono essere campionate (allowed_sample_rate) e,
+con la coda piena, vengono scartate e contate; le decisioni "Blocked" non
+vengono mai scartate: se la coda è piena la richiesta attende il writer.
+Se una scrittura fallisce (OSError) i record non ancora scritti vengono
+riprovati alla scrittura successiva: le Blocked sempre, le Allowed finché non
+superano max_retry (poi sono scartate e contate). Il file è scritto senza
+buffer, quindi dopo una scrittura parziale (es. ENOSPC) si sa quanti byte sono
+arrivati: i record già scritti non vengono ripetuti e di quello interrotto si
+riscrive solo il resto. I record registrati dopo close() vengono scritti
+subito dal thread chiamante, aprendo e chiudendo il file ogni volta.
+
+    decision_log = DecisionLog("/var/log/modsec_combined_decisions.jsonl", allowed_sample_rate=0.1)
+    decision_log.log(payload, {"waf_decision": ..., "ml_decision": ..., "combined_decision": ...})
+    decision_log.stats()
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+_STOP = object()
+
+
+class DecisionLog:
+    """Writer asincrono del log delle decisioni con rotazione per dimensione."""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5, max_payload=256, allowed_sample_rate=1.0,
+                 batch_size=256, flush_interval=0.5, queue_size=100000, max_retry=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_payload = max_payload
+        self.allowed_sample_rate = allowed_sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry = max_retry
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counters = {"written": 0, "sampled_out": 0, "dropped": 0, "rotations": 0, "write_errors": 0,
+                          "lost": 0}
+        self._lock = threading.Lock()
+        # Record (riga, blocked) di una scrittura fallita, riprovati alla successiva
+        self._retry = []
+        # Serializza le scritture del thread writer e quelle dopo close()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="decision-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def record(self, payload, result):
+        data = payload.encode("utf-8", errors="replace")
+        record = {
+            "ts": round(time.time(), 3),
+            "payload_sha256": hashlib.sha256(data).hexdigest(),
+            "payload_len": len(payload),
+            "payload": payload[:self.max_payload],
+            "truncated": len(payload) > self.max_payload,
+        }
+        record.update(result)
+        return record
+
+    def log(self, payload, result):
+        """Accoda una decisione; le Allowed possono essere campionate o scartate, le Blocked mai."""
+        blocked = result.get("combined_decision") == "Blocked"
+        if not blocked and self.allowed_sample_rate < 1.0 and random.random() >= self.allowed_sample_rate:
+            self._count("sampled_out")
+            return
+        item = ((json.dumps(self.record(payload, result), ensure_ascii=False) + "\n").encode("utf-8"), blocked)
+        if self._closed:
+            # Writer già fermo: scrittura sincrona invece di perdere il record, senza lasciare il file aperto
+            self._write([item], close=True)
+            return
+        if blocked:
+            self._queue.put(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._count("dropped")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._retry:
+                    self._write([])
+                continue
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+        # Record accodati mentre close() fermava il writer
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        self._write(batch)
+        with self._write_lock:
+            if self._retry:
+                self._count("lost", len(self._retry))
+                self._retry = []
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, batch, close=False):
+        """Scrive i record da riprovare e `batch`; quelli non scritti restano per la scrittura successiva."""
+        with self._write_lock:
+            batch = self._retry + list(batch)
+            self._retry = []
+            if not batch:
+                return
+            data = memoryview(b"".join(line for line, _ in batch))
+            offset = 0
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "ab", buffering=0)
+                while offset < len(data):
+                    offset += self._file.write(data[offset:])
+            except OSError:
+                remaining = self._unwritten(batch, offset)
+                self._count("written", len(batch) - len(remaining))
+                self._count("write_errors", len(remaining))
+                self._keep_for_retry(remaining)
+                return
+            self._count("written", len(batch))
+            if self.max_bytes:
+                try:
+                    if self._file.tell() >= self.max_bytes:
+                        self._rotate()
+                except OSError:
+                    # Rotazione fallita: i record sono già scritti, si riprova alla prossima scrittura
+                    self._count("write_errors")
+            if close and self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _unwritten(batch, offset):
+        """Record di `batch` oltre i primi `offset` byte scritti; di quello interrotto resta solo la coda."""
+        remaining = []
+        start = 0
+        for line, blocked in batch:
+            end = start + len(line)
+            if end > offset:
+                # La coda di un record già iniziato non viene mai scartata (come una Blocked),
+                # altrimenti nel file resterebbe una riga spezzata
+                remaining.append((line[offset - start:], True) if start < offset else (line, blocked))
+            start = end
+        return remaining
+
+    def _keep_for_retry(self, batch):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            # Riaperto alla scrittura successiva (es. file rimosso o disco di nuovo disponibile)
+            self._file = None
+        # Le Blocked restano sempre; le Allowed solo entro max_retry record in attesa
+        allowed_room = max(0, self.max_retry - sum(1 for _, blocked in batch if blocked))
+        kept = []
+        for line, blocked in batch:
+            if blocked or allowed_room > 0:
+                kept.append((line, blocked))
+                allowed_room -= not blocked
+            else:
+                self._count("dropped")
+        self._retry = kept
+
+    def _rotate(self):
+        """Come RotatingFileHandler: path -> path.1 -> ... -> path.N (il più vecchio viene rimosso)."""
+        self._file.close()
+        self._file = None
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._count("rotations")
+
+    def close(self):
+        """Scrive i record in coda e chiude il file."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters["queued"] = self._queue.qsize()
+        counters["retry_pending"] = len(self._retry)
+        return counters
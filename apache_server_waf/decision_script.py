@@ -3,48 +3,122 @@
 import sys
 import os
 
-os.environ['MPLCONFIGDIR'] = '/tmp/matplotlib'
+# Il pacchetto src.models di ModSec-AdvLearn può importare matplotlib, che con l'utente di Apache
+# non ha una home scrivibile per la sua cache; il percorso di decisione non lo usa
+os.environ.setdefault('MPLCONFIGDIR', '/tmp/matplotlib')
 
 # Aggiungi il percorso base del progetto al PYTHONPATH
 sys.path.append("/home/cris/modsecproj/modsec-advlearn")
 
 import json
 import logging
-from src.models import PyModSecurity
-from src.extractor import ModSecurityFeaturesExtractor
+import waf_engine
+import scoring
+import metrics
+from feature_service import FeatureService
+from verdict_cache import VerdictCache, config_identity, file_identity
+from decision_log import DecisionLog
+from payload_policy import PayloadPolicy
+from cascade import Cascade
+from private_files import DEFAULT_CACHE_DIR
 import joblib
-import numpy as np
-import pandas as pd
 
-# Configura il logger per scrivere nel file di audit
+# Configura il logger per i messaggi di servizio (avvio, errori)
 logging.basicConfig(filename='/var/log/modsec_combined_decisions.log', level=logging.INFO)
 
-# Carica il modello
+# Log di audit delle decisioni: JSON lines scritte in background, con rotazione, payload
+# troncati e hash; le decisioni Allowed possono essere campionate, le Blocked sono sempre scritte
+decision_log = DecisionLog(os.environ.get("MODSEC_DECISION_LOG", "/var/log/modsec_combined_decisions.jsonl"),
+                           max_bytes=int(os.environ.get("MODSEC_DECISION_LOG_MAX_BYTES", 50 * 1024 * 1024)),
+                           max_payload=int(os.environ.get("MODSEC_DECISION_LOG_MAX_PAYLOAD", 256)),
+                           allowed_sample_rate=float(os.environ.get("MODSEC_DECISION_LOG_ALLOWED_SAMPLE", 1.0)))
+
+crs_rules_dir = "/home/cris/modsecproj/modsec-advlearn/coreruleset/rules/"
+
+# Strategia di valutazione (both/waf_first/ml_first/adaptive/single_pass/cascade, vedi scoring.py);
+# "both" valuta sempre entrambi i motori per avere log di audit completi, "single_pass"
+# esegue le regole CRS una sola volta per payload per entrambi i verdetti
+decision_strategy = os.environ.get("DECISION_STRATEGY", "both")
+
+# Cascata (MODSEC_CASCADE: file di calibrazione di testing_scripts/calibrate_cascade.py): un modello
+# lineare economico decide i payload certi, solo quelli incerti passano a ModSecurity e al modello
+cascade_path = os.environ.get("MODSEC_CASCADE")
+cascade = Cascade.load(cascade_path) if cascade_path else None
+if cascade is not None:
+    decision_strategy = "cascade"
+
+# Carica il modello (MODSEC_MODEL_STORE: array mappati da file condivisi tra i processi, vedi model_store.py)
 model_path = "/home/cris/modsecproj/modsec-advlearn/data/models_wafamole/adv_inf_svm_pl4_t1.joblib"
-model = joblib.load(model_path)
+if os.environ.get("MODSEC_MODEL_STORE"):
+    from model_store import ModelStore
+
+    model = ModelStore(os.environ["MODSEC_MODEL_STORE"]).attach(model_path)
+else:
+    model = joblib.load(model_path)
 # Features Extractor
-extractor = ModSecurityFeaturesExtractor(crs_ids_path='/home/cris/modsecproj/modsec-advlearn/data/crs_sqli_ids_4.0.0.json', crs_path='/home/cris/modsecproj/modsec-advlearn/coreruleset/rules/', crs_pl=4)
+# MODSEC_CRS_MATCHER: file del matcher precompilato (crs_matcher.py) per le feature
+# MODSEC_CRS_RULES_CACHE: metadati CRS in pickle, in una directory privata dell'utente (non /tmp)
+extractor = FeatureService(crs_ids_path='/home/cris/modsecproj/modsec-advlearn/data/crs_sqli_ids_4.0.0.json', crs_path=crs_rules_dir, crs_pl=4,
+                           cache_path=os.environ.get("MODSEC_CRS_RULES_CACHE", os.path.join(DEFAULT_CACHE_DIR, "crs_rules.pkl")),
+                           matcher_path=os.environ.get("MODSEC_CRS_MATCHER"))
+# Motore ModSecurity PL1 compilato una sola volta all'avvio (non serve con la passata singola)
+if decision_strategy != "single_pass":
+    waf_engine.preload(crs_rules_dir, pl=1)
 
-# Esegui la decisione
-def combined_decision(payload):
-    # Predizione ModSecurity
-    waf = PyModSecurity(rules_dir="/home/cris/modsecproj/modsec-advlearn/coreruleset/rules/", pl=1)
-    waf_decision = "Blocked" if waf.predict(np.array([payload]))[0] > 0 else "Allowed"
+# Limite di lunghezza e pre-filtro prima dello scoring (MODSEC_MAX_PAYLOAD, MODSEC_OVERSIZE_POLICY,
+# MODSEC_SAFE_PATTERN, vedi payload_policy.py): i payload troppo lunghi non fanno scorrere
+# estrattore e regex CRS su tutto il corpo
+payload_policy = PayloadPolicy.from_env()
+# Pre-filtro (solo con MODSEC_SAFE_PATTERN): verdetto del modello sul vettore nullo calcolato una volta
+payload_policy.bind_model(model, extractor)
+
+# Cache dei verdetti (utile nel demone; shared_path permette di condividerla tra processi)
+verdict_cache = VerdictCache(max_entries=10000, ttl=3600, shared_path=os.environ.get("MODSEC_VERDICT_CACHE"))
+
+# Metriche (stadi, verdetti, cache, log): esportate dal demone ({"cmd": "metrics"}) e,
+# se MODSEC_METRICS_FILE è impostato, scritte su file in formato textfile di node_exporter
+model_name = os.path.basename(model_path)
+metrics.registry.add_collector(metrics.stats_collector("verdict_cache", verdict_cache.stats))
+metrics.registry.add_collector(metrics.stats_collector("decision_log", decision_log.stats))
+metrics.registry.add_collector(metrics.stats_collector("features", extractor.stats))
+if cascade is not None:
+    metrics.registry.add_collector(metrics.stats_collector("cascade", cascade.stats))
+metrics_file = os.environ.get("MODSEC_METRICS_FILE")
 
-    # ML Model Prediction
-    features = extractor.extract_features(pd.DataFrame([{"payload": payload}]))
-    prediction = model.predict([features[0]])[0]
-    ml_decision = "Blocked" if prediction == 1 else "Allowed"
+# Esegui la decisione su un batch di payload (una sola predict per motore)
+def combined_decision_batch(payloads):
+    with metrics.timed("decision"):
+        # Strategia diversa, verdetto diverso (es. single_pass calcola ModSecurity dalla passata PL4)
+        namespace = verdict_cache.namespace(model_path, crs_rules_dir) + config_identity(decision_strategy)
+        if cascade is not None:
+            # I verdetti dipendono anche dalle soglie calibrate e dal modello economico del primo stadio
+            namespace += file_identity(cascade_path) + file_identity(cascade.cheap_model_path)
+        # La cache vede i payload già troncati: il verdetto dipende solo da quelli
+        results = payload_policy.apply_batch(payloads, lambda scored: verdict_cache.lookup_batch(
+            namespace, scored,
+            lambda missing: scoring.combined_decision_batch(missing, model, extractor, crs_rules_dir, pl=1,
+                                                            strategy=decision_strategy, cascade=cascade)
+        ))
+    with metrics.timed("log"):
+        for payload, result in zip(payloads, results):
+            decision_log.log(payload, result)
+    for result in results:
+        for engine in ("waf", "ml", "combined"):
+            metrics.count_verdict(engine, result[f"{engine}_decision"], model=model_name)
+    return results
 
-    # Decisione combinata (OR logico)
-    combined_decision = "Blocked" if waf_decision == "Blocked" or ml_decision == "Blocked" else "Allowed"
-    logging.info(f"Payload: {payload} | ModSec: {waf_decision} | ML: {ml_decision} | Combined: {combined_decision}")
-    print(json.dumps({"waf_decision": waf_decision, "ml_decision": ml_decision, "combined_decision": combined_decision}))
-    return combined_decision
+# Esegui la decisione e restituisce i verdetti dei singoli motori
+def decide(payload):
+    return combined_decision_batch([payload])[0]
+
+def combined_decision(payload):
+    result = decide(payload)
+    print(json.dumps(result))
+    return result["combined_decision"]
 
 if __name__ == "__main__":
     print("Enter in the decision script")
-    print("Dati ricevuti dallo script:", sys.argv)
+    print("Dati ricevuti dallo script:", [arg[:256] for arg in sys.argv])
     # Legge il payload dal file temporaneo
     #with open("/tmp/modsec_payload.txt", "r") as f:
     #    payload = f.read().strip()
@@ -53,12 +127,14 @@ if __name__ == "__main__":
     #if decision:
     #    print(decision)
     #    sys.exit(0)
-    # Estrai il payload direttamente dagli argomenti
+    # Payload da stdin con "-" (non copiato in argv), altrimenti dagli argomenti
     if len(sys.argv) > 1:
-        payload = sys.argv[1]
-        print("Payload: ", payload)
+        payload = sys.stdin.read() if sys.argv[1] == "-" else sys.argv[1]
+        print("Payload: ", payload[:256])
         decision = combined_decision(payload)
         print(decision)
+        if metrics_file:
+            metrics.registry.dump(metrics_file)
     else:
         print("❌ Nessun payload trovato negli argomenti.")
     sys.exit(0)
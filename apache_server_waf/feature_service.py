@@ -0,0 +1,250 @@
+"""
+Servizio di estrazione delle feature CRS.
+
+ModSecurityFeaturesExtractor viene costruito una sola volta (e non per ogni
+payload); poiché condivide lo stato del proprio PyModSecurity non è
+thread-safe, quindi le istanze sono tenute in un pool come in waf_engine.
+Gli id delle regole SQLi e il loro indice di colonna sono caricati una volta
+(extract_features rilegge il JSON e usa list.index a ogni chiamata), e i
+metadati delle regole CRS (paranoia level, punteggi) sono salvati su disco
+da crs_rules, così gli avvii successivi non rileggono i .conf per ricavarli.
+Le regole attivate si leggono dall'API privata di PyModSecurity
+(_process_query/_get_triggered_rules) solo attraverso TriggeredRules, che
+ne verifica la presenza e la firma quando l'estrattore viene costruito.
+
+Valutazione a passata singola: le regole CRS vengono eseguite una sola volta
+per payload (al PL dell'estrattore, 4) e dalla stessa passata si ricavano
+sia le feature sia il verdetto ModSecurity a un PL inferiore, sommando il
+punteggio di anomalia delle regole attivate con paranoia level <= PL
+(metadati di crs_rules). Le feature restano sparse: per ogni payload gli
+indici delle regole attivate, convertibili in una matrice CSR.
+
+Il ruleset compilato da libmodsecurity è un oggetto nativo e non può essere
+serializzato: ModSecurityFeaturesExtractor lo ricompila (parsing dei .conf
+compreso) a ogni avvio, una volta per istanza del pool; la cache evita solo
+il parsing di crs_rules.
+Con matcher_path le sole feature (evaluate senza `pl`) vengono calcolate dal
+matcher precompilato e pre-filtrato di crs_matcher, se supporta tutte le
+regole SQLi e nel file è registrata una verifica di parità senza differenze
+(benchmark_crs_matcher.py --matcher); il verdetto ModSecurity resta all'estrattore,
+che valuta anche le regole fuori da crs_sqli_ids.
+
+    features = FeatureService(crs_ids_path, crs_path, crs_pl=4, cache_path="./data/crs_rules_cache.pkl",
+                              matcher_path="./data/crs_sqli.matcher")
+    X = features.extract_features(["payload 1", "payload 2"])
+    active, waf_scores = features.evaluate(["payload 1"], pl=1)
+    features.to_sparse(active)
+    features.stats()
+"""
+
+import inspect
+import json
+import threading
+import time
+
+import numpy as np
+
+import crs_rules
+
+
+def accepts_sparse(model):
+    """True se la predict del modello accetta direttamente una matrice CSR.
+
+    Gli stimatori sklearn lineari e ad albero la accettano; SVC addestrata su
+    dati densi (_sparse False) e i modelli non sklearn ricevono la matrice densa.
+    """
+    return type(model).__module__.startswith("sklearn.") and getattr(model, "_sparse", None) is not False
+
+
+def _arity(method):
+    try:
+        return len(inspect.signature(method).parameters)
+    except (TypeError, ValueError):
+        # Metodo nativo senza firma ispezionabile
+        return None
+
+
+class TriggeredRules:
+    """Unico accesso all'API privata di PyModSecurity: id delle regole attivate da un payload."""
+
+    # Metodi privati di PyModSecurity (modsec-advlearn) e numero di argomenti attesi
+    API = {"_process_query": 1, "_get_triggered_rules": 0}
+
+    def __init__(self, extractor):
+        pymodsec = getattr(extractor, "_pymodsec", None)
+        for name, arity in self.API.items():
+            method = getattr(pymodsec, name, None)
+            if not callable(method) or _arity(method) not in (arity, None):
+                raise RuntimeError(f"Versione di PyModSecurity non supportata: manca {name} con {arity} argomenti")
+        self._process_query = pymodsec._process_query
+        self._get_triggered_rules = pymodsec._get_triggered_rules
+
+    def __call__(self, payload):
+        self._process_query(payload)
+        return self._get_triggered_rules()
+
+
+class FeatureService:
+    """Estrazione delle feature con estrattori precaricati e tempi esposti."""
+
+    def __init__(self, crs_ids_path, crs_path, crs_pl=4, cache_path=None, matcher_path=None):
+        self.crs_ids_path = crs_ids_path
+        self.crs_path = crs_path
+        self.crs_pl = crs_pl
+        self._idle = []
+        self._lock = threading.Lock()
+        self._timings = {"requests": 0, "payloads": 0, "total_seconds": 0.0, "last_seconds": 0.0}
+
+        start = time.perf_counter()
+        with open(crs_ids_path, "r") as f:
+            self.rule_ids = json.load(f)["rules_ids"]
+        # Id delle regole sempre come stringhe (il JSON e PyModSecurity possono usare int), come in crs_rules
+        self.rule_index = {str(rule_id): i for i, rule_id in enumerate(self.rule_ids)}
+        self.rules = crs_rules.load_rules(crs_path, cache_path)
+        self._pl_scores = {}
+        self.metadata_seconds = time.perf_counter() - start
+
+        self.matcher = None
+        self.matcher_seconds = 0.0
+        if matcher_path:
+            import crs_matcher
+
+            start = time.perf_counter()
+            matcher = crs_matcher.load_or_build(crs_path, crs_ids_path, pl=crs_pl, path=matcher_path)
+            self.matcher_seconds = time.perf_counter() - start
+            # Solo un matcher con tutte le regole supportate e una verifica di parità registrata
+            if matcher.verified:
+                self.matcher = matcher
+            elif not matcher.exact:
+                print(f"⚠️ CRS matcher not used, unsupported rules: {sorted(matcher.unsupported)}")
+            else:
+                print(f"⚠️ CRS matcher not used, no parity check recorded: "
+                      f"run testing_scripts/benchmark_crs_matcher.py --matcher {matcher_path}")
+
+        start = time.perf_counter()
+        self._idle.append(self._build())
+        self.cold_start_seconds = self.metadata_seconds + time.perf_counter() - start
+
+    def _build(self):
+        from src.extractor import ModSecurityFeaturesExtractor
+
+        return TriggeredRules(ModSecurityFeaturesExtractor(crs_ids_path=self.crs_ids_path, crs_path=self.crs_path,
+                                                           crs_pl=self.crs_pl))
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._build()
+
+    def _release(self, rules):
+        with self._lock:
+            self._idle.append(rules)
+
+    @property
+    def num_features(self):
+        return len(self.rule_ids)
+
+    def triggered_rules(self, payload):
+        """Id delle regole attivate da un payload (valutazione PL dell'estrattore)."""
+        rules = self._acquire()
+        try:
+            return rules(payload)
+        finally:
+            self._release(rules)
+
+    def pl_scores(self, pl):
+        """Punteggio di anomalia delle regole che contano per il verdetto a paranoia level `pl`."""
+        scores = self._pl_scores.get(pl)
+        if scores is None:
+            scores = {
+                rule_id: rule["anomaly_score"] for rule_id, rule in self.rules.items()
+                if rule["paranoia_level"] is not None and rule["paranoia_level"] <= pl and rule["anomaly_score"]
+            }
+            self._pl_scores[pl] = scores
+        return scores
+
+    def evaluate(self, payloads, pl=None):
+        """Una sola passata del CRS per payload: indici delle regole SQLi attivate e,
+        se `pl` è indicato, punteggio di anomalia delle regole attivate con paranoia level <= pl
+        (verdetto ModSecurity: Blocked se > 0)."""
+        start = time.perf_counter()
+        if pl is None and self.matcher is not None:
+            active = [np.array(sorted(self.rule_index[rule] for rule in self.matcher.match(payload)), dtype=np.intp)
+                      for payload in payloads]
+            self._record(time.perf_counter() - start, len(payloads))
+            return active, np.zeros(len(payloads), dtype=np.int64)
+        scores = self.pl_scores(pl) if pl is not None else None
+        active = []
+        waf_scores = np.zeros(len(payloads), dtype=np.int64)
+        rules = self._acquire()
+        try:
+            for i, payload in enumerate(payloads):
+                triggered = {str(rule) for rule in rules(payload)}
+                indices = {self.rule_index[rule] for rule in triggered if rule in self.rule_index}
+                active.append(np.array(sorted(indices), dtype=np.intp))
+                if scores is not None:
+                    waf_scores[i] = sum(scores.get(rule, 0) for rule in triggered)
+        finally:
+            self._release(rules)
+        self._record(time.perf_counter() - start, len(payloads))
+        return active, waf_scores
+
+    def extract_active(self, payloads):
+        """Per ogni payload, gli indici di colonna (ordinati) delle regole SQLi attivate."""
+        return self.evaluate(payloads)[0]
+
+    def to_sparse(self, active):
+        """Matrice CSR (N, num_features) dagli indici delle regole attivate."""
+        indptr = np.zeros(len(active) + 1, dtype=np.intp)
+        indptr[1:] = np.cumsum([len(indices) for indices in active])
+        indices = np.concatenate(active) if len(active) else np.zeros(0, dtype=np.intp)
+        data = np.ones(len(indices), dtype=np.float64)
+        # scipy solo per i modelli che accettano input sparso
+        from scipy import sparse
+
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(active), self.num_features))
+
+    def to_dense(self, active):
+        X = np.zeros((len(active), self.num_features))
+        for i, indices in enumerate(active):
+            X[i, indices] = 1.0
+        return X
+
+    def features_for(self, model, active):
+        """Feature nel formato accettato dal modello: CSR se possibile, altrimenti densa."""
+        return self.to_sparse(active) if accepts_sparse(model) else self.to_dense(active)
+
+    def extract_sparse(self, payloads):
+        """Matrice CSR (N, num_features) di attivazioni delle regole."""
+        return self.to_sparse(self.extract_active(payloads))
+
+    def extract_features(self, payloads):
+        """Matrice densa (N, num_features) di attivazioni delle regole; accetta una lista o una DataFrame."""
+        if hasattr(payloads, "columns"):
+            payloads = payloads["payload"].tolist()
+        return self.to_dense(self.extract_active(payloads))
+
+    def _record(self, elapsed, count):
+        with self._lock:
+            self._timings["requests"] += 1
+            self._timings["payloads"] += count
+            self._timings["total_seconds"] += elapsed
+            self._timings["last_seconds"] = elapsed
+
+    def stats(self):
+        with self._lock:
+            timings = dict(self._timings)
+            pool_size = len(self._idle)
+        payloads = timings["payloads"]
+        return {
+            "cold_start_ms": round(self.cold_start_seconds * 1000, 3),
+            "metadata_ms": round(self.metadata_seconds * 1000, 3),
+            "matcher": self.matcher.describe() if self.matcher is not None else None,
+            "matcher_load_ms": round(self.matcher_seconds * 1000, 3),
+            "requests": timings["requests"],
+            "payloads": payloads,
+            "mean_ms_per_payload": round(timings["total_seconds"] / payloads * 1000, 3) if payloads else 0.0,
+            "last_request_ms": round(timings["last_seconds"] * 1000, 3),
+            "idle_extractors": pool_size,
+        }
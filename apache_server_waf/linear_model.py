@@ -0,0 +1,88 @@
+"""
+Percorso di inferenza veloce per i modelli lineari (LinearSVC, LogisticRegression).
+
+Le feature sono attivazioni binarie delle regole CRS, quindi lo score di un
+modello lineare è semplicemente il bias più la somma dei pesi delle regole
+che si sono attivate: non serve né la matrice densa né la predict generica
+di sklearn. Per i modelli L1 quasi tutti i pesi sono zero e la somma tocca
+poche voci.
+
+L'esportazione salva pesi, bias e classi in un file .npz compatto:
+
+    python3 linear_model.py data/models/adv_linear_svc_pl4_l1.joblib [altri .joblib ...]
+
+    model = SparseLinearModel.load("data/models/adv_linear_svc_pl4_l1.npz")
+    model.predict_active([np.array([3, 17]), np.array([], dtype=int)])
+"""
+
+import sys
+
+import numpy as np
+
+
+def is_linear(model):
+    """True per i classificatori binari con coef_ e intercept_ (LinearSVC, LogisticRegression, ...)."""
+    coef = getattr(model, "coef_", None)
+    if coef is None or not hasattr(model, "intercept_"):
+        return False
+    coef = np.asarray(coef)
+    return coef.ndim == 1 or (coef.ndim == 2 and coef.shape[0] == 1)
+
+
+class SparseLinearModel:
+    """Modello lineare binario valutato sulle sole regole attivate."""
+
+    def __init__(self, weights, bias, classes=(0, 1)):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64).ravel()
+        self.bias = float(bias)
+        self.classes_ = np.asarray(classes)
+        self.nonzero = np.flatnonzero(self.weights)
+
+    @classmethod
+    def from_model(cls, model):
+        if not is_linear(model):
+            raise ValueError(f"Il modello {type(model).__name__} non è un classificatore lineare binario")
+        classes = getattr(model, "classes_", (0, 1))
+        return cls(np.asarray(model.coef_).ravel(), np.asarray(model.intercept_).ravel()[0], classes)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["weights"], data["bias"], data["classes"])
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=np.float64(self.bias), classes=self.classes_)
+
+    def decision_function_active(self, active):
+        """Score per payload, dati gli indici di colonna delle regole attivate di ciascun payload."""
+        weights = self.weights
+        return np.array([self.bias + weights[idx].sum() for idx in active], dtype=np.float64)
+
+    def predict_active(self, active):
+        return np.where(self.decision_function_active(active) > 0, self.classes_[1], self.classes_[0])
+
+    def decision_function(self, X):
+        """Score per una matrice di feature densa o sparsa (come sklearn)."""
+        return np.asarray(X @ self.weights).ravel() + self.bias
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) > 0, self.classes_[1], self.classes_[0])
+
+
+def export(model_path, output_path=None):
+    """Esporta un modello joblib lineare in un file .npz con pesi, bias e classi."""
+    import joblib
+
+    model = SparseLinearModel.from_model(joblib.load(model_path))
+    output_path = output_path or model_path.rsplit(".", 1)[0] + ".npz"
+    model.save(output_path)
+    print(f"📦 {model_path} -> {output_path} ({len(model.nonzero)}/{len(model.weights)} non-zero weights)")
+    return output_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 linear_model.py model.joblib [model.joblib ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        export(path)
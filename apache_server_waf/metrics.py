@@ -0,0 +1,181 @@
+"""
+Metriche del percorso di decisione in formato testo Prometheus.
+
+Istogrammi della durata di ciascuno stadio (WAF, estrazione delle feature,
+predict ML, caricamento del modello, log, richiesta completa), contatori dei
+verdetti per motore/modello/dataset e valori letti al momento dell'export
+(cache dei verdetti, modelli caricati) tramite collector registrati.
+Solo libreria standard, come decision_client.
+
+    with metrics.timed("waf"):
+        ...
+    metrics.count_verdict("ml", "Blocked", model="inf_svm", dataset="modsec")
+    metrics.registry.render()                       # endpoint /metrics
+    metrics.registry.dump("/var/lib/node_exporter/modsec.prom")   # textfile per il deployment exec
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Contatori e istogrammi con etichette, esportati in formato testo Prometheus."""
+
+    def __init__(self, prefix="modsec_", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _labels_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                hist["buckets"][index] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def add_collector(self, collect):
+        """collect() restituisce [(nome, {etichette}, valore), ...] letti al momento dell'export (gauge)."""
+        self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                                 for key, h in series.items()}
+                          for name, series in self._histograms.items()}
+
+        lines = []
+
+        def header(name, kind):
+            full = self.prefix + name
+            if name in self._help:
+                lines.append(f"# HELP {full} {self._help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name in sorted(counters):
+            full = header(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{full}_total{_format_labels(key)} {value}")
+
+        for name in sorted(histograms):
+            full = header(name, "histogram")
+            for key, hist in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, hist["buckets"]):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{full}_sum{_format_labels(key)} {hist['sum']:.6f}")
+                lines.append(f"{full}_count{_format_labels(key)} {hist['count']}")
+
+        gauges = {}
+        for collect in self._collectors:
+            try:
+                for name, labels, value in collect():
+                    gauges.setdefault(name, []).append((_labels_key(labels), value))
+            except Exception:
+                # Un collector che fallisce non deve impedire l'export delle altre metriche
+                continue
+        for name in sorted(gauges):
+            full = header(name, "gauge")
+            for key, value in sorted(gauges[name]):
+                lines.append(f"{full}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Scrive l'export su file in modo atomico (textfile collector di node_exporter)."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+registry = MetricsRegistry()
+registry.describe("stage_seconds", "Duration of each stage of the combined decision")
+registry.describe("verdicts", "Verdicts per engine, model and dataset")
+registry.describe("requests", "Decision requests per route")
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Misura la durata del blocco nell'istogramma stage_seconds{stage=...}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def count_verdict(engine, verdict, **labels):
+    registry.inc("verdicts", engine=engine, verdict=verdict, **labels)
+
+
+def stats_collector(name, stats, **labels):
+    """Collector che esporta i valori numerici di un dizionario stats() come gauge name{key=...}."""
+    def collect():
+        return [(name, dict(labels, key=key), value) for key, value in stats().items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return collect
+
+
+class PeriodicDump:
+    """Riscrive l'export su file ogni `interval` secondi (per il demone usato dallo script exec)."""
+
+    def __init__(self, path, interval=15.0, metrics=None):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics or registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.metrics.dump(self.path)
+            except OSError:
+                pass
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics.dump(self.path)
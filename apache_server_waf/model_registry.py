@@ -0,0 +1,197 @@
+"""
+Registro dei modelli ML.
+
+Tiene in memoria tutti i modelli di un dizionario model_paths
+({dataset: {model: path}}), caricandoli all'avvio (preload) o al primo uso.
+Se il file joblib di un modello cambia, il modello viene ricaricato e
+sostituito in modo atomico: chi sta usando la versione precedente la completa,
+le richieste successive ricevono quella nuova, senza riavviare il server.
+
+Con mmap_mode="r" gli array numpy dei modelli (alberi RF, vettori di supporto,
+pesi) vengono mappati dal file invece che copiati in memoria (solo per file
+joblib non compressi).
+
+Con store (model_store.ModelStore) i modelli vengono convertiti una volta in
+file non compressi su /dev/shm e mappati in sola lettura: tra più processi
+worker gli array dei modelli (anche gli alberi RF) restano in memoria una
+sola volta.
+
+Con fast_linear=True i modelli lineari (LinearSVC, LogisticRegression) vengono
+convertiti in SparseLinearModel (linear_model.py); i file .npz esportati sono
+caricati direttamente.
+
+    registry = ModelRegistry(model_paths, mmap_mode="r")
+    registry.preload()
+    model = registry.get("modsec", "rf")
+    registry.stats()
+"""
+
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+
+import metrics
+from linear_model import SparseLinearModel, is_linear
+from model_store import mapped_bytes
+
+
+def current_rss():
+    """Memoria residente del processo in byte (0 se non disponibile)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def array_bytes(obj, _seen=None):
+    """Byte occupati dagli array numpy raggiungibili da un modello (stima della sua dimensione)."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(array_bytes(v, _seen) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(array_bytes(v, _seen) for v in obj)
+    if isinstance(obj, (str, bytes, int, float)):
+        return 0
+    # Gli alberi sklearn (Cython) espongono i propri array solo tramite __getstate__
+    getstate = getattr(obj, "__getstate__", None)
+    try:
+        state = getstate() if getstate is not None else getattr(obj, "__dict__", None)
+    except Exception:
+        state = getattr(obj, "__dict__", None)
+    if isinstance(state, (dict, list, tuple)):
+        return array_bytes(state, _seen)
+    return 0
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+class _Entry:
+    def __init__(self, path):
+        self.path = path
+        self.model = None
+        self.signature = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.rss_delta = 0
+        self.array_bytes = 0
+        self.mapped_bytes = 0
+
+
+class ModelRegistry:
+    """Modelli caricati una sola volta, con ricarica atomica quando il file cambia."""
+
+    def __init__(self, model_paths, mmap_mode=None, check_interval=1.0, fast_linear=False, store=None):
+        self.mmap_mode = mmap_mode
+        self.store = store
+        self.fast_linear = fast_linear
+        self.check_interval = check_interval
+        self._entries = {
+            (dataset, model): _Entry(path)
+            for dataset, models in model_paths.items()
+            for model, path in models.items()
+        }
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def preload(self):
+        """Carica subito tutti i modelli del registro."""
+        for dataset, model in self._entries:
+            self.get(dataset, model)
+
+    def get(self, dataset, model):
+        entry = self._entries.get((dataset, model))
+        if entry is None:
+            raise KeyError(f"Modello '{model}' non valido per il dataset '{dataset}'.")
+
+        now = time.monotonic()
+        if entry.model is not None and now - entry.checked_at < self.check_interval:
+            return entry.model
+
+        with entry.lock:
+            try:
+                signature = _file_signature(entry.path)
+            except OSError as e:
+                if entry.model is None:
+                    raise
+                # File rimosso o sostituito in quel momento (es. deploy non atomico): si resta sul modello caricato
+                entry.checked_at = now
+                print(f"⚠️ Cannot stat {entry.path}, keeping the loaded model: {e}")
+                return entry.model
+            entry.checked_at = now
+            if entry.model is None:
+                self._load(entry, signature)
+            elif signature != entry.signature:
+                try:
+                    self._load(entry, signature)
+                except Exception as e:
+                    # File in fase di scrittura o corrotto: si continua con il modello precedente
+                    print(f"⚠️ Reload of {entry.path} failed, keeping the previous model: {e}")
+            return entry.model
+
+    def _load(self, entry, signature):
+        rss_before = current_rss()
+        start = time.perf_counter()
+        if entry.path.endswith(".npz"):
+            model = SparseLinearModel.load(entry.path)
+        elif self.store is not None:
+            model = self.store.attach(entry.path)
+            if self.fast_linear and is_linear(model):
+                model = SparseLinearModel.from_model(model)
+        else:
+            model = joblib.load(entry.path, mmap_mode=self.mmap_mode)
+            if self.fast_linear and is_linear(model):
+                model = SparseLinearModel.from_model(model)
+        entry.load_seconds = time.perf_counter() - start
+        metrics.registry.observe("stage_seconds", entry.load_seconds, stage="model_load")
+        entry.rss_delta = max(0, current_rss() - rss_before)
+        entry.array_bytes = array_bytes(model)
+        entry.mapped_bytes = mapped_bytes(model)
+        # Sostituzione atomica: i chiamanti vedono il vecchio o il nuovo modello, mai uno parziale
+        entry.model = model
+        entry.signature = signature
+        entry.loads += 1
+        print(f"📦 Loaded {entry.path} in {entry.load_seconds * 1000:.1f} ms")
+
+    def stats(self):
+        """Tempi di caricamento e memoria di ciascun modello caricato."""
+        stats = {}
+        for (dataset, model), entry in self._entries.items():
+            stats[f"{dataset}/{model}"] = {
+                "path": entry.path,
+                "loaded": entry.model is not None,
+                "loads": entry.loads,
+                "load_ms": round(entry.load_seconds * 1000, 3),
+                "rss_delta_bytes": entry.rss_delta,
+                "array_bytes": entry.array_bytes,
+                "mapped_bytes": entry.mapped_bytes,
+            }
+        stats["process_rss_bytes"] = current_rss()
+        return stats
+
+    def collect(self):
+        """Gauge per metrics.registry.add_collector: caricamenti, tempi e memoria per modello."""
+        values = [("process_rss_bytes", {}, current_rss())]
+        for (dataset, model), entry in self._entries.items():
+            labels = {"dataset": dataset, "model": model}
+            values.append(("model_loaded", labels, int(entry.model is not None)))
+            values.append(("model_loads", labels, entry.loads))
+            values.append(("model_load_seconds", labels, round(entry.load_seconds, 6)))
+            values.append(("model_array_bytes", labels, entry.array_bytes))
+            values.append(("model_mapped_bytes", labels, entry.mapped_bytes))
+        return values
@@ -0,0 +1,266 @@
+"""
+Archivio dei modelli in file mappati in memoria, condivisi tra i processi.
+
+Con Apache prefork o più worker Flask ogni processo carica la propria copia
+dei modelli joblib. I file joblib dei modelli sono compressi, quindi
+mmap_mode non ha effetto, e gli alberi sklearn copiano comunque i nodi in
+memoria privata al caricamento (Tree.__setstate__). Questo archivio converte
+una volta ogni modello in file non compressi in una cartella, di default su
+/dev/shm (tmpfs, quindi memoria condivisa), che i processi mappano in sola
+lettura: le pagine sono in memoria una sola volta qualunque sia il numero di
+worker.
+
+    forest   RandomForest / ExtraTrees / DecisionTree: nodi di tutti gli alberi
+             appiattiti in array .npy (feature, soglia, figli, probabilità
+             delle foglie) valutati da SharedForest, con le stesse predizioni
+             di sklearn
+    joblib   tutti gli altri modelli (SVM, lineari, ...): joblib non compresso
+             caricato con mmap_mode="r", gli array (vettori di supporto, pesi)
+             restano mappati dal file
+
+La voce "joblib" è un pickle: l'archivio deve essere privato. La cartella
+viene creata con permessi 0700 (di default una per utente,
+/dev/shm/modsec_model_store-<uid>) e cartelle, voci e file non di proprietà
+dell'utente effettivo o scrivibili da gruppo/altri vengono rifiutati
+(PermissionError, private_files.check_private) prima di caricarli.
+
+Ogni voce è una cartella <nome>-<hash del percorso>-<identità del file>-v<versione>:
+quando il file del modello cambia viene creata una voce nuova (in modo
+atomico, con rename) e le vecchie vengono rimosse; i processi che le hanno
+già mappate continuano a leggerle finché non le rilasciano.
+
+    store = ModelStore("/dev/shm/modsec_model_store-1000")
+    model = store.attach("data/models/adv_rf_pl4.joblib")
+    registry = ModelRegistry(model_paths, store=store)
+
+    python3 model_store.py --store /dev/shm/modsec_model_store-1000 data/models/*.joblib
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from private_files import check_private
+from verdict_cache import file_identity
+
+STORE_VERSION = 1
+# Una cartella per utente: su /dev/shm (scrivibile da tutti) il nome non può essere occupato da un altro utente
+DEFAULT_STORE_DIR = f"/dev/shm/modsec_model_store-{os.geteuid()}"
+FOREST_TYPES = ("RandomForestClassifier", "ExtraTreesClassifier", "DecisionTreeClassifier", "ExtraTreeClassifier")
+# Righe valutate insieme da SharedForest (matrice righe x alberi di indici di nodo)
+FOREST_CHUNK = 1024
+
+
+def is_forest(model):
+    """True per i classificatori ad albero sklearn a un solo output."""
+    return type(model).__name__ in FOREST_TYPES and getattr(model, "n_outputs_", 1) == 1
+
+
+class SharedForest:
+    """Foresta sklearn appiattita in array (anche mappati da file): predict senza copie private dei nodi."""
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = int(n_features)
+
+    @staticmethod
+    def export(model):
+        """Array della foresta: nodi di tutti gli alberi concatenati, figli con indici globali."""
+        trees = [estimator.tree_ for estimator in getattr(model, "estimators_", [model])]
+        sizes = [tree.node_count for tree in trees]
+        offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+        n_classes = len(model.classes_)
+
+        value = np.concatenate([tree.value[:, 0, :n_classes] for tree in trees]).astype(np.float64)
+        # Probabilità delle foglie normalizzate come in DecisionTreeClassifier.predict_proba
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        return {
+            "feature": np.concatenate([tree.feature for tree in trees]).astype(np.int64),
+            "threshold": np.concatenate([tree.threshold for tree in trees]).astype(np.float64),
+            "left": np.concatenate([np.where(tree.children_left < 0, -1, tree.children_left + offset)
+                                    for tree, offset in zip(trees, offsets)]).astype(np.int64),
+            "right": np.concatenate([np.where(tree.children_right < 0, -1, tree.children_right + offset)
+                                     for tree, offset in zip(trees, offsets)]).astype(np.int64),
+            "value": value / normalizer,
+            "roots": offsets,
+            "classes": np.asarray(model.classes_),
+        }
+
+    def _leaves(self, X):
+        # Tutti gli alberi in parallelo: un passo per livello finché ogni riga non è su una foglia
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        while True:
+            left = self.left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                return nodes
+            # Come sklearn: feature in float32 confrontate con la soglia in float64
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.right[nodes]), nodes)
+
+    def predict_proba(self, X):
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        X = np.asarray(X, dtype=np.float32)
+        proba = np.zeros((len(X), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(X), FOREST_CHUNK):
+            leaves = self._leaves(X[start:start + FOREST_CHUNK])
+            chunk = proba[start:start + FOREST_CHUNK]
+            # Somma albero per albero, nello stesso ordine di RandomForestClassifier.predict_proba
+            for t in range(leaves.shape[1]):
+                chunk += self.value[leaves[:, t]]
+        return proba / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def predict_active(self, active):
+        """Predizioni dagli indici delle regole attivate di ciascun payload (feature binarie)."""
+        X = np.zeros((len(active), self.n_features_in_), dtype=np.float32)
+        for i, indices in enumerate(active):
+            X[i, indices] = 1.0
+        return self.predict(X)
+
+
+def mapped_bytes(model):
+    """Byte degli array del modello mappati da file (condivisi tra i processi)."""
+    if isinstance(model, SharedForest):
+        arrays = [model.feature, model.threshold, model.left, model.right, model.value, model.roots]
+    else:
+        arrays = [value for value in getattr(model, "__dict__", {}).values() if isinstance(value, np.ndarray)]
+    return sum(array.nbytes for array in arrays if isinstance(array, np.memmap))
+
+
+class ModelStore:
+    """Modelli convertiti una volta in file non compressi e mappati in sola lettura da ogni processo."""
+
+    def __init__(self, path=DEFAULT_STORE_DIR):
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        check_private(path)
+
+    def _prefix(self, source):
+        source = os.path.abspath(source)
+        digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:8]
+        return f"{os.path.basename(source).rsplit('.', 1)[0]}-{digest}"
+
+    def entry_path(self, source):
+        return os.path.join(self.path, f"{self._prefix(source)}-{file_identity(source)}-v{STORE_VERSION}")
+
+    def _check_entry(self, directory):
+        """Cartella della voce e tutti i suoi file privati dell'utente effettivo (prima di caricarli)."""
+        check_private(directory)
+        for name in os.listdir(directory):
+            check_private(os.path.join(directory, name))
+
+    def _read_meta(self, directory):
+        if not os.path.isdir(directory):
+            return None
+        self._check_entry(directory)
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("version") == STORE_VERSION else None
+
+    def build(self, source):
+        """Converte il modello `source` nella voce dell'archivio (se non è già aggiornata)."""
+        directory = self.entry_path(source)
+        meta = self._read_meta(directory)
+        if meta is not None:
+            return directory, meta
+        import joblib
+
+        start = time.perf_counter()
+        model = joblib.load(source)
+        tmp_directory = f"{directory}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory, mode=0o700)
+        if is_forest(model):
+            arrays = SharedForest.export(model)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_directory, f"{name}.npy"), np.ascontiguousarray(array))
+            meta = {"kind": "forest", "n_features": int(model.n_features_in_), "trees": len(arrays["roots"])}
+        else:
+            joblib.dump(model, os.path.join(tmp_directory, "model.joblib"), compress=0)
+            meta = {"kind": "joblib"}
+        meta.update({"version": STORE_VERSION, "source": os.path.abspath(source), "type": type(model).__name__,
+                     "build_seconds": round(time.perf_counter() - start, 3)})
+        with open(os.path.join(tmp_directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        # File leggibili solo dall'utente dell'archivio, qualunque sia l'umask
+        for name in os.listdir(tmp_directory):
+            os.chmod(os.path.join(tmp_directory, name), 0o600)
+        try:
+            os.rename(tmp_directory, directory)
+        except OSError:
+            # Un altro processo ha creato la stessa voce nel frattempo
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            meta = self._read_meta(directory) or meta
+        self._remove_stale(source, directory)
+        return directory, meta
+
+    def _remove_stale(self, source, current):
+        for directory in glob.glob(os.path.join(self.path, f"{self._prefix(source)}-*")):
+            if directory != current and not directory.endswith(".tmp"):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def attach(self, source):
+        """Modello con gli array mappati in sola lettura dall'archivio (convertito al primo uso)."""
+        directory, meta = self.build(source)
+        if meta["kind"] == "forest":
+            arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                      for name in ("feature", "threshold", "left", "right", "value", "roots")}
+            classes = np.load(os.path.join(directory, "classes.npy"))
+            return SharedForest(classes=classes, n_features=meta["n_features"], **arrays)
+        import joblib
+
+        return joblib.load(os.path.join(directory, "model.joblib"), mmap_mode="r")
+
+    def entries(self):
+        """Voci dell'archivio con tipo e dimensione su disco."""
+        entries = []
+        for directory in sorted(glob.glob(os.path.join(self.path, "*"))):
+            try:
+                meta = self._read_meta(directory)
+            except PermissionError as e:
+                print(f"⚠️ {e}")
+                continue
+            if meta is None:
+                continue
+            size = sum(os.path.getsize(path) for path in glob.glob(os.path.join(directory, "*")))
+            entries.append(dict(meta, path=directory, bytes=size))
+        return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert joblib models into the shared model store")
+    parser.add_argument("models", nargs="+", help="joblib model files")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR)
+    args = parser.parse_args()
+
+    store = ModelStore(args.store)
+    for source in args.models:
+        directory, meta = store.build(source)
+        print(f"📦 {source} -> {directory} ({meta['kind']}, {meta['type']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
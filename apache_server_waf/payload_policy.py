@@ -0,0 +1,141 @@
+"""
+Limiti di lunghezza e pre-filtro dei payload prima dello scoring completo.
+
+Estrattore e regex del CRS scorrono tutto il payload: un corpo di 128 KB
+(SecRequestBodyNoFilesLimit) costa centinaia di volte una query normale.
+Prima della decisione combinata ogni payload passa da qui:
+
+    pre-filtro  disattivato di default (safe_pattern vuoto). Con un
+                safe_pattern, es. SUGGESTED_SAFE_PATTERN (alfanumerici senza
+                letterali esadecimali/binari 0x.../0b..., che attivano la
+                regola 942450), i payload che lo soddisfano fino a
+                safe_max_length ricevono senza scoring il verdetto del
+                modello sul vettore di feature nullo, calcolato una volta
+                da bind_model; senza bind_model il pre-filtro non decide nulla
+    lunghezza   oltre max_length si applica la politica `oversize`:
+                    head       valuta solo i primi max_length caratteri
+                    head_tail  valuta la prima e l'ultima metà (un attacco
+                               in coda a un corpo lungo resta visibile)
+                    block      Blocked senza scoring
+                    allow      Allowed senza scoring (solo per misure)
+
+I payload decisi qui risultano con entrambi i motori "Not evaluated" e con la
+chiave "prefilter" nel risultato. L'impatto sull'accuratezza di ciascuna
+configurazione si misura con testing_scripts/benchmark_payload_policy.py.
+
+    policy = PayloadPolicy.from_env()       # MODSEC_MAX_PAYLOAD, MODSEC_OVERSIZE_POLICY, MODSEC_SAFE_PATTERN
+    policy.bind_model(model, extractor)
+    results = policy.apply_batch(payloads, lambda scored: scoring.combined_decision_batch(scored, ...))
+"""
+
+import os
+import re
+
+import metrics
+import scoring
+
+OVERSIZE_POLICIES = ("head", "head_tail", "block", "allow")
+DEFAULT_MAX_LENGTH = 16384
+DEFAULT_SAFE_PATTERN = ""
+# Pattern proposto per il pre-filtro (opzionale): va misurato con benchmark_payload_policy.py
+SUGGESTED_SAFE_PATTERN = r"(?i)(?!.*0[xb])[a-z0-9]+"
+DEFAULT_SAFE_MAX_LENGTH = 256
+
+# Esito del pre-filtro per ciascun payload (None = scoring completo)
+EARLY_ALLOWED = 0
+EARLY_BLOCKED = 1
+
+
+class PayloadPolicy:
+    """Pre-filtro e limite di lunghezza applicati ai payload prima di scoring.score_batch."""
+
+    def __init__(self, max_length=DEFAULT_MAX_LENGTH, oversize="head_tail", safe_pattern=DEFAULT_SAFE_PATTERN,
+                 safe_max_length=DEFAULT_SAFE_MAX_LENGTH):
+        if oversize not in OVERSIZE_POLICIES:
+            raise ValueError(f"Politica non supportata per i payload troppo lunghi: {oversize}")
+        # max_length <= 0 disattiva il limite, safe_pattern vuoto disattiva il pre-filtro
+        self.max_length = max_length if max_length > 0 else None
+        self.oversize = oversize
+        self.safe_pattern = safe_pattern or None
+        self.safe_max_length = safe_max_length
+        self._safe = re.compile(safe_pattern).fullmatch if safe_pattern else None
+        # Verdetto del modello sul vettore di feature nullo (bind_model); None = pre-filtro inattivo
+        self.safe_verdict = None
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        return cls(max_length=int(environ.get("MODSEC_MAX_PAYLOAD", DEFAULT_MAX_LENGTH)),
+                   oversize=environ.get("MODSEC_OVERSIZE_POLICY", "head_tail"),
+                   safe_pattern=environ.get("MODSEC_SAFE_PATTERN", DEFAULT_SAFE_PATTERN),
+                   safe_max_length=int(environ.get("MODSEC_SAFE_MAX_LENGTH", DEFAULT_SAFE_MAX_LENGTH)))
+
+    def bind_model(self, model, extractor):
+        """Calcola una volta il verdetto del modello sul vettore di feature nullo, usato dal pre-filtro."""
+        if self._safe is not None:
+            self.safe_verdict = int(scoring._predict_active(model, extractor, [[]])[0])
+        return self.safe_verdict
+
+    def describe(self):
+        return {"max_length": self.max_length, "oversize": self.oversize, "safe_pattern": self.safe_pattern,
+                "safe_max_length": self.safe_max_length, "safe_verdict": self.safe_verdict}
+
+    def truncate(self, payload):
+        if self.oversize == "head":
+            return payload[:self.max_length]
+        head = self.max_length // 2
+        return payload[:head] + " " + payload[len(payload) - (self.max_length - head):]
+
+    def screen(self, payload):
+        """(payload da valutare, esito anticipato EARLY_* o None, motivo o None)."""
+        if (self.safe_verdict is not None and len(payload) <= self.safe_max_length
+                and self._safe(payload)):
+            return payload, self.safe_verdict, "safe"
+        if self.max_length is not None and len(payload) > self.max_length:
+            if self.oversize == "block":
+                return payload, EARLY_BLOCKED, "oversize_block"
+            if self.oversize == "allow":
+                return payload, EARLY_ALLOWED, "oversize_allow"
+            return self.truncate(payload), None, "truncated"
+        return payload, None, None
+
+    def score_batch(self, payloads, score):
+        """Come scoring.score_batch: (waf, ml, combined, motivi), con `score` chiamato solo sui payload da valutare."""
+        n = len(payloads)
+        screened = [self.screen(payload) for payload in payloads]
+        waf_pred = [scoring.NOT_EVALUATED] * n
+        # Per il pre-filtro il verdetto è quello del modello sul vettore nullo
+        ml_pred = [early if reason == "safe" else scoring.NOT_EVALUATED for _, early, reason in screened]
+        combined_pred = [early for _, early, _ in screened]
+        pending = [i for i, (_, early, _) in enumerate(screened) if early is None]
+        if pending:
+            waf, ml, combined = score([screened[i][0] for i in pending])
+            for i, w, m, c in zip(pending, waf, ml, combined):
+                waf_pred[i], ml_pred[i], combined_pred[i] = int(w), int(m), int(c)
+        return waf_pred, ml_pred, combined_pred, [reason for _, _, reason in screened]
+
+    def apply_batch(self, payloads, decide):
+        """Risultati nel formato di scoring.combined_decision_batch, con `decide` chiamato solo sui payload da valutare."""
+        payloads = list(payloads)
+        screened = [self.screen(payload) for payload in payloads]
+        results = [None] * len(payloads)
+        pending = []
+        for i, (_, early, reason) in enumerate(screened):
+            if reason is not None:
+                metrics.registry.inc("prefilter", action=reason)
+            if early is None:
+                pending.append(i)
+            else:
+                results[i] = {"waf_decision": scoring.verdict(scoring.NOT_EVALUATED),
+                              "ml_decision": scoring.verdict(early if reason == "safe" else scoring.NOT_EVALUATED),
+                              "combined_decision": scoring.verdict(early),
+                              "prefilter": reason}
+        if pending:
+            for i, result in zip(pending, decide([screened[i][0] for i in pending])):
+                if screened[i][2] is not None:
+                    result = dict(result, prefilter=screened[i][2])
+                results[i] = result
+        return results
+
+
+metrics.registry.describe("prefilter", "Payloads decided or truncated before the full scoring")
@@ -0,0 +1,314 @@
+"""
+Server WSGI pre-fork per le app Flask di decisione (al posto di app.run()).
+
+Il processo master apre il socket in ascolto dopo che l'app ha caricato
+modelli, estrattore e motori ModSecurity, congela gli oggetti del garbage
+collector (gc.freeze) e crea N worker con fork: la memoria dei modelli è
+condivisa copy-on-write. Ogni worker accetta le connessioni dallo stesso
+socket e serve una richiesta alla volta (PyModSecurity non è thread-safe).
+
+Segnali al master:
+    SIGHUP          riavvio graduale: i worker vengono sostituiti uno alla volta,
+                    ciascuno termina la richiesta in corso prima di uscire
+    SIGTERM/SIGINT  arresto graduale (SIGKILL dopo graceful_timeout secondi)
+
+Un worker che termina in modo anomalo viene ricreato. Lo stato è visibile
+su GET /_prefork/stats (e come gauge in metrics): worker occupati, richieste
+servite e lunghezza della coda di accept del socket in ascolto (connessioni
+accettate dal kernel e non ancora prese da un worker).
+
+Solo questi valori prefork_* vengono dalla memoria condivisa: /metrics è
+servito dal worker che accetta la connessione, quindi gli altri contatori e
+istogrammi (richieste, verdetti, stage_seconds) sono quelli di quel solo
+processo e tra uno scrape e l'altro possono saltare da un worker all'altro.
+
+    prefork.serve(app, port=6000, workers=4)
+    python3 prefork.py server_vulnerable:app --workers 4 --port 6000 --path testing_scripts
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import mmap
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+import metrics
+
+# Intestazione condivisa: worker riavviati, richieste servite dai worker già terminati
+_HEADER = struct.Struct("<qq")
+# Slot condiviso di ogni worker: pid, richieste servite, inizio della richiesta in corso (0 = libero)
+_SLOT = struct.Struct("<qqd")
+
+
+class _RequestHandler(WSGIRequestHandler):
+    # Una richiesta per connessione: con keep-alive una connessione inattiva occuperebbe un worker
+    protocol_version = "HTTP/1.0"
+    access_log = False
+
+    def log_request(self, code="-", size="-"):
+        if self.access_log:
+            super().log_request(code, size)
+
+
+class _WorkerServer(BaseWSGIServer):
+    multiprocess = True
+
+
+def _listen_queue(inode):
+    """Connessioni in attesa di accept sul socket in ascolto (rx_queue in /proc/net/tcp per lo stato LISTEN)."""
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[9] == str(inode) and fields[3] == "0A":
+                        return int(fields[4].split(":")[1], 16)
+        except (OSError, IndexError, StopIteration):
+            continue
+    return -1
+
+
+class PreforkServer:
+    """Master che crea, sorveglia e riavvia i worker."""
+
+    def __init__(self, app, host="127.0.0.1", port=6000, workers=4, backlog=1024, stats_path="/_prefork/stats",
+                 on_reload=None, graceful_timeout=30.0, access_log=False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.backlog = backlog
+        self.stats_path = stats_path
+        self.on_reload = on_reload
+        self.graceful_timeout = graceful_timeout
+        self.access_log = access_log
+        self.pids = [0] * workers
+        self._stopping = False
+        self._reload = False
+        self.socket = None
+        self._shared = None
+        self._inode = None
+
+    # --- stato condiviso ---
+
+    def _read_slot(self, slot):
+        return _SLOT.unpack_from(self._shared, _HEADER.size + slot * _SLOT.size)
+
+    def _write_slot(self, slot, pid, handled, busy_since):
+        _SLOT.pack_into(self._shared, _HEADER.size + slot * _SLOT.size, pid, handled, busy_since)
+
+    def _retire(self, slot, restart=True):
+        """Somma le richieste del worker uscente ai totali e conta il riavvio (solo nel master)."""
+        restarts, retired = _HEADER.unpack_from(self._shared, 0)
+        _HEADER.pack_into(self._shared, 0, restarts + int(restart), retired + self._read_slot(slot)[1])
+
+    def stats(self):
+        now = time.time()
+        restarts, retired = _HEADER.unpack_from(self._shared, 0)
+        slots = [self._read_slot(slot) for slot in range(self.workers)]
+        return {
+            "workers": self.workers,
+            "busy_workers": sum(1 for _, _, busy_since in slots if busy_since),
+            "handled": retired + sum(handled for _, handled, _ in slots),
+            "accept_queue": _listen_queue(self._inode),
+            "backlog": self.backlog,
+            "restarts": restarts,
+            "per_worker": [{"pid": pid, "handled": handled,
+                            "busy_ms": round((now - busy_since) * 1000, 1) if busy_since else 0.0}
+                           for pid, handled, busy_since in slots],
+        }
+
+    def collect(self):
+        stats = self.stats()
+        return [("prefork_" + key, {}, stats[key])
+                for key in ("workers", "busy_workers", "handled", "accept_queue", "restarts")]
+
+    # --- master ---
+
+    def serve(self):
+        self.socket = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.port = self.socket.getsockname()[1]
+        self._inode = os.fstat(self.socket.fileno()).st_ino
+        self._shared = mmap.mmap(-1, _HEADER.size + self.workers * _SLOT.size)
+        metrics.registry.add_collector(self.collect)
+
+        # Gli oggetti già caricati (modelli, estrattore) non vengono più toccati dal GC nei worker,
+        # così le loro pagine restano condivise
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+        print(f"🚀 Prefork master {os.getpid()} on {self.host}:{self.port} with {self.workers} workers")
+
+        try:
+            while not self._stopping:
+                if self._reload:
+                    self._reload = False
+                    self._rolling_restart()
+                self._reap()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._worker(slot)
+            except Exception as e:
+                print(f"❌ Worker {os.getpid()} failed: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[slot] = pid
+        self._write_slot(slot, pid, 0, 0.0)
+
+    def _reap(self):
+        """Ricrea i worker terminati in modo inatteso."""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.pids and not self._stopping:
+                slot = self.pids.index(pid)
+                print(f"⚠️ Worker {pid} exited, restarting it")
+                self._retire(slot)
+                self._spawn(slot)
+
+    def _wait(self, pid, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if done:
+                return
+            time.sleep(0.05)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def _rolling_restart(self):
+        print("♻️ Graceful restart of the workers")
+        if self.on_reload is not None:
+            self.on_reload()
+        for slot in range(self.workers):
+            if self._stopping:
+                return
+            old = self.pids[slot]
+            os.kill(old, signal.SIGTERM)
+            self._wait(old, self.graceful_timeout)
+            self._retire(slot)
+            self._spawn(slot)
+
+    def _shutdown(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.pids:
+            self._wait(pid, self.graceful_timeout)
+        self.socket.close()
+        print("👋 Prefork master stopped")
+
+    # --- worker ---
+
+    def _worker(self, slot):
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        random.seed()
+
+        handler = type("RequestHandler", (_RequestHandler,), {"access_log": self.access_log})
+        server = _WorkerServer(self.host, self.port, self._wrap(slot), handler=handler, fd=self.socket.fileno())
+        # handle_request torna almeno ogni mezzo secondo per controllare la richiesta di arresto
+        server.timeout = 0.5
+        while not stopping:
+            server.handle_request()
+
+    def _wrap(self, slot):
+        app = self.app
+
+        def wsgi(environ, start_response):
+            if environ.get("PATH_INFO") == self.stats_path:
+                body = json.dumps(self.stats()).encode("utf-8")
+                start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+                return [body]
+            pid, handled, _ = self._read_slot(slot)
+            self._write_slot(slot, pid, handled, time.time())
+            try:
+                return app(environ, start_response)
+            finally:
+                self._write_slot(slot, pid, handled + 1, 0.0)
+
+        return wsgi
+
+
+def serve(app, host="127.0.0.1", port=6000, workers=4, **kwargs):
+    PreforkServer(app, host=host, port=port, workers=workers, **kwargs).serve()
+
+
+def _load(spec):
+    """'modulo:attributo' (es. server_vulnerable:app, server_vulnerable:models.preload)."""
+    module_name, _, attribute = spec.partition(":")
+    target = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        target = getattr(target, name)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked WSGI server for the decision apps")
+    parser.add_argument("app", help="module:attribute of the WSGI app, e.g. server_vulnerable:app")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument("--preload", action="append", default=[],
+                        help="module:callable run in the master before forking (e.g. server_vulnerable:models.preload)")
+    parser.add_argument("--path", action="append", default=[], help="directory added to sys.path")
+    parser.add_argument("--access-log", action="store_true", help="log every request (werkzeug format) on stderr")
+    args = parser.parse_args()
+
+    sys.path[:0] = [os.path.abspath(path) for path in args.path] + [os.getcwd()]
+    app = _load(args.app)
+    preload = [_load(spec) for spec in args.preload]
+    for hook in preload:
+        hook()
+    serve(app, host=args.host, port=args.port, workers=args.workers, backlog=args.backlog,
+          access_log=args.access_log, on_reload=lambda: [hook() for hook in preload])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+File e cartelle private dell'utente effettivo.
+
+Cache dei metadati CRS, matcher precompilato e archivio dei modelli sono
+pickle: caricare un file che un altro utente può scrivere esegue il suo
+codice nel processo del WAF. Prima di caricarli, file e cartella devono
+essere dell'utente effettivo, non essere link simbolici e non essere
+scrivibili da gruppo/altri; le cartelle vengono create con permessi 0700 e
+i file scritti con permessi 0600, qualunque sia l'umask.
+
+    check_private_file(path)       # PermissionError se path o la sua cartella non sono privati
+    dump_private(path, obj)        # pickle con permessi 0600 e rename atomico
+"""
+
+import os
+import pickle
+import stat
+
+# Cartella di default per le cache in pickle (una per utente, fuori da /tmp)
+DEFAULT_CACHE_DIR = f"/var/tmp/modsec_crs_cache-{os.geteuid()}"
+
+
+def check_private(path):
+    """PermissionError se `path` non è dell'utente effettivo, è un link simbolico o è scrivibile da gruppo/altri."""
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode):
+        raise PermissionError(f"{path} è un link simbolico")
+    if info.st_uid != os.geteuid():
+        raise PermissionError(f"{path} appartiene all'uid {info.st_uid}, non a {os.geteuid()}")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} è scrivibile da gruppo/altri ({oct(info.st_mode & 0o777)})")
+
+
+def check_private_file(path):
+    """Crea la cartella di `path` (0700) e verifica che cartella e, se esiste, file siano privati."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    check_private(directory)
+    if os.path.lexists(path):
+        check_private(path)
+
+
+def dump_private(path, obj):
+    """Salva `obj` in pickle su `path` con permessi 0600 (file temporaneo e rename atomico)."""
+    check_private_file(path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,133 @@
+"""
+Raggruppamento delle richieste concorrenti in un solo batch di scoring.
+
+Con il server Flask multi-thread ogni richiesta a /vulnerable o /predict
+valuta il proprio payload da sola, mentre la predict dei modelli sklearn e
+PyModSecurity.predict costano molto meno per payload su un array. Il
+coalescer raccoglie le richieste concorrenti con la stessa chiave (dataset,
+modello): la prima richiesta di un batch ne diventa il leader, attende al
+massimo `max_wait_ms` (o finché il batch non arriva a `max_batch` payload),
+valuta tutto il batch con una sola chiamata a `score_batch(chiave, payloads)`
+e restituisce a ogni richiesta in attesa il proprio risultato.
+
+La finestra di attesa si apre solo se ci sono altre richieste in corso nel
+coalescer: una richiesta isolata (carico basso, o un worker pre-fork che
+serve una richiesta alla volta) viene valutata subito, senza latenza
+aggiunta. Non ci sono thread in background, quindi l'oggetto può essere
+creato prima del fork dei worker.
+
+Un errore di score_batch viene rilanciato in tutte le richieste del batch.
+
+    coalescer = RequestCoalescer(lambda key, payloads: score(payloads, *key), max_wait_ms=2, max_batch=32)
+    result = coalescer.submit(("modsec", "inf_svm"), payload)
+"""
+
+import threading
+import time
+
+import metrics
+
+
+class _Batch:
+    def __init__(self):
+        self.payloads = []
+        self.results = None
+        self.error = None
+        self.closed = False
+        self.started = time.perf_counter()
+        # full: batch chiuso prima della scadenza (max_batch); done: risultati pronti
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class RequestCoalescer:
+    """Richieste concorrenti con la stessa chiave valutate insieme da una sola chiamata a score_batch."""
+
+    def __init__(self, score_batch, max_wait_ms=2.0, max_batch=32, name="coalescer"):
+        if max_batch < 1:
+            raise ValueError(f"max_batch non valido: {max_batch}")
+        self.score_batch = score_batch
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_batch = int(max_batch)
+        self.name = name
+        self._pending = {}
+        self._active = 0
+        self._counters = {"requests": 0, "batches": 0, "full_batches": 0, "max_batch_size": 0, "wait_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def _close(self, key, batch):
+        # Chiamata con self._lock acquisito: nessun altro payload entra nel batch
+        batch.closed = True
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+
+    def submit(self, key, payload):
+        """Risultato di `payload`, valutato insieme alle altre richieste concorrenti con la stessa chiave."""
+        with self._lock:
+            self._active += 1
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            index = len(batch.payloads)
+            batch.payloads.append(payload)
+            if len(batch.payloads) >= self.max_batch:
+                self._close(key, batch)
+                batch.full.set()
+            # Con una sola richiesta in corso non c'è nessuno da aspettare
+            wait = self.max_wait if self._active > 1 else 0.0
+        try:
+            if leader:
+                self._lead(key, batch, wait)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._active -= 1
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _lead(self, key, batch, wait):
+        if wait and not batch.closed:
+            batch.full.wait(wait)
+        with self._lock:
+            self._close(key, batch)
+            size = len(batch.payloads)
+            waited = time.perf_counter() - batch.started
+            self._counters["requests"] += size
+            self._counters["batches"] += 1
+            self._counters["full_batches"] += int(size >= self.max_batch)
+            self._counters["max_batch_size"] = max(self._counters["max_batch_size"], size)
+            self._counters["wait_seconds"] += waited
+        metrics.registry.observe("stage_seconds", waited, stage="coalesce_wait", coalescer=self.name)
+        metrics.registry.inc("coalesced_requests", size, coalescer=self.name)
+        try:
+            results = list(self.score_batch(key, batch.payloads))
+            if len(results) != size:
+                raise RuntimeError(f"score_batch ha restituito {len(results)} risultati per {size} payload")
+            batch.results = results
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            active = self._active
+        batches = counters["batches"]
+        return {
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "max_batch": self.max_batch,
+            "requests": counters["requests"],
+            "batches": batches,
+            "full_batches": counters["full_batches"],
+            "mean_batch_size": round(counters["requests"] / batches, 3) if batches else 0.0,
+            "max_batch_size": counters["max_batch_size"],
+            "mean_wait_ms": round(counters["wait_seconds"] / batches * 1000, 4) if batches else 0.0,
+            "in_flight": active,
+        }
+
+
+metrics.registry.describe("coalesced_requests", "Requests scored through the request coalescer")
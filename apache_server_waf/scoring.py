@@ -0,0 +1,187 @@
+"""
+Scoring vettorizzato della decisione combinata ModSecurity + ML.
+
+Invece di una DataFrame di una riga e di una predict per payload, costruisce
+una sola matrice di feature e chiama una sola volta model.predict e
+PyModSecurity.predict su tutti gli N payload.
+
+La decisione combinata è un OR logico, quindi il secondo motore può essere
+saltato per i payload già bloccati dal primo. Strategie disponibili:
+
+    both       valuta sempre entrambi i motori (log di audit completi)
+    waf_first  ModSecurity, poi il modello ML solo sui payload non bloccati
+    ml_first   modello ML, poi ModSecurity solo sui payload non bloccati
+    adaptive   sceglie l'ordine con il costo atteso minore, in base al costo
+               per payload e al tasso di blocco misurati per ciascun motore
+    single_pass  una sola passata del CRS (PL4) per payload: le feature del
+               modello e il verdetto ModSecurity al PL richiesto, ricavato dal
+               punteggio di anomalia delle regole attivate (FeatureService.evaluate)
+    cascade    un modello lineare economico decide i payload certi; solo quelli
+               incerti passano a ModSecurity e al modello richiesto (cascade.py,
+               soglie calibrate offline)
+
+Il motore saltato risulta "Not evaluated" (-1 negli array).
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import metrics
+import waf_engine
+
+STRATEGIES = ("both", "waf_first", "ml_first", "adaptive", "single_pass", "cascade")
+NOT_EVALUATED = -1
+
+
+def verdict(blocked):
+    if blocked == NOT_EVALUATED:
+        return "Not evaluated"
+    return "Blocked" if blocked else "Allowed"
+
+
+class EngineStats:
+    """Costo medio per payload e tasso di blocco di ciascun motore (medie mobili esponenziali)."""
+
+    def __init__(self, alpha=0.01, explore_every=100):
+        self.alpha = alpha
+        # Ogni `explore_every` batch la strategia adattiva valuta entrambi i motori,
+        # così anche il tasso di blocco del motore valutato per secondo resta aggiornato.
+        # Il tasso di blocco viene solo da questi batch: con il cortocircuito il secondo
+        # motore vede solo i payload non bloccati dal primo e il campione sarebbe distorto
+        self.explore_every = explore_every
+        self.cost = {}
+        self.block_rate = {}
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def update(self, engine, seconds, evaluated, blocked=None):
+        """Costo da ogni batch; tasso di blocco solo se `blocked` è indicato (entrambi i motori su tutto il batch)."""
+        if evaluated == 0:
+            return
+        weight = 1.0 - (1.0 - self.alpha) ** evaluated
+        samples = [(self.cost, seconds / evaluated)]
+        if blocked is not None:
+            samples.append((self.block_rate, blocked / evaluated))
+        with self._lock:
+            for values, sample in samples:
+                values[engine] = sample if engine not in values else values[engine] + weight * (sample - values[engine])
+
+    def order(self):
+        """Ordine (primo, secondo) con costo atteso c_primo + (1 - p_primo) * c_secondo minore; None = valuta entrambi."""
+        with self._lock:
+            self.batches += 1
+            if len(self.block_rate) < 2 or self.batches % self.explore_every == 0:
+                return None
+            expected = {
+                (first, second): self.cost[first] + (1.0 - self.block_rate[first]) * self.cost[second]
+                for first, second in (("waf", "ml"), ("ml", "waf"))
+            }
+        return min(expected, key=expected.get)
+
+    def summary(self):
+        with self._lock:
+            return {
+                engine: {"ms_per_payload": round(self.cost[engine] * 1000, 4),
+                         "block_rate": round(self.block_rate[engine], 4) if engine in self.block_rate else None}
+                for engine in self.cost
+            }
+
+
+# Statistiche condivise dalla strategia adattiva quando il chiamante non ne passa di proprie
+engine_stats = EngineStats()
+
+
+def _run_waf(payloads, rules_dir, pl):
+    with metrics.timed("waf"), waf_engine.waf_engine(rules_dir, pl=pl) as waf:
+        return (np.asarray(waf.predict(np.array(payloads))) > 0).astype(int)
+
+
+def _predict_active(model, extractor, active):
+    with metrics.timed("ml_predict"):
+        if hasattr(model, "predict_active"):
+            # Modello lineare esportato (linear_model.py): somma dei pesi delle sole regole attivate
+            return (np.asarray(model.predict_active(active)) == 1).astype(int)
+        # Una sola matrice di feature (CSR se il modello la accetta) e una sola predict per il modello ML
+        return (np.asarray(model.predict(extractor.features_for(model, active))) == 1).astype(int)
+
+
+def _run_ml(payloads, model, extractor):
+    with metrics.timed("features"):
+        active = extractor.extract_active(payloads)
+    return _predict_active(model, extractor, active)
+
+
+def _score_single_pass(payloads, model, extractor, pl):
+    with metrics.timed("crs_single_pass"):
+        active, waf_scores = extractor.evaluate(payloads, pl=pl)
+    waf_pred = (waf_scores > 0).astype(int)
+    ml_pred = _predict_active(model, extractor, active)
+    return waf_pred, ml_pred, (waf_pred | ml_pred).astype(int)
+
+
+def score_batch(payloads, model, extractor, rules_dir, pl=1, strategy="both", stats=None, cascade=None):
+    """Restituisce tre array (waf, ml, combined) allineati a `payloads`; -1 = motore non valutato."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Strategia non supportata: {strategy}")
+    if strategy == "cascade" and cascade is None:
+        raise ValueError("La strategia cascade richiede una calibrazione (cascade.Cascade)")
+    stats = engine_stats if stats is None else stats
+    payloads = list(payloads)
+    n = len(payloads)
+    if not n:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, empty
+    if strategy == "single_pass":
+        return _score_single_pass(payloads, model, extractor, pl)
+    if strategy == "cascade":
+        return cascade.score_batch(payloads, extractor, lambda subset, active: (
+            _run_waf(subset, rules_dir, pl), _predict_active(model, extractor, active)))
+
+    engines = {
+        "waf": lambda subset: _run_waf(subset, rules_dir, pl),
+        "ml": lambda subset: _run_ml(subset, model, extractor),
+    }
+    order, short_circuit = ("waf", "ml"), strategy != "both"
+    if strategy == "ml_first":
+        order = ("ml", "waf")
+    elif strategy == "adaptive":
+        chosen = stats.order()
+        if chosen is None:
+            short_circuit = False
+        else:
+            order = chosen
+
+    preds = {engine: np.full(n, NOT_EVALUATED, dtype=int) for engine in engines}
+    remaining = np.arange(n)
+    for position, engine in enumerate(order):
+        if position == 1 and short_circuit:
+            # Decisione combinata OR: i payload già bloccati non servono al secondo motore
+            remaining = np.flatnonzero(preds[order[0]] != 1)
+        if not len(remaining):
+            break
+        start = time.perf_counter()
+        result = engines[engine]([payloads[i] for i in remaining])
+        # Senza cortocircuito entrambi i motori valutano tutto il batch: campione del tasso di blocco non distorto
+        stats.update(engine, time.perf_counter() - start, len(remaining),
+                     None if short_circuit else int(result.sum()))
+        preds[engine][remaining] = result
+
+    # Decisione combinata (OR logico)
+    combined_pred = ((preds["waf"] == 1) | (preds["ml"] == 1)).astype(int)
+    return preds["waf"], preds["ml"], combined_pred
+
+
+def combined_decision_batch(payloads, model, extractor, rules_dir, pl=1, strategy="both", stats=None, cascade=None):
+    """Verdetti per payload, nello stesso formato della decisione singola."""
+    waf_pred, ml_pred, combined_pred = score_batch(payloads, model, extractor, rules_dir, pl, strategy, stats,
+                                                   cascade)
+    return [
+        {
+            "waf_decision": verdict(w),
+            "ml_decision": verdict(m),
+            "combined_decision": verdict(c),
+        }
+        for w, m, c in zip(waf_pred, ml_pred, combined_pred)
+    ]
@@ -0,0 +1,208 @@
+"""
+Cache dei verdetti della decisione combinata.
+
+Le chiavi sono l'hash SHA-256 del payload (codificato in UTF-8) insieme
+all'identità del modello e del ruleset CRS che hanno prodotto il verdetto:
+l'identità è ricavata da percorso, dimensione e mtime del file joblib e dei
+file .conf del CRS, quindi un modello o un ruleset modificato invalida
+automaticamente le voci vecchie e due modelli diversi non condividono mai
+una voce. Anche la configurazione che cambia il verdetto (strategia, backend
+WAF, calibrazione della cascata) va aggiunta al namespace con config_identity.
+
+La cache in memoria è limitata (LRU) e opzionalmente con scadenza (TTL).
+Per condividere i verdetti tra più processi (es. più worker) si può aggiungere
+un file SQLite locale come secondo livello.
+
+    cache = VerdictCache(max_entries=10000, ttl=3600)
+    ns = cache.namespace(model_path, rules_dir)
+    result = cache.get(ns, payload)
+    if result is None:
+        result = ...
+        cache.put(ns, payload, result)
+"""
+
+import collections
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def file_identity(path):
+    """Identità di un file o di una directory di regole (percorso, dimensione, mtime)."""
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, "*.conf")) + glob.glob(os.path.join(path, "*.data")))
+    else:
+        files = [path]
+    parts = [path]
+    for name in files:
+        try:
+            st = os.stat(name)
+        except OSError:
+            continue
+        parts.append(f"{os.path.basename(name)}:{st.st_size}:{st.st_mtime_ns}")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def config_identity(*parts):
+    """Identità di una configurazione che cambia il verdetto (es. strategia, backend WAF)."""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:16]
+
+
+def payload_key(namespace, payload):
+    """Chiave di cache per un payload all'interno di un namespace modello+ruleset."""
+    data = payload.encode("utf-8", "surrogateescape") if isinstance(payload, str) else bytes(payload)
+    return namespace + ":" + hashlib.sha256(data).hexdigest()
+
+
+class SqliteVerdictStore:
+    """Secondo livello condiviso tra processi su un file SQLite locale."""
+
+    # Ogni quanti inserimenti eliminare le voci oltre max_entries
+    TRIM_EVERY = 1000
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._puts = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, value TEXT, ts REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS verdicts_ts ON verdicts (ts)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import sqlite3
+
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, key, ttl=None):
+        row = self._connection().execute("SELECT value, ts FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if ttl is not None and time.time() - row[1] > ttl:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?)", (key, json.dumps(value), time.time()))
+        self._puts += 1
+        if self._puts % self.TRIM_EVERY == 0:
+            self.trim()
+
+    def trim(self):
+        """Elimina le voci più vecchie oltre max_entries."""
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def drop_namespace(self, namespace):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM verdicts WHERE key LIKE ?", (namespace + "%",))
+
+
+class VerdictCache:
+    """Cache LRU/TTL dei verdetti, con contatori di hit/miss."""
+
+    def __init__(self, max_entries=10000, ttl=None, shared_path=None, identity_check_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.identity_check_interval = identity_check_interval
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._identities = {}
+        self._shared = SqliteVerdictStore(shared_path, max_entries * 10) if shared_path else None
+        self._counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def namespace(self, model_path, rules_dir):
+        """Identità corrente di modello+ruleset; se è cambiata, le voci vecchie vengono eliminate."""
+        key = (model_path, rules_dir)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._identities.get(key)
+            if cached is not None and now - cached[1] < self.identity_check_interval:
+                return cached[0]
+        namespace = file_identity(model_path) + file_identity(rules_dir)
+        with self._lock:
+            previous = self._identities.get(key)
+            self._identities[key] = (namespace, now)
+        if previous is not None and previous[0] != namespace:
+            self.invalidate(previous[0])
+        return namespace
+
+    def invalidate(self, namespace=None):
+        """Elimina tutte le voci di un namespace, anche esteso con config_identity (o tutta la cache)."""
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k.startswith(namespace)]:
+                    del self._entries[key]
+            self._counters["invalidations"] += 1
+        if self._shared is not None and namespace is not None:
+            self._shared.drop_namespace(namespace)
+
+    def get(self, namespace, payload):
+        key = payload_key(namespace, payload)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._counters["expired"] += 1
+        if self._shared is not None:
+            value = self._shared.get(key, self.ttl)
+            if value is not None:
+                self._store(key, value)
+                with self._lock:
+                    self._counters["shared_hits"] += 1
+                return value
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def put(self, namespace, payload, value):
+        key = payload_key(namespace, payload)
+        self._store(key, value)
+        if self._shared is not None:
+            self._shared.put(key, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["shared_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def lookup_batch(self, namespace, payloads, compute):
+        """Verdetti per `payloads`: solo quelli non in cache vengono calcolati, con una sola chiamata a `compute`."""
+        results = [self.get(namespace, payload) for payload in payloads]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = compute([payloads[i] for i in missing])
+            for i, value in zip(missing, computed):
+                results[i] = value
+                self.put(namespace, payloads[i], value)
+        return results
@@ -0,0 +1,80 @@
+"""
+Motore ModSecurity precompilato e condiviso.
+
+Costruire PyModSecurity significa fare il parsing dell'intero CRS: va fatto una
+sola volta per processo. PyModSecurity non è thread-safe (lo stato del logger
+delle regole vive nell'istanza), quindi i motori sono tenuti in un pool: ogni
+chiamante ne prende uno libero e lo restituisce a fine valutazione. Il pool
+cresce solo fino al numero massimo di valutazioni concorrenti.
+
+    with waf_engine(rules_dir, pl=1) as waf:
+        waf.predict(np.array([payload]))
+"""
+
+import contextlib
+import os
+import threading
+import time
+
+_pools = {}
+_pools_lock = threading.Lock()
+_stats = {"builds": 0, "build_seconds": 0.0, "acquired": 0}
+
+
+def _build(rules_dir, pl):
+    from src.models import PyModSecurity
+
+    start = time.perf_counter()
+    waf = PyModSecurity(rules_dir=rules_dir, pl=pl)
+    elapsed = time.perf_counter() - start
+    with _pools_lock:
+        _stats["builds"] += 1
+        _stats["build_seconds"] += elapsed
+    return waf
+
+
+def _idle_engines(rules_dir, pl):
+    key = (os.path.abspath(rules_dir), pl)
+    with _pools_lock:
+        return _pools.setdefault(key, [])
+
+
+def acquire(rules_dir, pl=1):
+    """Prende un motore libero dal pool, compilandone uno nuovo solo se sono tutti occupati."""
+    idle = _idle_engines(rules_dir, pl)
+    with _pools_lock:
+        _stats["acquired"] += 1
+        if idle:
+            return idle.pop()
+    return _build(rules_dir, pl)
+
+
+def release(waf, rules_dir, pl=1):
+    """Restituisce il motore al pool."""
+    idle = _idle_engines(rules_dir, pl)
+    with _pools_lock:
+        idle.append(waf)
+
+
+@contextlib.contextmanager
+def waf_engine(rules_dir, pl=1):
+    waf = acquire(rules_dir, pl)
+    try:
+        yield waf
+    finally:
+        release(waf, rules_dir, pl)
+
+
+def preload(rules_dir, pl=1, count=1):
+    """Compila in anticipo `count` motori (es. prima di servire richieste o prima del fork)."""
+    engines = [acquire(rules_dir, pl) for _ in range(count)]
+    for waf in engines:
+        release(waf, rules_dir, pl)
+
+
+def engine_stats():
+    """Motori compilati, tempo speso a compilarli e numero di acquisizioni."""
+    with _pools_lock:
+        stats = dict(_stats)
+        stats["idle"] = sum(len(idle) for idle in _pools.values())
+    return stats
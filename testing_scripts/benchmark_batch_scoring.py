@@ -0,0 +1,64 @@
+"""
+Benchmark di throughput della decisione combinata in funzione della dimensione del batch.
+
+Per ogni dimensione del batch valuta gli stessi payload di test con
+scoring.score_batch (una matrice di feature, una model.predict e una
+PyModSecurity.predict per batch) e riporta payload/s e ms per payload.
+
+    python3 benchmark_batch_scoring.py --dataset modsec --model-path data/models/adv_inf_svm_pl4_t1.joblib
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+from feature_service import FeatureService
+import waf_engine
+from my_utils import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Combined decision throughput by batch size")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model-path", default="data/models/adv_inf_svm_pl4_t1.joblib")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads per class")
+    parser.add_argument("--batch-sizes", default="1,10,100,1000")
+    parser.add_argument("--rules-dir", default="./coreruleset/rules/")
+    args = parser.parse_args()
+
+    payloads = []
+    for payload_type in ["legitimate", "malicious"]:
+        data = load_dataset(construct_path(args.dataset, "inf_svm", payload_type=payload_type))
+        payloads.extend(data["payload"].tolist()[:args.samples])
+
+    model = joblib.load(args.model_path)
+    extractor = FeatureService(crs_ids_path='./data/crs_sqli_ids_4.0.0.json', crs_path=args.rules_dir, crs_pl=4)
+    waf_engine.preload(args.rules_dir, pl=1)
+
+    print(f"🔍 {len(payloads)} payloads from {args.dataset}, model {args.model_path}")
+    print(f"{'batch':>8} {'payloads/s':>12} {'ms/payload':>12}")
+    reference = None
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        combined = []
+        start = time.perf_counter()
+        for i in range(0, len(payloads), batch_size):
+            _, _, combined_pred = scoring.score_batch(payloads[i:i + batch_size], model, extractor, args.rules_dir)
+            combined.append(combined_pred)
+        elapsed = time.perf_counter() - start
+        combined = np.concatenate(combined)
+        if reference is None:
+            reference = combined
+        elif not np.array_equal(reference, combined):
+            print(f"⚠️ Batch size {batch_size} changed some verdicts")
+        print(f"{batch_size:>8} {len(payloads) / elapsed:>12.1f} {elapsed / len(payloads) * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Throughput e latenza del coalescer delle richieste (request_coalescer.py) rispetto al percorso per richiesta.
+
+Simula il server Flask multi-thread: --concurrency thread client in anello
+chiuso inviano un payload alla volta al percorso di scoring, senza HTTP,
+così la misura riguarda solo la decisione combinata:
+
+    per-request  scoring.score_batch su [payload] in ogni thread (comportamento attuale)
+    coalesced    RequestCoalescer.submit, batch per (dataset, modello) con
+                 attesa massima --max-wait-ms e al più --max-batch payload
+
+Per ogni livello di concorrenza e ogni attesa riporta richieste/s, latenza
+p50/p95/p99 e dimensione media dei batch, e verifica che i verdetti dei
+payload siano gli stessi del percorso per richiesta (codice di uscita 1 se
+non è così).
+
+    python3 benchmark_coalescer.py --dataset modsec --model inf_svm --concurrency 1 4 16 --max-wait-ms 1 2 5
+    python3 benchmark_coalescer.py --model rf --strategy waf_first --max-batch 64 --output coalescer.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+import waf_engine
+from feature_service import FeatureService
+from request_coalescer import RequestCoalescer
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+
+def run_clients(payloads, concurrency, requests, decide):
+    """Anello chiuso: (latenze in secondi, verdetto combinato per indice di payload, durata)."""
+    latencies = []
+    verdicts = {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        local_latencies, local_verdicts = [], {}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            index = i % len(payloads)
+            start = time.perf_counter()
+            local_verdicts[index] = decide(payloads[index])
+            local_latencies.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local_latencies)
+            verdicts.update(local_verdicts)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, verdicts, time.perf_counter() - start
+
+
+def summarize(latencies, elapsed):
+    latencies = np.asarray(latencies) * 1000.0
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request coalescer vs per-request scoring: throughput and latency")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm")
+    parser.add_argument("--strategy", choices=[s for s in scoring.STRATEGIES if s != "cascade"], default="both")
+    parser.add_argument("--samples", type=int, default=500, help="payloads per class")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[1.0, 2.0, 5.0])
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--output", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    payloads = []
+    for payload_type in ["legitimate", "malicious"]:
+        data = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))
+        payloads.extend(str(payload) for payload in data["payload"].tolist()[:args.samples])
+
+    model = joblib.load(model_paths[args.dataset][args.model])
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+    if args.strategy != "single_pass":
+        waf_engine.preload(crs_rules_dir, pl=1)
+
+    def score(batch):
+        return scoring.score_batch(batch, model, extractor, crs_rules_dir, pl=1, strategy=args.strategy)[2]
+
+    # Riscaldamento: motori ModSecurity, cache dell'estrattore e modello pronti prima delle misure
+    score(payloads[:64])
+    reference = score(payloads)
+
+    print(f"🔍 {len(payloads)} payloads from {args.dataset}, model {args.model}, strategy {args.strategy}, "
+          f"{args.requests} requests per run, max batch {args.max_batch}")
+    print(f"{'clients':>8} {'path':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'batch':>8}")
+    results, mismatches = [], 0
+    for concurrency in args.concurrency:
+        runs = [("per-request", None)] + [(f"coalesced {wait:g} ms", wait) for wait in args.max_wait_ms]
+        baseline = None
+        for label, wait in runs:
+            if wait is None:
+                coalescer = None
+                latencies, verdicts, elapsed = run_clients(payloads, concurrency, args.requests,
+                                                           lambda payload: int(score([payload])[0]))
+            else:
+                coalescer = RequestCoalescer(lambda key, batch: [int(v) for v in score(batch)],
+                                             max_wait_ms=wait, max_batch=args.max_batch, name="benchmark")
+                latencies, verdicts, elapsed = run_clients(payloads, concurrency, args.requests,
+                                                           lambda payload: coalescer.submit("benchmark", payload))
+            differ = sum(1 for index, verdict in verdicts.items() if verdict != reference[index])
+            mismatches += differ
+            summary = summarize(latencies, elapsed)
+            summary.update({"concurrency": concurrency, "path": label, "max_wait_ms": wait,
+                            "mean_batch_size": coalescer.stats()["mean_batch_size"] if coalescer else 1.0,
+                            "verdicts_differ": differ})
+            if baseline is None:
+                baseline = summary
+            summary["speedup"] = round(summary["throughput_rps"] / baseline["throughput_rps"], 3)
+            results.append(summary)
+            print(f"{concurrency:>8} {label:<18}{summary['throughput_rps']:>10.1f}{summary['p50_ms']:>10.3f}"
+                  f"{summary['p95_ms']:>10.3f}{summary['p99_ms']:>10.3f}{summary['mean_batch_size']:>8.1f}"
+                  f"{'' if not differ else f'  ⚠️ {differ} verdicts differ'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Results saved to {args.output}")
+    if mismatches:
+        print(f"❌ {mismatches} verdicts differ from the per-request path")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
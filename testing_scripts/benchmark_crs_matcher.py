@@ -0,0 +1,117 @@
+"""
+Parità e costo del matcher precompilato di crs_matcher.py rispetto all'estrattore.
+
+Per ogni insieme di test (legittimi, malevoli, avversari) confronta, payload
+per payload, le regole SQLi attivate secondo l'estrattore ModSecurity
+(FeatureService senza matcher) con quelle del matcher. Riporta le regole con
+hit mancanti (FN) o in più (FP) e un esempio, il tempo per payload dei due
+motori e la quota di valutazioni saltate dal pre-filtro, poi il profilo di
+costo delle regole più care. Esce con codice 1 se un solo hit differisce.
+Con --matcher il risultato della verifica viene salvato nel file del
+matcher: FeatureService (MODSEC_CRS_MATCHER) lo usa solo se la verifica
+registrata non ha differenze e tutte le regole sono supportate.
+
+    python3 benchmark_crs_matcher.py --dataset modsec --model inf_svm --samples 1000
+    python3 benchmark_crs_matcher.py --matcher /var/tmp/modsec_crs_cache-$(id -u)/crs_sqli_pl4.matcher --top 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import crs_matcher
+from feature_service import FeatureService
+from complete_client_eval import crs_rules_dir, crs_ids_path
+from my_utils import *
+
+payload_types = ["legitimate", "malicious", "adv_ms", "adv_ml"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule-hit parity and cost of the precompiled CRS SQLi matcher")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm", help="model whose adversarial sets are used")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads per test set")
+    parser.add_argument("--pl", type=int, default=4)
+    parser.add_argument("--matcher", default=None,
+                        help="save the compiled matcher and the parity result here (file read by MODSEC_CRS_MATCHER)")
+    parser.add_argument("--top", type=int, default=10, help="costliest rules to show")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matcher = crs_matcher.build(crs_rules_dir, crs_ids_path, pl=args.pl)
+    build_ms = (time.perf_counter() - start) * 1000
+    if args.matcher:
+        matcher.save(args.matcher)
+        start = time.perf_counter()
+        matcher = crs_matcher.load_or_build(crs_rules_dir, crs_ids_path, pl=args.pl, path=args.matcher)
+        print(f"🧩 Matcher built in {build_ms:.1f} ms, loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+    else:
+        print(f"🧩 Matcher built in {build_ms:.1f} ms")
+    print(f"   {matcher.describe()}")
+    for rule_id, reason in sorted(matcher.unsupported.items()):
+        print(f"   ⚠️ {rule_id}: {reason}")
+
+    reference = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=args.pl)
+    mismatches = 0
+    all_payloads = []
+    print(f"{'set':<12}{'payloads':>10}{'FN':>6}{'FP':>6}{'ref ms':>10}{'matcher ms':>12}{'skipped':>9}")
+    for payload_type in payload_types:
+        payloads = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))["payload"]
+        payloads = [str(payload) for payload in payloads.tolist()[:args.samples]]
+        all_payloads += payloads
+
+        start = time.perf_counter()
+        expected = reference.extract_active(payloads)
+        reference_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        found = matcher.match_batch(payloads)
+        matcher_seconds = time.perf_counter() - start
+
+        # Differenze per regola: (payload di esempio, conteggio)
+        missed, extra = {}, {}
+        for payload, indices, hits in zip(payloads, expected, found):
+            expected_ids = {str(reference.rule_ids[i]) for i in indices}
+            for rule_id in expected_ids - set(hits):
+                missed.setdefault(rule_id, [payload, 0])[1] += 1
+            for rule_id in set(hits) - expected_ids:
+                extra.setdefault(rule_id, [payload, 0])[1] += 1
+        mismatches += sum(count for _, count in missed.values()) + sum(count for _, count in extra.values())
+
+        n = max(len(payloads), 1)
+        profile = matcher.profile(payloads)
+        evaluations = sum(entry["evaluations"] for entry in profile)
+        skipped = 1.0 - evaluations / max(len(matcher.rules) * n, 1)
+        print(f"{payload_type:<12}{len(payloads):>10}{sum(c for _, c in missed.values()):>6}"
+              f"{sum(c for _, c in extra.values()):>6}{reference_seconds / n * 1000:>10.3f}"
+              f"{matcher_seconds / n * 1000:>12.3f}{skipped:>9.1%}")
+        for label, differences in (("FN", missed), ("FP", extra)):
+            for rule_id, (payload, count) in sorted(differences.items()):
+                print(f"   ❌ {label} {rule_id} x{count}, e.g. {payload[:80]!r}")
+
+    print(f"\n💰 Costliest rules ({len(all_payloads)} payloads)")
+    print(f"{'rule':<8}{'PL':>4}{'total ms':>10}{'us/eval':>10}{'evals':>8}{'skipped':>9}{'hits':>7}")
+    for entry in matcher.profile(all_payloads)[:args.top]:
+        total = max(entry["evaluations"] + entry["skipped"], 1)
+        print(f"{entry['rule']:<8}{entry['paranoia_level'] or '-':>4}{entry['seconds'] * 1000:>10.2f}"
+              f"{entry['us_per_evaluation']:>10.1f}{entry['evaluations']:>8}{entry['skipped'] / total:>9.1%}"
+              f"{entry['hits']:>7}")
+
+    if args.matcher:
+        matcher.parity = {"payloads": len(all_payloads), "mismatches": mismatches}
+        matcher.save(args.matcher)
+        print(f"\n📄 Parity result saved to {args.matcher} (matcher {'verified' if matcher.verified else 'not verified'})")
+
+    if mismatches or not matcher.exact:
+        print(f"\n❌ {mismatches} rule hits differ from the reference engine, "
+              f"{len(matcher.unsupported)} rules not supported by the matcher")
+        return 1
+    print("\n✅ Rule hits identical to the reference engine")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
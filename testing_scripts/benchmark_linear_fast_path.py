@@ -0,0 +1,67 @@
+"""
+Verifica e benchmark del percorso veloce per i modelli lineari (linear_model.py).
+
+Per ogni modello lineare del dataset scelto confronta, payload per payload,
+la predict di sklearn (model.predict([features]) come nel server) con la
+somma sparsa dei pesi delle regole attivate, sui payload legittimi, malevoli
+e avversari di test: accordo delle predizioni e latenza per decisione.
+
+    python3 benchmark_linear_fast_path.py --dataset modsec --samples 1000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from feature_service import FeatureService
+from linear_model import SparseLinearModel, is_linear
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sklearn predict vs sparse linear fast path")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads per test set")
+    args = parser.parse_args()
+
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+
+    for model_choice, model_path in model_paths[args.dataset].items():
+        model = joblib.load(model_path)
+        if not is_linear(model):
+            print(f"\n⏭️ {model_choice}: not a linear model, skipped")
+            continue
+        fast_model = SparseLinearModel.from_model(model)
+
+        payloads = []
+        for payload_type in ["legitimate", "malicious", "adv_ms", "adv_ml"]:
+            data = load_dataset(construct_path(args.dataset, model_choice, payload_type=payload_type))
+            payloads.extend(data["payload"].tolist()[:args.samples])
+        active = extractor.extract_active(payloads)
+        features = extractor.extract_features(payloads)
+
+        start = time.perf_counter()
+        sklearn_pred = [model.predict([row])[0] for row in features]
+        sklearn_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast_pred = [fast_model.predict_active([indices])[0] for indices in active]
+        fast_time = time.perf_counter() - start
+
+        n = len(payloads)
+        agreement = np.mean(np.asarray(sklearn_pred) == np.asarray(fast_pred))
+        print(f"\n🔍 {model_choice} ({len(fast_model.nonzero)}/{len(fast_model.weights)} non-zero weights, {n} payloads)")
+        print(f"🔹 sklearn predict:  {sklearn_time / n * 1e6:9.2f} µs/decision")
+        print(f"🔹 sparse fast path: {fast_time / n * 1e6:9.2f} µs/decision ({sklearn_time / fast_time:.1f}x)")
+        print(f"🔹 Prediction agreement: {agreement:.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Memoria per worker con i modelli caricati da joblib e dall'archivio condiviso (model_store.py).
+
+Per ogni modalità avvia --workers processi che restano vivi insieme, ognuno
+con tutti i modelli di model_paths caricati tramite ModelRegistry e usati
+per una predict su un batch di feature (come dopo le prime richieste):
+
+    none    nessun modello (interprete, numpy, registro): il riferimento
+    joblib  joblib.load in ogni processo (comportamento attuale)
+    mmap    joblib.load con mmap_mode="r" sui file originali
+    store   modelli mappati in sola lettura dall'archivio su /dev/shm
+
+Con tutti i worker vivi legge /proc/<pid>/smaps_rollup: RSS, PSS (le pagine
+condivise divise tra i processi che le mappano) e USS (pagine private) per
+worker, e la somma dei PSS, cioè la memoria realmente occupata. Prima della
+misura verifica che i modelli dell'archivio diano le stesse predizioni dei
+modelli joblib ed esce con codice 1 se non è così.
+
+    python3 benchmark_model_store.py --workers 4
+    python3 benchmark_model_store.py --workers 8 --datasets modsec --store /dev/shm/modsec_model_store-1000
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from model_registry import ModelRegistry
+from model_store import ModelStore
+
+MODES = ("none", "joblib", "mmap", "store")
+SMAPS_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def n_features(model):
+    if hasattr(model, "n_features_in_"):
+        return int(model.n_features_in_)
+    weights = getattr(model, "weights", None)
+    return len(weights) if weights is not None else int(np.asarray(model.coef_).shape[-1])
+
+
+def sample_features(model, rows, seed=0):
+    """Feature binarie sparse come le attivazioni delle regole CRS."""
+    rng = np.random.default_rng(seed)
+    X = (rng.random((rows, n_features(model))) < 0.05).astype(np.float64)
+    X[: max(1, rows // 10)] = 0.0
+    return X
+
+
+def run_worker(mode, paths, store_dir, touch_rows):
+    start = time.perf_counter()
+    store = ModelStore(store_dir) if mode == "store" else None
+    registry = ModelRegistry(paths, mmap_mode="r" if mode == "mmap" else None, store=store)
+    # stdout porta al padre solo la riga JSON finale (il registro stampa un messaggio per modello)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if mode != "none":
+            registry.preload()
+            for dataset, models in paths.items():
+                for name in models:
+                    model = registry.get(dataset, name)
+                    model.predict(sample_features(model, touch_rows))
+    print(json.dumps({"ready": True, "seconds": time.perf_counter() - start}), flush=True)
+    # Il processo resta vivo finché il padre non ha misurato la memoria di tutti i worker
+    sys.stdin.read()
+
+
+def smaps_rollup(pid):
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in SMAPS_FIELDS:
+                values[name] = int(rest.split()[0]) * 1024
+    return {"rss": values["Rss"], "pss": values["Pss"], "uss": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def measure(mode, workers, paths, store_dir, touch_rows):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", mode, "--paths", json.dumps(paths),
+               "--store", store_dir, "--touch-rows", str(touch_rows)]
+    processes = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                 for _ in range(workers)]
+    try:
+        ready = [json.loads(process.stdout.readline()) for process in processes]
+        memory = [smaps_rollup(process.pid) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+        for process in processes:
+            process.wait()
+    mean = {key: sum(m[key] for m in memory) / workers for key in ("rss", "pss", "uss")}
+    return dict(mean, total_pss=sum(m["pss"] for m in memory),
+                load_ms=sum(r["seconds"] for r in ready) / workers * 1000)
+
+
+def check_parity(paths, store, samples):
+    """Modelli con predizioni diverse tra joblib e archivio: [(dataset/modello, quota diversa)]."""
+    import joblib
+
+    mismatches = []
+    for dataset, models in paths.items():
+        for name, path in models.items():
+            original = joblib.load(path)
+            attached = store.attach(path)
+            X = sample_features(original, samples, seed=1)
+            differ = float(np.mean(np.asarray(original.predict(X)) != np.asarray(attached.predict(X))))
+            print(f"   {dataset}/{name}: {type(original).__name__} -> {type(attached).__name__}, "
+                  f"{'identical' if not differ else f'{differ:.2%} predictions differ'}")
+            if differ:
+                mismatches.append((f"{dataset}/{name}", differ))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory with joblib models vs the shared model store")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--datasets", nargs="+", default=None, help="default: all datasets of model_paths")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--store", default=None, help="store directory (default: a new one in /dev/shm)")
+    parser.add_argument("--touch-rows", type=int, default=256, help="rows predicted by each worker after loading")
+    parser.add_argument("--samples", type=int, default=2000, help="rows used for the parity check")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--paths", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args.worker, json.loads(args.paths), args.store, args.touch_rows)
+
+    from complete_client_eval import model_paths
+
+    paths = {dataset: {name: path for name, path in models.items() if os.path.isfile(path)}
+             for dataset, models in model_paths.items() if args.datasets is None or dataset in args.datasets}
+    paths = {dataset: models for dataset, models in paths.items() if models}
+    count = sum(len(models) for models in paths.values())
+    if not count:
+        print("❌ No model files found (run from the project root)")
+        return 1
+    store_dir = args.store or tempfile.mkdtemp(prefix="modsec_model_store_",
+                                               dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+    store = ModelStore(store_dir)
+    start = time.perf_counter()
+    for models in paths.values():
+        for path in models.values():
+            store.build(path)
+    store_bytes = sum(entry["bytes"] for entry in store.entries())
+    print(f"📦 {count} models in {store_dir}: {store_bytes / 2**20:.1f} MiB, built in "
+          f"{time.perf_counter() - start:.1f} s")
+    mismatches = check_parity(paths, store, args.samples)
+
+    print(f"\n🔍 {args.workers} workers per mode, {count} models each")
+    print(f"{'mode':<8}{'RSS/worker':>12}{'PSS/worker':>12}{'USS/worker':>12}{'total PSS':>12}{'load ms':>10}")
+    results = {}
+    for mode in args.modes:
+        result = results[mode] = measure(mode, args.workers, paths, store_dir, args.touch_rows)
+        print(f"{mode:<8}{result['rss'] / 2**20:>10.1f}Mi{result['pss'] / 2**20:>10.1f}Mi"
+              f"{result['uss'] / 2**20:>10.1f}Mi{result['total_pss'] / 2**20:>10.1f}Mi{result['load_ms']:>10.0f}")
+    if "joblib" in results and "store" in results:
+        before, after = results["joblib"], results["store"]
+        print(f"\n🔹 Private memory per worker: {before['uss'] / 2**20:.1f} -> {after['uss'] / 2**20:.1f} MiB; "
+              f"total for {args.workers} workers: {before['total_pss'] / 2**20:.1f} -> "
+              f"{after['total_pss'] / 2**20:.1f} MiB (store files on tmpfs: {store_bytes / 2**20:.1f} MiB)")
+
+    if mismatches:
+        print(f"❌ {len(mismatches)} models predict differently from the store")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
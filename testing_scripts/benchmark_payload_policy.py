@@ -0,0 +1,125 @@
+"""
+Impatto sull'accuratezza e sul costo delle politiche di payload_policy.py.
+
+Per ogni insieme di test valuta la decisione combinata senza politica
+(riferimento) e con ciascuna configurazione: limite di lunghezza con le
+politiche head / head_tail / block / allow e pre-filtro dei payload sicuri.
+Riporta per ogni configurazione il tasso di blocco per tipo di payload
+(1 - FPR sui legittimi, recall sugli altri), l'accuratezza complessiva, i
+verdetti cambiati rispetto al riferimento, la quota di payload decisi senza
+scoring o troncati e il tempo per payload.
+
+I payload dei dataset sono brevi: --pad-bytes antepone a ciascun payload un
+testo neutro lungo N byte (l'attacco finisce in coda a un corpo lungo), per
+misurare i limiti di lunghezza sui corpi che giustificano la politica.
+
+    python3 benchmark_payload_policy.py --dataset modsec --model inf_svm --samples 1000
+    python3 benchmark_payload_policy.py --pad-bytes 20000 --max-lengths 1024 4096
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+import waf_engine
+from feature_service import FeatureService
+from payload_policy import PayloadPolicy, SUGGESTED_SAFE_PATTERN, OVERSIZE_POLICIES
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+payload_types = ["legitimate", "malicious", "adv_ms", "adv_ml"]
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit "
+
+
+def policies(max_lengths, safe_pattern):
+    configs = [("safe prefilter", PayloadPolicy(max_length=0, safe_pattern=safe_pattern))]
+    for max_length in max_lengths:
+        for oversize in OVERSIZE_POLICIES:
+            configs.append((f"{oversize} {max_length}", PayloadPolicy(max_length=max_length, oversize=oversize,
+                                                                      safe_pattern=None)))
+    configs.append(("default (env)", PayloadPolicy.from_env()))
+    return configs
+
+
+def evaluate(payloads, score, policy=None):
+    """(verdetti combinati, secondi, quota decisa senza scoring, quota troncata)."""
+    start = time.perf_counter()
+    if policy is None:
+        combined = score(payloads)[2]
+        reasons = [None] * len(payloads)
+    else:
+        _, _, combined, reasons = policy.score_batch(payloads, score)
+    elapsed = time.perf_counter() - start
+    n = max(len(payloads), 1)
+    early = sum(1 for reason in reasons if reason is not None and reason != "truncated")
+    truncated = sum(1 for reason in reasons if reason == "truncated")
+    return np.asarray(combined, dtype=int), elapsed, early / n, truncated / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and cost of the payload length limits and prefilter")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads per test set")
+    parser.add_argument("--max-lengths", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--safe-pattern", default=SUGGESTED_SAFE_PATTERN)
+    parser.add_argument("--pad-bytes", type=int, default=0, help="prepend N bytes of neutral text to every payload")
+    parser.add_argument("--strategy", choices=scoring.STRATEGIES, default="both")
+    args = parser.parse_args()
+
+    model = joblib.load(model_paths[args.dataset][args.model])
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+    if args.strategy != "single_pass":
+        waf_engine.preload(crs_rules_dir, pl=1)
+
+    def score(payloads):
+        return scoring.score_batch(payloads, model, extractor, crs_rules_dir, strategy=args.strategy)
+
+    padding = (FILLER * (args.pad_bytes // len(FILLER) + 1))[:args.pad_bytes]
+    data = {}
+    for payload_type in payload_types:
+        payloads = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))["payload"]
+        data[payload_type] = [padding + str(payload) for payload in payloads.tolist()[:args.samples]]
+    labels = {payload_type: int(payload_type != "legitimate") for payload_type in payload_types}
+
+    configs = policies(args.max_lengths, args.safe_pattern)
+    for _, policy in configs:
+        policy.bind_model(model, extractor)
+
+    print(f"🔍 {args.dataset}/{args.model}, {args.samples} payloads per set, padding {args.pad_bytes} bytes, "
+          f"strategy {args.strategy}")
+    header = (f"{'policy':<18}" + "".join(f"{t:>12}" for t in payload_types)
+              + f"{'accuracy':>10}{'changed':>9}{'early':>8}{'trunc':>8}{'ms/payload':>12}")
+    print(header)
+
+    baseline = {}
+    for name, policy in [("no policy", None)] + configs:
+        rates, correct, total, changed, elapsed, early, truncated = [], 0, 0, 0, 0.0, 0.0, 0.0
+        for payload_type in payload_types:
+            payloads = data[payload_type]
+            combined, seconds, early_share, truncated_share = evaluate(payloads, score, policy)
+            if policy is None:
+                baseline[payload_type] = combined
+            # Tasso di verdetti corretti: Allowed per i legittimi, Blocked per gli altri
+            rates.append(float(np.mean(combined == labels[payload_type])) if len(payloads) else 0.0)
+            correct += int(np.sum(combined == labels[payload_type]))
+            total += len(payloads)
+            changed += int(np.sum(combined != baseline[payload_type]))
+            elapsed += seconds
+            early += early_share * len(payloads)
+            truncated += truncated_share * len(payloads)
+        total = max(total, 1)
+        print(f"{name:<18}" + "".join(f"{rate:>12.4f}" for rate in rates)
+              + f"{correct / total:>10.4f}{changed:>9}{early / total:>8.1%}{truncated / total:>8.1%}"
+              f"{elapsed / total * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark richieste/secondo al variare del numero di worker pre-fork (prefork.py).
+
+Per ogni valore di --workers-list avvia prefork.py come sottoprocesso, attende
+che /_prefork/stats risponda, lo carica con load_test.run_load (anello chiuso,
+--concurrency richieste in volo) e riporta throughput, latenze e la coda di
+accept massima osservata, poi lo arresta con SIGTERM.
+
+Senza --app viene servita l'app di prova di questo file, che per ogni
+richiesta consuma --work-ms di CPU (--work cpu, come estrazione + predict)
+oppure attende --work-ms (--work sleep, come una chiamata I/O): con un solo
+core il caso cpu non scala con i worker, il caso sleep sì.
+
+    python3 benchmark_prefork.py --workers-list 1 2 4 8 --work sleep --work-ms 10
+    python3 benchmark_prefork.py --app server_vulnerable:app --preload server_vulnerable:models.preload \\
+        --url-path /vulnerable --payload-file payloads.txt
+"""
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from load_test import run_load, summarize
+
+PREFORK = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'apache_server_waf', 'prefork.py')
+
+
+def app(environ, start_response):
+    """App WSGI di prova: lavoro fisso per richiesta (BENCH_WORK=cpu|sleep, BENCH_WORK_MS)."""
+    length = int(environ.get("CONTENT_LENGTH") or 0)
+    if length:
+        environ["wsgi.input"].read(length)
+    work_ms = float(os.environ.get("BENCH_WORK_MS", "5"))
+    if os.environ.get("BENCH_WORK", "cpu") == "sleep":
+        time.sleep(work_ms / 1000.0)
+    else:
+        deadline = time.perf_counter() + work_ms / 1000.0
+        while time.perf_counter() < deadline:
+            pass
+    body = b"Allowed"
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _stats(port, timeout=1.0):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_prefork/stats", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def start_server(args, workers, port):
+    command = [sys.executable, PREFORK, args.app or "benchmark_prefork:app", "--workers", str(workers),
+               "--port", str(port), "--path", os.path.dirname(os.path.abspath(__file__))]
+    for spec in args.preload:
+        command += ["--preload", spec]
+    env = dict(os.environ, BENCH_WORK=args.work, BENCH_WORK_MS=str(args.work_ms))
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"prefork.py exited with code {process.returncode}")
+        try:
+            _stats(port)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"prefork.py did not answer within {args.startup_timeout} s")
+
+
+def sample_accept_queue(port, stop, peaks):
+    """Campiona la coda di accept durante il carico (il massimo finisce in peaks[0])."""
+    while not stop.wait(0.05):
+        try:
+            peaks[0] = max(peaks[0], _stats(port)["accept_queue"])
+        except (OSError, ValueError, KeyError):
+            # Con tutti i worker occupati anche la richiesta delle statistiche resta in coda
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests/second of the pre-forked server vs worker count")
+    parser.add_argument("--workers-list", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--app", default=None, help="module:attribute of the WSGI app (default: built-in stand-in)")
+    parser.add_argument("--preload", action="append", default=[], help="module:callable passed to prefork.py")
+    parser.add_argument("--url-path", default="/")
+    parser.add_argument("--work", choices=["cpu", "sleep"], default="cpu", help="stand-in app work per request")
+    parser.add_argument("--work-ms", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--payload-file", default=None, help="one payload per line (default: a fixed query)")
+    parser.add_argument("--output", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.payload_file:
+        with open(args.payload_file) as f:
+            payloads = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        payloads = ["SELECT name FROM products WHERE id = 42"]
+
+    print(f"🖥️ CPUs: {os.cpu_count()} | app: {args.app or f'stand-in ({args.work}, {args.work_ms} ms)'} | "
+          f"concurrency {args.concurrency} | {args.requests} requests")
+    results = []
+    for workers in args.workers_list:
+        port = _free_port()
+        process = start_server(args, workers, port)
+        try:
+            # Riscaldamento: ogni worker serve almeno una richiesta prima della misura
+            run_load(f"http://127.0.0.1:{port}{args.url_path}", payloads, args.concurrency, None,
+                     max(workers * 4, args.concurrency), None, args.timeout)
+            stop, peaks = threading.Event(), [0]
+            sampler = threading.Thread(target=sample_accept_queue, args=(port, stop, peaks), daemon=True)
+            sampler.start()
+            samples, elapsed = run_load(f"http://127.0.0.1:{port}{args.url_path}", payloads, args.concurrency,
+                                        None, args.requests, None, args.timeout)
+            stop.set()
+            sampler.join()
+            stats = _stats(port, timeout=args.timeout)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+
+        summary = summarize(samples, elapsed)
+        summary.update({"workers": workers, "max_accept_queue": peaks[0], "restarts": stats["restarts"]})
+        results.append(summary)
+        print(f"🔹 {workers:>3} workers | {summary['throughput_rps']:>8.1f} req/s | "
+              f"p50 {summary.get('p50_ms', 0):8.2f} ms | p99 {summary.get('p99_ms', 0):8.2f} ms | "
+              f"errors {summary['error_rate'] * 100:5.2f}% | max accept queue {peaks[0]}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
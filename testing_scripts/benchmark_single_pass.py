@@ -0,0 +1,72 @@
+"""
+Verifica e benchmark della valutazione a passata singola del CRS (FeatureService.evaluate).
+
+Per ogni insieme di test confronta le due passate attuali (PyModSecurity PL1
+per il verdetto WAF + estrattore PL4 per le feature) con la passata singola
+PL4 da cui si ricavano entrambi: accordo dei verdetti WAF, tempo per payload
+e memoria della matrice di feature densa rispetto alla CSR.
+
+    python3 benchmark_single_pass.py --dataset modsec --model inf_svm --samples 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+import waf_engine
+from feature_service import FeatureService
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Two CRS passes (PL1 WAF + PL4 features) vs a single PL4 pass")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm")
+    parser.add_argument("--samples", type=int, default=500, help="payloads per test set")
+    args = parser.parse_args()
+
+    model = joblib.load(model_paths[args.dataset][args.model])
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+    waf_engine.preload(crs_rules_dir, pl=1)
+
+    for payload_type in ["legitimate", "malicious", "adv_ms", "adv_ml"]:
+        data = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))
+        payloads = data["payload"].tolist()[:args.samples]
+        n = len(payloads)
+        print(f"\n🔍 {payload_type}: {n} payloads ({args.dataset}, {args.model})")
+
+        start = time.perf_counter()
+        waf_two, ml_two, combined_two = scoring.score_batch(payloads, model, extractor, crs_rules_dir, strategy="both")
+        two_pass = time.perf_counter() - start
+
+        start = time.perf_counter()
+        waf_one, ml_one, combined_one = scoring.score_batch(payloads, model, extractor, crs_rules_dir,
+                                                            strategy="single_pass")
+        one_pass = time.perf_counter() - start
+
+        active = extractor.extract_active(payloads)
+        dense = extractor.to_dense(active)
+        csr = extractor.to_sparse(active)
+        csr_bytes = csr.data.nbytes + csr.indices.nbytes + csr.indptr.nbytes
+
+        disagree = np.flatnonzero(waf_two != waf_one)
+        print(f"🔹 Two passes:  {two_pass / n * 1000:8.3f} ms/payload")
+        print(f"🔹 Single pass: {one_pass / n * 1000:8.3f} ms/payload ({two_pass / one_pass:.2f}x)")
+        print(f"🔹 WAF verdict agreement: {1 - len(disagree) / n:.4f} | "
+              f"ML agreement: {np.mean(ml_two == ml_one):.4f} | "
+              f"combined agreement: {np.mean(combined_two == combined_one):.4f}")
+        print(f"🔹 Features: dense {dense.nbytes / 1024:.1f} KiB | CSR {csr_bytes / 1024:.1f} KiB")
+        for i in disagree[:5]:
+            print(f"   ⚠️ WAF PL1 {waf_two[i]} vs single pass {waf_one[i]}: {payloads[i][:120]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Tempo di avvio a freddo e RSS di picco dei punti di ingresso (python -X importtime).
+
+Ogni punto di ingresso viene importato in un processo Python nuovo con
+-X importtime: per ciascuno riporta il tempo totale del processo (minimo su
+--repeat esecuzioni), il tempo di import, l'RSS di picco (wait4) e i
+pacchetti più costosi. Segnala anche se vengono caricati pacchetti che non servono
+alla decisione (pandas, matplotlib, ...).
+
+Con --save-baseline i risultati vengono salvati; con --baseline vengono
+confrontati con quelli salvati e lo script esce con codice 1 se tempo o RSS
+peggiorano oltre --tolerance, o se compare un pacchetto pesante che prima
+non veniva caricato.
+
+    python3 benchmark_startup.py
+    python3 benchmark_startup.py --save-baseline startup_baseline.json
+    python3 benchmark_startup.py --baseline startup_baseline.json --tolerance 0.25
+    python3 benchmark_startup.py --entry decision_script --cwd /home/cris/modsecproj/modsec-advlearn
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+WAF_DIR = os.path.join(ROOT, 'apache_server_waf')
+TESTING_DIR = os.path.join(ROOT, 'testing_scripts')
+DEMO_DIR = os.path.join(TESTING_DIR, 'demo_scripts')
+
+# Punto di ingresso -> (modulo importato, cartelle aggiunte a sys.path)
+ENTRY_POINTS = {
+    "decision_client": ("decision_client", [WAF_DIR]),
+    "decision_daemon": ("decision_daemon", [WAF_DIR]),
+    "decision_script": ("decision_script", [WAF_DIR]),
+    "prefork": ("prefork", [WAF_DIR]),
+    # Moduli del percorso di decisione senza modello (decision_script richiede i file del modello)
+    "scoring_path": ("feature_service, scoring, payload_policy, verdict_cache, decision_log", [WAF_DIR]),
+    "server_vulnerable": ("server_vulnerable", [TESTING_DIR]),
+    "server_demo": ("server_demo", [DEMO_DIR]),
+    "complete_client_eval": ("complete_client_eval", [TESTING_DIR]),
+    "load_test": ("load_test", [TESTING_DIR]),
+    "result_plot": ("result_plot", [TESTING_DIR]),
+}
+
+# Pacchetti che non servono sul percorso di decisione
+HEAVY_PACKAGES = ("pandas", "matplotlib", "scipy", "sklearn", "requests", "toml", "torch", "tensorflow")
+
+
+def parse_importtime(text):
+    """[(modulo, self_us, cumulative_us, livello)] dall'output di -X importtime."""
+    entries = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            entries.append((name.strip(), int(self_us), int(cumulative_us),
+                            (len(name) - len(name.lstrip())) // 2))
+        except ValueError:
+            continue
+    return entries
+
+
+def run_once(module, paths, cwd, env):
+    code = f"import sys; sys.path[:0] = {paths!r}; import {module}"
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 restituisce le risorse del solo processo figlio (ru_maxrss in KiB su Linux)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_ms = (time.perf_counter() - start) * 1000.0
+        stderr.seek(0)
+        output = stderr.read().decode("utf-8", errors="replace")
+    return process.returncode, wall_ms, usage.ru_maxrss / 1024.0, output
+
+
+def measure(name, cwd, repeat, top, env):
+    module, paths = ENTRY_POINTS[name]
+    runs = [run_once(module, paths, cwd, env) for _ in range(repeat)]
+    code, _, _, output = runs[-1]
+    if code != 0:
+        errors = [line for line in output.splitlines() if not line.startswith("import time:")]
+        return {"entry": name, "ok": False, "error": errors[-1] if errors else f"exit code {code}"}
+
+    entries = parse_importtime(output)
+    # Costo di ciascun pacchetto: il cumulativo del suo import più esterno (include le sue dipendenze)
+    packages = {}
+    for entry_name, _, cumulative_us, _ in entries:
+        package = entry_name.split(".")[0]
+        packages[package] = max(packages.get(package, 0), cumulative_us)
+    for skipped in [name.strip() for name in module.split(",")] + ["site", "encodings"]:
+        packages.pop(skipped, None)
+    heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {
+        "entry": name,
+        "ok": True,
+        "wall_ms": round(min(run[1] for run in runs), 1),
+        "import_ms": round(sum(entry[1] for entry in entries) / 1000.0, 1),
+        "peak_rss_mb": round(min(run[2] for run in runs), 1),
+        "modules": len(entries),
+        "heavy_packages": sorted(package for package in HEAVY_PACKAGES if package in packages),
+        "heaviest": [{"package": package, "cumulative_ms": round(us / 1000.0, 1)} for package, us in heaviest],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressioni rispetto al baseline: [(punto di ingresso, descrizione)]."""
+    previous = {result["entry"]: result for result in baseline if result.get("ok")}
+    regressions = []
+    for result in results:
+        old = previous.get(result["entry"])
+        if old is None:
+            continue
+        if not result["ok"]:
+            regressions.append((result["entry"], f"fails to start: {result['error']}"))
+            continue
+        for key in ("wall_ms", "peak_rss_mb"):
+            if result[key] > old[key] * (1 + tolerance):
+                regressions.append((result["entry"], f"{key} {old[key]} -> {result[key]}"))
+        for package in sorted(set(result["heavy_packages"]) - set(old["heavy_packages"])):
+            regressions.append((result["entry"], f"now imports {package}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time and peak RSS of the decision entry points")
+    parser.add_argument("--entry", nargs="+", choices=sorted(ENTRY_POINTS), default=sorted(ENTRY_POINTS))
+    parser.add_argument("--cwd", default=ROOT, help="working directory (relative model and CRS paths)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="heaviest imported packages to show")
+    parser.add_argument("--baseline", default=None, help="compare with a saved baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown / RSS growth")
+    parser.add_argument("--save-baseline", default=None)
+    args = parser.parse_args()
+
+    # Gli stessi valori di default dei servizi: nessun preload dei modelli nei server
+    env = dict(os.environ, MODEL_PRELOAD="0")
+    results = []
+    for name in args.entry:
+        result = measure(name, args.cwd, args.repeat, args.top, env)
+        results.append(result)
+        if not result["ok"]:
+            print(f"❌ {name:<22} {result['error']}")
+            continue
+        heavy = ", ".join(result["heavy_packages"]) or "-"
+        print(f"🔹 {name:<22} {result['wall_ms']:>8.1f} ms | imports {result['import_ms']:>8.1f} ms | "
+              f"peak RSS {result['peak_rss_mb']:>7.1f} MiB | {result['modules']:>4} modules | heavy: {heavy}")
+        for entry in result["heaviest"]:
+            print(f"      {entry['cumulative_ms']:>8.1f} ms  {entry['package']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"📄 Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, description in regressions:
+            print(f"⚠️ {name}: {description}")
+        if regressions:
+            return 1
+        print("✅ No startup regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Benchmark delle strategie di valutazione della decisione combinata (scoring.py).
+
+Per ogni insieme di test (legittimi, malevoli, avversari ModSecurity e ML)
+confronta le strategie both / waf_first / ml_first / adaptive: latenza per
+payload, numero di valutazioni di ciascun motore e verifica che la decisione
+combinata sia identica a quella con entrambi i motori.
+
+    python3 benchmark_strategies.py --dataset modsec --model inf_svm --samples 500
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+import waf_engine
+from feature_service import FeatureService
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Short-circuit evaluation strategies for the combined decision")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm")
+    parser.add_argument("--samples", type=int, default=500, help="payloads per test set")
+    parser.add_argument("--batch-size", type=int, default=1, help="1 = one decision per request, as in production")
+    args = parser.parse_args()
+
+    model = joblib.load(model_paths[args.dataset][args.model])
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+    waf_engine.preload(crs_rules_dir, pl=1)
+
+    for payload_type in ["malicious", "adv_ms", "adv_ml", "legitimate"]:
+        data = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))
+        payloads = data["payload"].tolist()[:args.samples]
+        print(f"\n🔍 {payload_type}: {len(payloads)} payloads ({args.dataset}, {args.model})")
+
+        reference = None
+        for strategy in scoring.STRATEGIES:
+            stats = scoring.EngineStats()
+            waf_runs, ml_runs, combined = 0, 0, []
+            start = time.perf_counter()
+            for i in range(0, len(payloads), args.batch_size):
+                waf_pred, ml_pred, combined_pred = scoring.score_batch(
+                    payloads[i:i + args.batch_size], model, extractor, crs_rules_dir, strategy=strategy, stats=stats)
+                waf_runs += int((waf_pred != scoring.NOT_EVALUATED).sum())
+                ml_runs += int((ml_pred != scoring.NOT_EVALUATED).sum())
+                combined.append(combined_pred)
+            elapsed = time.perf_counter() - start
+            combined = np.concatenate(combined)
+            if reference is None:
+                reference = combined
+            same = np.array_equal(reference, combined)
+            print(f"🔹 {strategy:>9}: {elapsed / len(payloads) * 1000:8.3f} ms/payload | "
+                  f"WAF evaluated {waf_runs}/{len(payloads)} | ML evaluated {ml_runs}/{len(payloads)} | "
+                  f"same combined decision: {same}")
+
+
+if __name__ == "__main__":
+    main()
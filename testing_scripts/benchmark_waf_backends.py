@@ -0,0 +1,82 @@
+"""
+Benchmark dei backend WAF di server_vulnerable.py.
+
+Confronta il backend in-process (PyModSecurity dal pool di waf_engine) con
+il backend HTTP (Apache+ModSecurity tramite sessione keep-alive) sui
+payload legittimi e malevoli di test: latenza per payload, tasso di blocco
+e accordo tra i due verdetti. Richiede Apache attivo per il backend HTTP.
+
+Con --batch-sizes misura anche il backend HTTP su batch di N payload, come
+quelli del coalescer (COALESCE_MAX_BATCH): latenza per batch, cioè quanto
+attende l'ultima richiesta del batch, con le POST in sequenza e in parallelo
+(HttpWafBackend.predict).
+
+    python3 benchmark_waf_backends.py --dataset modsec --samples 200
+    python3 benchmark_waf_backends.py --batch-sizes 1 8 32
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+from server_vulnerable import InProcessWafBackend, HttpWafBackend, crs_rules_dir
+from my_utils import *
+
+
+def run(backend, payloads):
+    start = time.perf_counter()
+    decisions = [backend.predict([payload])[0] for payload in payloads]
+    return time.perf_counter() - start, decisions
+
+
+def run_batches(payloads, size, predict):
+    """(durata, numero di batch, verdetti) valutando `payloads` a batch di `size`."""
+    start = time.perf_counter()
+    decisions, batches = [], 0
+    for i in range(0, len(payloads), size):
+        decisions.extend(predict(payloads[i:i + size]))
+        batches += 1
+    return time.perf_counter() - start, batches, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process vs HTTP WAF backend")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--samples", type=int, default=200, help="payloads per class")
+    parser.add_argument("--url", default="http://127.0.0.1/")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[], help="also time the HTTP backend on batches")
+    args = parser.parse_args()
+
+    backends = [InProcessWafBackend(crs_rules_dir, pl=1), HttpWafBackend(args.url)]
+
+    for payload_type in ["legitimate", "malicious"]:
+        data = load_dataset(construct_path(args.dataset, "inf_svm", payload_type=payload_type))
+        payloads = data["payload"].tolist()[:args.samples]
+        print(f"\n🔍 {payload_type}: {len(payloads)} payloads ({args.dataset})")
+
+        results = {}
+        for backend in backends:
+            elapsed, decisions = run(backend, payloads)
+            results[backend.name] = decisions
+            blocked = sum(decision == "Blocked" for decision in decisions)
+            print(f"🔹 {backend.name:>9}: {elapsed / len(payloads) * 1000:8.3f} ms/payload | "
+                  f"blocked {blocked}/{len(payloads)}")
+
+        agreement = sum(a == b for a, b in zip(results["inprocess"], results["http"])) / len(payloads)
+        print(f"🔹 Agreement in-process vs HTTP: {agreement:.4f}")
+
+        http = backends[1]
+        for size in args.batch_sizes:
+            for label, predict in (("sequential", lambda batch: [http._post(payload) for payload in batch]),
+                                   ("concurrent", http.predict)):
+                elapsed, batches, decisions = run_batches(payloads, size, predict)
+                differ = sum(a != b for a, b in zip(decisions, results["http"]))
+                print(f"🔹 http batch {size:>3} {label:>10}: {elapsed / batches * 1000:8.3f} ms/batch | "
+                      f"{elapsed / len(payloads) * 1000:8.3f} ms/payload"
+                      f"{'' if not differ else f' | ⚠️ {differ} verdicts differ'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Benchmark del costo per payload della decisione ModSecurity.
+
+Confronta il comportamento precedente (PyModSecurity ricostruito a ogni chiamata,
+come faceva combined_decision) con il motore precompilato del pool di waf_engine,
+sui dataset di test del progetto. Verifica anche che i verdetti coincidano.
+
+    python3 benchmark_waf_engine.py --dataset modsec --samples 100
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from src.models import PyModSecurity
+import waf_engine
+from my_utils import *
+
+
+def load_test_payloads(dataset_choice, samples):
+    """Carica payloads legittimi e malevoli di test (i primi `samples` di ciascuno)."""
+    payloads = []
+    for payload_type in ["legitimate", "malicious"]:
+        data = load_dataset(construct_path(dataset_choice, "inf_svm", payload_type=payload_type))
+        payloads.extend(data["payload"].tolist()[:samples])
+    return payloads
+
+
+def bench_rebuild(payloads, rules_dir, pl):
+    """Comportamento precedente: un nuovo PyModSecurity per ogni payload."""
+    verdicts = []
+    start = time.perf_counter()
+    for payload in payloads:
+        waf = PyModSecurity(rules_dir=rules_dir, pl=pl)
+        verdicts.append(int(waf.predict(np.array([payload]))[0] > 0))
+    return time.perf_counter() - start, verdicts
+
+
+def bench_shared(payloads, rules_dir, pl):
+    """Motore compilato una sola volta e preso dal pool."""
+    verdicts = []
+    start = time.perf_counter()
+    for payload in payloads:
+        with waf_engine.waf_engine(rules_dir, pl=pl) as waf:
+            verdicts.append(int(waf.predict(np.array([payload]))[0] > 0))
+    return time.perf_counter() - start, verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyModSecurity per-payload cost: rebuild vs shared engine")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--samples", type=int, default=100, help="payloads per class")
+    parser.add_argument("--rules-dir", default="./coreruleset/rules/")
+    parser.add_argument("--pl", type=int, default=1)
+    args = parser.parse_args()
+
+    payloads = load_test_payloads(args.dataset, args.samples)
+    print(f"🔍 {len(payloads)} payloads from {args.dataset} (legitimate + malicious)")
+
+    start = time.perf_counter()
+    waf_engine.preload(args.rules_dir, pl=args.pl)
+    build_time = time.perf_counter() - start
+
+    rebuild_time, rebuild_verdicts = bench_rebuild(payloads, args.rules_dir, args.pl)
+    shared_time, shared_verdicts = bench_shared(payloads, args.rules_dir, args.pl)
+
+    n = len(payloads)
+    print(f"🔹 One-off engine build: {build_time * 1000:.1f} ms")
+    print(f"🔹 Before (rebuild per payload): {rebuild_time / n * 1000:.3f} ms/payload")
+    print(f"🔹 After (shared engine):        {shared_time / n * 1000:.3f} ms/payload")
+    print(f"🔹 Speedup: {rebuild_time / shared_time:.1f}x")
+    print(f"🔹 Identical verdicts: {rebuild_verdicts == shared_verdicts}")
+    print(f"🔹 Engine stats: {waf_engine.engine_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Calibrazione offline delle soglie della cascata (apache_server_waf/cascade.py).
+
+Sugli insiemi di test (legittimi, malevoli, avversari) valuta il percorso
+completo (ModSecurity PL1 OR modello richiesto) e lo score del modello
+lineare economico. Tra le coppie di soglie (allow_below, block_above) prese
+dai quantili degli score sceglie quella che inoltra meno payload al
+percorso completo mantenendo entro --tolerance dai valori del percorso
+completo l'accuratezza complessiva, la recall di ogni insieme di attacchi
+(malevoli e avversari) e il tasso di Allowed sui legittimi (niente falsi
+positivi in più in cambio di recall).
+
+Il report riporta per insieme il tasso di verdetti corretti del percorso
+completo e della cascata e la quota inoltrata, poi la latenza per payload
+misurata eseguendo la cascata calibrata: feature + modello economico per
+tutti, ModSecurity + modello richiesto solo per gli inoltrati. Soglie e
+report sono salvati nel file letto da MODSEC_CASCADE (decision_script) e
+da CASCADE_DIR (server_vulnerable).
+
+    python3 calibrate_cascade.py --dataset modsec --model inf_svm --cheap log_reg_l1
+    python3 calibrate_cascade.py --dataset modsec --model rf --tolerance 0.001 --output data/cascade_modsec_rf.json
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+import scoring
+import waf_engine
+from cascade import Cascade, load_cheap_model
+from feature_service import FeatureService
+from complete_client_eval import model_paths, crs_rules_dir, crs_ids_path
+from my_utils import *
+
+payload_types = ["legitimate", "malicious", "adv_ms", "adv_ml"]
+
+
+def side_deltas(order, correct_if, reference_correct, sets, n_sets):
+    """Per ogni prefisso di `order`: variazione dei verdetti corretti per insieme se quei payload
+    vengono decisi dal primo stadio con `correct_if` al posto del percorso completo."""
+    delta = correct_if[order].astype(int) - reference_correct[order].astype(int)
+    per_set = np.zeros((n_sets, len(order) + 1), dtype=int)
+    for t in range(n_sets):
+        per_set[t, 1:] = np.cumsum(np.where(sets[order] == t, delta, 0))
+    return per_set
+
+
+def calibrate(scores, labels, reference, sets, tolerance, candidates):
+    """(allow_below, block_above, payload decisi dal primo stadio) con meno payload inoltrati nei vincoli."""
+    n, n_sets = len(scores), int(sets.max()) + 1
+    reference_correct = reference == labels
+    sizes = np.bincount(sets, minlength=n_sets)
+    base = np.bincount(sets, weights=reference_correct, minlength=n_sets)
+
+    thresholds = np.unique(np.quantile(scores, np.linspace(0.0, 1.0, candidates)))
+    thresholds = np.concatenate(([-np.inf], thresholds, [np.inf]))
+    ascending = np.argsort(scores, kind="stable")
+    descending = ascending[::-1]
+    low = side_deltas(ascending, labels == 0, reference_correct, sets, n_sets)
+    high = side_deltas(descending, labels == 1, reference_correct, sets, n_sets)
+    # Payload con score < a (Allowed) e con score > b (Blocked) per ogni soglia candidata
+    allowed = np.searchsorted(scores[ascending], thresholds, side="left")
+    blocked = n - np.searchsorted(scores[ascending], thresholds, side="right")
+
+    # Griglia (a, b): correct[t] = base[t] + low[t, allowed(a)] + high[t, blocked(b)]
+    correct = base[:, None, None] + low[:, allowed][:, :, None] + high[:, blocked][:, None, :]
+    valid = thresholds[:, None] <= thresholds[None, :]
+    valid &= correct.sum(axis=0) >= base.sum() - tolerance * n
+    for t in range(n_sets):
+        if sizes[t]:
+            valid &= correct[t] >= base[t] - tolerance * sizes[t]
+    decided = allowed[:, None] + blocked[None, :]
+    # Tra le coppie valide: più payload decisi dal primo stadio, poi più verdetti corretti
+    objective = np.where(valid, decided * (n + 1) + correct.sum(axis=0), -1)
+    a, b = np.unravel_index(np.argmax(objective), objective.shape)
+    return float(thresholds[a]), float(thresholds[b]), int(decided[a, b])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the cascade thresholds on the test sets")
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm", help="model of the full path")
+    parser.add_argument("--cheap", default="log_reg_l1", help="linear first-stage model (name or .npz/.joblib path)")
+    parser.add_argument("--samples", type=int, default=1000, help="payloads per test set")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="allowed drop of accuracy and of the correct-verdict rate of each test set")
+    parser.add_argument("--candidates", type=int, default=200, help="score quantiles tried as thresholds")
+    parser.add_argument("--output", default=None, help="default data/cascade_<dataset>_<model>.json")
+    args = parser.parse_args()
+
+    cheap_path = model_paths[args.dataset].get(args.cheap, args.cheap)
+    cheap = load_cheap_model(cheap_path)
+    model = joblib.load(model_paths[args.dataset][args.model])
+    extractor = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4)
+    waf_engine.preload(crs_rules_dir, pl=1)
+
+    payloads, labels, sets, active, waf, ml = [], [], [], [], [], []
+    seconds = {"features": 0.0, "cheap": 0.0, "waf": 0.0, "ml": 0.0}
+    for t, payload_type in enumerate(payload_types):
+        data = load_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))
+        subset = [str(payload) for payload in data["payload"].tolist()[:args.samples]]
+        start = time.perf_counter()
+        subset_active = extractor.extract_active(subset)
+        seconds["features"] += time.perf_counter() - start
+        start = time.perf_counter()
+        waf.append(scoring._run_waf(subset, crs_rules_dir, 1))
+        seconds["waf"] += time.perf_counter() - start
+        start = time.perf_counter()
+        ml.append(scoring._predict_active(model, extractor, subset_active))
+        seconds["ml"] += time.perf_counter() - start
+        payloads += subset
+        active += subset_active
+        labels += [int(payload_type != "legitimate")] * len(subset)
+        sets += [t] * len(subset)
+
+    n = len(payloads)
+    labels, sets = np.asarray(labels), np.asarray(sets)
+    reference = (np.concatenate(waf) == 1) | (np.concatenate(ml) == 1)
+    start = time.perf_counter()
+    scores = cheap.decision_function_active(active)
+    seconds["cheap"] = time.perf_counter() - start
+
+    allow_below, block_above, decided = calibrate(scores, labels, reference, sets, args.tolerance, args.candidates)
+    # Percorso assoluto: il file di calibrazione è letto anche da processi con un'altra cartella di lavoro
+    cascade = Cascade(cheap, allow_below, block_above, cheap_model_path=os.path.abspath(cheap_path))
+
+    # Cascata calibrata eseguita davvero: verdetti e latenza (le feature sono ricalcolate)
+    def escalate(subset, subset_active):
+        return scoring._run_waf(subset, crs_rules_dir, 1), scoring._predict_active(model, extractor, subset_active)
+
+    start = time.perf_counter()
+    _, _, combined = cascade.score_batch(payloads, extractor, escalate)
+    cascade_seconds = time.perf_counter() - start
+    reference_seconds = seconds["features"] + seconds["waf"] + seconds["ml"]
+    escalated = cascade.stats()["stages"]["escalated"]
+
+    print(f"🪜 {args.dataset}/{args.model}, first stage {args.cheap}, {n} payloads, tolerance {args.tolerance}")
+    print(f"🔹 allow_below {allow_below:.6g} | block_above {block_above:.6g}")
+    print(f"{'set':<12}{'payloads':>10}{'full path':>11}{'cascade':>10}{'escalated':>11}")
+    report = {"dataset": args.dataset, "model": args.model, "cheap_model": args.cheap, "payloads": n,
+              "tolerance": args.tolerance, "sets": {}}
+    for t, payload_type in enumerate(payload_types):
+        mask = sets == t
+        if not mask.any():
+            continue
+        full_rate = float(np.mean(reference[mask] == labels[mask]))
+        cascade_rate = float(np.mean(combined[mask] == labels[mask]))
+        escalated_rate = float(np.mean((scores[mask] >= allow_below) & (scores[mask] <= block_above)))
+        report["sets"][payload_type] = {"full_path": round(full_rate, 4), "cascade": round(cascade_rate, 4),
+                                        "escalated": round(escalated_rate, 4)}
+        print(f"{payload_type:<12}{int(mask.sum()):>10}{full_rate:>11.4f}{cascade_rate:>10.4f}{escalated_rate:>11.1%}")
+
+    report.update({
+        "accuracy_full_path": round(float(np.mean(reference == labels)), 4),
+        "accuracy_cascade": round(float(np.mean(combined == labels)), 4),
+        "escalated_rate": round(escalated / n, 4),
+        "full_path_ms_per_payload": round(reference_seconds / n * 1000, 4),
+        "cascade_ms_per_payload": round(cascade_seconds / n * 1000, 4),
+        "stage_ms_per_payload": {stage: round(value / n * 1000, 4) for stage, value in seconds.items()},
+    })
+    print(f"🔹 Accuracy: full path {report['accuracy_full_path']:.4f} | cascade {report['accuracy_cascade']:.4f}")
+    print(f"🔹 Escalated: {escalated}/{n} ({escalated / n:.1%}); decided by the first stage: {decided}")
+    print(f"🔹 Latency: full path {report['full_path_ms_per_payload']:.3f} ms/payload | "
+          f"cascade {report['cascade_ms_per_payload']:.3f} ms/payload "
+          f"({1 - cascade_seconds / reference_seconds:.1%} saved)")
+    print("   " + " | ".join(f"{stage} {value:.3f} ms" for stage, value in report["stage_ms_per_payload"].items()))
+
+    output = args.output or os.path.join("data", f"cascade_{args.dataset}_{args.model}.json")
+    cascade.save(output, report)
+    print(f"📄 Calibration saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
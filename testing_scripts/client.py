@@ -4,8 +4,6 @@
 
 
 import requests
-import pandas as pd
-import pickle
 import json
 import random
 from my_utils import *
@@ -27,20 +27,28 @@ Flask è il livello intermedio che riceve la richiesta dal client, interroga Apa
 """
 
 import requests
-import pandas as pd
-import pickle
 import json
-from sklearn.metrics import accuracy_score, roc_auc_score, f1_score, classification_report
 import numpy as np
 from my_utils import *
-import matplotlib.pyplot as plt
 import os
-from sklearn.metrics import accuracy_score, roc_auc_score, f1_score, classification_report, roc_curve
-from sklearn.utils import shuffle
+import argparse
+import threading
+import time
+import multiprocessing
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from payload_store import open_dataset
 
 
 # URL del server Apache che passa per ModSecurity
 url = "http://127.0.0.1:6000/vulnerable"
+# Endpoint che valuta un batch di payload con una sola richiesta
+batch_url = "http://127.0.0.1:6000/vulnerable_batch"
 
 # List of available models
 models = ["rf", "svm_linear_l1", "svm_linear_l2", "log_reg_l1", "log_reg_l2", "inf_svm"]
@@ -49,9 +57,18 @@ payload_types = ["legitimate", "malicious", "adv_ms", "adv_ml"]
 # List of available datasets
 datasets = ["wafamole", "modsec"]
 
+# Percorsi dei modelli ML (modalità direct, senza server): model_catalog.py, condivisi con i server
+from model_catalog import model_paths
+crs_rules_dir = './coreruleset/rules'
+crs_ids_path = './data/crs_sqli_ids_4.0.0.json'
+
 
 def plot_and_save_roc_curve(y_true, y_pred, output_dir):
     """Genera e salva la curva ROC."""
+    # matplotlib e sklearn solo qui: gli script che importano model_paths da questo modulo non li caricano
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import roc_auc_score, roc_curve
+
     fpr, tpr, _ = roc_curve(y_true, y_pred)
     plt.figure()
     plt.plot(fpr, tpr, color='blue', lw=2, label='ROC Curve (AUC = {:.4f})'.format(roc_auc_score(y_true, y_pred)))
@@ -66,6 +83,8 @@ def plot_and_save_roc_curve(y_true, y_pred, output_dir):
 
 def save_performance_report(y_true, y_pred, output_dir):
     """Salva il rapporto di classificazione e le metriche in un file di testo."""
+    from sklearn.metrics import accuracy_score, roc_auc_score, f1_score, classification_report
+
     accuracy = accuracy_score(y_true, y_pred)
     f1 = f1_score(y_true, y_pred)
     roc_auc = roc_auc_score(y_true, y_pred)
@@ -78,40 +97,250 @@ def save_performance_report(y_true, y_pred, output_dir):
         f.write("📄 Rapporto di classificazione:\n")
         f.write(report)
     # Salva i vettori per eventuali analisi future
-    np.save(os.path.join(output_dir, "y_true.npy"), y_true)
-    np.save(os.path.join(output_dir, "y_pred.npy"), y_pred)
-
-
-def combine_datasets(legitimate_data, malicious_data, adv_ms_data=None, adv_ml_data=None):
-    """Combina i payloads legittimi, malevoli e opzionali avversari in un unico dataset."""
-    combined_payloads = []
-    true_labels = []
-
-    # Aggiungi i payloads legittimi (label 0)
-    combined_payloads.extend(legitimate_data['payload'].tolist())
-    true_labels.extend([0] * len(legitimate_data))
-
-    # Aggiungi i payloads malevoli (label 1)
-    combined_payloads.extend(malicious_data['payload'].tolist())
-    true_labels.extend([1] * len(malicious_data))
-
-    # Aggiungi i payloads avversari (label 1)
-    if adv_ms_data is not None:
-        combined_payloads.extend(adv_ms_data['payload'].tolist())
-        true_labels.extend([1] * len(adv_ms_data))
-
-    # Aggiungi i payloads avversari (label 1)
-    if adv_ml_data is not None:
-        combined_payloads.extend(adv_ml_data['payload'].tolist())
-        true_labels.extend([1] * len(adv_ml_data))
-
-    # Shuffle del dataset
-    combined_payloads, true_labels = shuffle(np.array(combined_payloads), np.array(true_labels), random_state=42)
-    return combined_payloads, true_labels
-
+    # int64 come l'output della valutazione sequenziale originale (le etichette in memoria sono int8)
+    np.save(os.path.join(output_dir, "y_true.npy"), np.asarray(y_true, dtype=np.int64))
+    np.save(os.path.join(output_dir, "y_pred.npy"), np.asarray(y_pred, dtype=np.int64))
+
+
+class CombinedDataset:
+    """Payload legittimi (label 0), malevoli e avversari (label 1) in ordine mescolato, letti a blocchi dagli store."""
+
+    def __init__(self, sources, random_state=42):
+        # sources: [(percorso del dataset, label)]; i payload restano nei file .pstore mappati in memoria
+        self.paths = [path for path, _ in sources]
+        self.stores = [open_dataset(path) for path in self.paths]
+        sizes = [len(store) for store in self.stores]
+        self.bounds = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        labels = np.concatenate([np.full(size, label, dtype=np.int8) for size, (_, label) in zip(sizes, sources)])
+        # Stesso ordine di sklearn.utils.shuffle(..., random_state=42) usato in precedenza
+        self.order = np.random.RandomState(random_state).permutation(len(labels))
+        self.y_true = labels[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def fingerprint(self):
+        return [[path, len(store)] for path, store in zip(self.paths, self.stores)]
+
+    def payloads(self, start, stop):
+        indices = self.order[start:stop]
+        sources = np.searchsorted(self.bounds, indices, side="right") - 1
+        return [self.stores[src][int(idx - self.bounds[src])] for idx, src in zip(indices, sources)]
+
+
+class EvalCheckpoint:
+    """Predizioni su disco (memmap .npy) e matrice di confusione aggiornate a ogni blocco completato."""
+
+    def __init__(self, directory, n, fingerprint):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.progress_path = os.path.join(directory, "progress.json")
+        self.pred_path = os.path.join(directory, "y_pred.npy")
+        progress = None
+        if os.path.isfile(self.progress_path) and os.path.isfile(self.pred_path):
+            with open(self.progress_path) as f:
+                progress = json.load(f)
+            if progress.get("n") != n or progress.get("fingerprint") != fingerprint:
+                print(f"⚠️ Checkpoint in {directory} is for a different dataset, starting over")
+                progress = None
+        if progress is None:
+            self.y_pred = np.lib.format.open_memmap(self.pred_path, mode="w+", dtype=np.int8, shape=(n,))
+            self.y_pred[:] = -1
+            self.y_pred.flush()
+            progress = {"n": n, "fingerprint": fingerprint, "done": 0, "tp": 0, "fp": 0, "tn": 0, "fn": 0}
+            self._save(progress)
+        else:
+            self.y_pred = np.lib.format.open_memmap(self.pred_path, mode="r+")
+        self.progress = progress
+
+    @property
+    def done(self):
+        return self.progress["done"]
+
+    def _save(self, progress):
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def append(self, start, y_pred, y_true):
+        """Registra le predizioni del blocco [start, start + len) e aggiorna le metriche incrementali."""
+        y_pred = np.asarray(y_pred, dtype=np.int8)
+        y_true = np.asarray(y_true, dtype=np.int8)
+        self.y_pred[start:start + len(y_pred)] = y_pred
+        # Prima le predizioni su disco, poi l'avanzamento: una ripresa non salta mai un blocco
+        self.y_pred.flush()
+        progress = dict(self.progress)
+        progress["done"] = start + len(y_pred)
+        progress["tp"] += int(((y_pred == 1) & (y_true == 1)).sum())
+        progress["fp"] += int(((y_pred == 1) & (y_true == 0)).sum())
+        progress["tn"] += int(((y_pred == 0) & (y_true == 0)).sum())
+        progress["fn"] += int(((y_pred == 0) & (y_true == 1)).sum())
+        self._save(progress)
+        self.progress = progress
+
+    def metrics(self):
+        """Accuratezza, F1 e AUC-ROC (predizioni binarie: (TPR + TNR) / 2) dei payload valutati finora."""
+        tp, fp, tn, fn = (self.progress[key] for key in ("tp", "fp", "tn", "fn"))
+        total = tp + fp + tn + fn
+        tpr = tp / (tp + fn) if tp + fn else 0.0
+        tnr = tn / (tn + fp) if tn + fp else 0.0
+        return {
+            "accuracy": (tp + tn) / total if total else 0.0,
+            "f1": 2 * tp / (2 * tp + fp + fn) if tp else 0.0,
+            "roc_auc": (tpr + tnr) / 2,
+        }
+
+    def remove(self):
+        del self.y_pred
+        for path in (self.pred_path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if not os.listdir(self.directory):
+            os.rmdir(self.directory)
+
+
+def send_batch_requests(payloads, model_choice, dataset_choice, batch_url, batch_size):
+    """Invia i payload a blocchi di `batch_size` e restituisce le decisioni combinate nell'ordine originale."""
+    decisions = []
+    for start in range(0, len(payloads), batch_size):
+        chunk = [str(payload) for payload in payloads[start:start + batch_size]]
+        response = requests.post(batch_url, json={
+            "payloads": chunk,
+            "model_choice": model_choice,
+            "dataset_choice": dataset_choice
+        })
+        response.raise_for_status()
+        decisions.extend(response.json()["combined_decision"])
+        print(f"🔍 [Scored {len(decisions)} of {len(payloads)} ({dataset_choice}, {model_choice})]")
+    return decisions
+
+
+class RateLimiter:
+    """Limita le richieste al secondo condivise tra tutti i thread (0 = nessun limite)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(self.next_time, now) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def make_session(pool_size, retries):
+    """Sessione HTTP keep-alive condivisa, con retry e backoff esponenziale."""
+    retry = Retry(total=retries, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504],
+                  allowed_methods=frozenset(["POST"]))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    return session
+
+
+def send_concurrent_requests(payloads, model_choice, dataset_choice, url, concurrency, rate=0, retries=3):
+    """Invia i payload con `concurrency` thread e restituisce le decisioni nell'ordine originale."""
+    session = make_session(concurrency, retries)
+    limiter = RateLimiter(rate)
+    decisions = [None] * len(payloads)
+
+    def send(idx):
+        limiter.wait()
+        response = session.post(url, data={
+            "query": payloads[idx],
+            "model_choice": model_choice,
+            "dataset_choice": dataset_choice
+        }, timeout=30)
+        response.raise_for_status()
+        return idx, response.json()["combined_decision"]
+
+    start = time.monotonic()
+    last_report = start
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(send, idx) for idx in range(len(payloads))]
+        for done, future in enumerate(as_completed(futures), start=1):
+            idx, decision = future.result()
+            decisions[idx] = decision
+            now = time.monotonic()
+            if now - last_report >= 1.0 or done == len(payloads):
+                last_report = now
+                print(f"\r⏱️ [{dataset_choice}, {model_choice}] {done}/{len(payloads)} | "
+                      f"{done / (now - start):.1f} req/s", end="", flush=True)
+    print()
+    session.close()
+    return decisions
+
+
+# Stato di ciascun worker della modalità direct: estrattore, motore WAF e modelli caricati una volta
+_direct_worker = {}
+
+
+def _init_direct_worker():
+    from feature_service import FeatureService
+    from model_registry import ModelRegistry
+    from model_store import ModelStore
+    import waf_engine
+
+    _direct_worker["features"] = FeatureService(crs_ids_path=crs_ids_path, crs_path=crs_rules_dir, crs_pl=4,
+                                                cache_path="./data/crs_rules_cache.pkl")
+    # MODEL_STORE: i worker mappano gli stessi file dei modelli invece di caricarne una copia ciascuno
+    store = ModelStore(os.environ["MODEL_STORE"]) if os.environ.get("MODEL_STORE") else None
+    _direct_worker["models"] = ModelRegistry(model_paths, store=store)
+    waf_engine.preload(crs_rules_dir, pl=1)
+
+
+def _score_direct_chunk(task):
+    import scoring
+
+    dataset_choice, model_choice, payloads = task
+    model = _direct_worker["models"].get(dataset_choice, model_choice)
+    _, _, combined_pred = scoring.score_batch(payloads, model, _direct_worker["features"], crs_rules_dir)
+    return combined_pred
+
+
+def score_direct(pool, payloads, model_choice, dataset_choice, chunk_size):
+    """Valuta i payload senza HTTP: batch di PyModSecurity e del modello ML distribuiti sul pool di processi."""
+    payloads = [str(payload) for payload in payloads]
+    tasks = [(dataset_choice, model_choice, payloads[i:i + chunk_size]) for i in range(0, len(payloads), chunk_size)]
+    y_pred = []
+    start = time.monotonic()
+    # imap conserva l'ordine dei chunk, quindi y_pred resta allineato a y_true
+    for combined_pred in pool.imap(_score_direct_chunk, tasks):
+        y_pred.extend(int(p) for p in combined_pred)
+        print(f"\r⏱️ [{dataset_choice}, {model_choice}] {len(y_pred)}/{len(payloads)} | "
+              f"{len(y_pred) / (time.monotonic() - start):.1f} payloads/s", end="", flush=True)
+    print()
+    return y_pred
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate the combined ModSecurity+ML decision on the test datasets")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="payloads per request to /vulnerable_batch (0 = one request per payload)")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="concurrent requests to /vulnerable (0 = sequential driver)")
+    parser.add_argument("--rate", type=float, default=0, help="max requests per second (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=3, help="retries with backoff for failed requests")
+    parser.add_argument("--direct", action="store_true",
+                        help="score in-process with a worker pool, without Apache or server_vulnerable")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes for --direct")
+    parser.add_argument("--chunk-size", type=int, default=256, help="payloads per worker task for --direct")
+    parser.add_argument("--adversarial", choices=["no", "yes", "both"], default="no",
+                        help="include the adversarial test sets (both = run with and without)")
+    parser.add_argument("--checkpoint-every", type=int, default=2048,
+                        help="payloads per streamed chunk; predictions are checkpointed after each chunk")
+    args = parser.parse_args()
+
+    adversarial_runs = {"no": [False], "yes": [True], "both": [False, True]}[args.adversarial]
+    pool = multiprocessing.Pool(args.workers, initializer=_init_direct_worker) if args.direct else None
+
     print("🚀 Il Client è pronto per inviare tutti i payload del dataset...")
 
     # Chiedi all'utente quale dataset utilizzare
@@ -119,12 +348,11 @@ def main():
     #if dataset_choice not in datasets:
     #    print("❌ Dataset non valido. Uscita.")
     #    return
-    for dataset_choice in datasets:
+    for dataset_choice, include_adversarial in [(d, adv) for d in datasets for adv in adversarial_runs]:
         print("Dataset: ", dataset_choice)
 
         # Chiedi se includere i payload avversari
         #include_adversarial = input("Vuoi includere anche i payload avversari? (y/n): ").strip().lower() == 'y'
-        include_adversarial = False
 
         # Chiedi all'utente quale modello utilizzare
         #model_choice = input("Scegli il modello (rf/svc_linear_l1/svm_linear_l2/log_reg_l1/log_reg_l2/inf_svm): ").strip().lower()
@@ -152,47 +380,66 @@ def main():
                 continue
 
             # Costruisci i percorsi dei dataset
-            legitimate_path = construct_path(dataset_choice, model_choice, payload_type="legitimate")
-            malicious_path = construct_path(dataset_choice, model_choice, payload_type="malicious")
+            sources = [(construct_path(dataset_choice, model_choice, payload_type="legitimate"), 0),
+                       (construct_path(dataset_choice, model_choice, payload_type="malicious"), 1)]
             if include_adversarial:
-                adv_ms_path = construct_path(dataset_choice, model_choice, payload_type="adv_ms")
-                adv_ml_path = construct_path(dataset_choice, model_choice, payload_type="adv_ml")
-
-            # Carica i dataset
-            legitimate_data = load_dataset(legitimate_path)
-            malicious_data = load_dataset(malicious_path)
-            if include_adversarial:
-                adv_ms_data = load_dataset(adv_ms_path) if adv_ms_path else None
-                adv_ml_data = load_dataset(adv_ml_path) if adv_ml_path else None
-                # Combina i dataset
-                combined_payloads, y_true = combine_datasets(legitimate_data, malicious_data, adv_ms_data, adv_ml_data)
-            else:
-                # Combina i dataset
-                combined_payloads, y_true = combine_datasets(legitimate_data, malicious_data)
-
-            # Inizializza i risultati
-            y_pred = []
-
-            # Invia ogni payload
-            for idx, payload in enumerate(combined_payloads):
-                print(f"\n🔍 [Send payload {idx + 1} of {len(combined_payloads)} ({dataset_choice}, {model_choice})]")
-                decision = send_requests(payload, model_choice, dataset_choice, url, verbose=True)
-                # Aggiorna i risultati
-                y_pred.append(1 if decision == "Blocked" else 0)
+                for payload_type in ["adv_ms", "adv_ml"]:
+                    adv_path = construct_path(dataset_choice, model_choice, payload_type=payload_type)
+                    if adv_path:
+                        sources.append((adv_path, 1))
+
+            # Dataset combinato e mescolato, letto a blocchi dagli store mappati in memoria
+            dataset = CombinedDataset(sources)
+            y_true = dataset.y_true
+
+            def score_chunk(payloads, start):
+                if pool is not None:
+                    # Valutazione diretta, senza server
+                    return score_direct(pool, payloads, model_choice, dataset_choice, args.chunk_size)
+                if args.batch_size > 0:
+                    # Invia i payload a batch
+                    decisions = send_batch_requests(payloads, model_choice, dataset_choice, batch_url, args.batch_size)
+                elif args.concurrency > 0:
+                    # Invia i payload in parallelo; le decisioni tornano nell'ordine originale
+                    decisions = send_concurrent_requests(payloads, model_choice, dataset_choice, url,
+                                                         args.concurrency, args.rate, args.retries)
+                else:
+                    # Invia ogni payload
+                    decisions = []
+                    for idx, payload in enumerate(payloads):
+                        print(f"\n🔍 [Send payload {start + idx + 1} of {len(dataset)} ({dataset_choice}, {model_choice})]")
+                        decisions.append(send_requests(payload, model_choice, dataset_choice, url, verbose=True))
+                return [1 if decision == "Blocked" else 0 for decision in decisions]
+
+            # Predizioni salvate su disco dopo ogni blocco: un'esecuzione interrotta riprende dall'ultimo blocco completato
+            checkpoint = EvalCheckpoint(os.path.join(output_dir, "checkpoint"), len(dataset), dataset.fingerprint())
+            if checkpoint.done:
+                print(f"♻️ Resuming {dataset_choice}/{model_choice} from payload {checkpoint.done} of {len(dataset)}")
+            for start in range(checkpoint.done, len(dataset), args.checkpoint_every):
+                stop = min(start + args.checkpoint_every, len(dataset))
+                checkpoint.append(start, score_chunk(dataset.payloads(start, stop), start), y_true[start:stop])
+                running = checkpoint.metrics()
+                print(f"💾 [{dataset_choice}, {model_choice}] {stop}/{len(dataset)} checkpointed | "
+                      f"accuracy {running['accuracy']:.4f} | F1 {running['f1']:.4f}")
+            y_pred = np.array(checkpoint.y_pred)
 
             # Calcola e mostra le metriche
             print("\n📊 Risultati delle prestazioni:")
-            accuracy = accuracy_score(y_true, y_pred)
-            f1 = f1_score(y_true, y_pred)
-            roc_auc = roc_auc_score(y_true, y_pred)
-            print(f"🔹 Accuratezza: {accuracy:.4f}")
-            print(f"🔹 F1-Score: {f1:.4f}")
-            print(f"🔹 AUC-ROC: {roc_auc:.4f}")
+            final = checkpoint.metrics()
+            print(f"🔹 Accuratezza: {final['accuracy']:.4f}")
+            print(f"🔹 F1-Score: {final['f1']:.4f}")
+            print(f"🔹 AUC-ROC: {final['roc_auc']:.4f}")
 
             # Salva il rapporto di classificazione e le metriche
             save_performance_report(y_true, y_pred, output_dir)
             # Genera e salva la curva ROC
             plot_and_save_roc_curve(y_true, y_pred, output_dir)
+            # Risultati completi salvati: il checkpoint non serve più
+            checkpoint.remove()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
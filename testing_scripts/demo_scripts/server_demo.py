@@ -1,65 +1,69 @@
-from flask import Flask, request, jsonify, render_template
-import joblib
+from flask import Flask, request, jsonify, render_template, Response
 import sys
 import os
-import requests
-import pandas as pd
-import pickle
-import json
 import numpy as np
-import toml
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from src.models import PyModSecurity
-from src.extractor import ModSecurityFeaturesExtractor
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'apache_server_waf'))
+import waf_engine
+import scoring
+import metrics
+from model_registry import ModelRegistry
+from model_store import ModelStore
+from feature_service import FeatureService
+from payload_store import open_dataset
+from request_coalescer import RequestCoalescer
 
 # Inizializza il server Flask
 app = Flask(__name__)
 
-settings = toml.load('config.toml')
-crs_dir = settings['crs_dir']
+# CRS_DIR evita di leggere config.toml (e di importare toml) all'avvio
+crs_dir = os.environ.get("CRS_DIR")
+if crs_dir is None:
+    import toml
+    crs_dir = toml.load('config.toml')['crs_dir']
 print(crs_dir)
 
-# Inizializza ModSecurity
-modsec = PyModSecurity(rules_dir="./coreruleset/rules/", pl=1)
-
-# Percorsi dei modelli ML
-model_paths = {
-    "wafamole": {
-        "rf": 'data/models_wafamole/adv_rf_pl4.joblib',
-        "svc_linear_l1": 'data/models_wafamole/adv_linear_svc_pl4_l1.joblib',
-        "svc_linear_l2": 'data/models_wafamole/adv_linear_svc_pl4_l2.joblib',
-        "log_reg_l1": 'data/models_wafamole/adv_log_reg_pl4_l1.joblib',
-        "log_reg_l2": 'data/models_wafamole/adv_log_reg_pl4_l2.joblib',
-        "inf_svm": 'data/models_wafamole/adv_inf_svm_pl4_t1.joblib'
-    },
-    "modsec": {
-        "rf": 'data/models/adv_rf_pl4.joblib',
-        "svc_linear_l1": 'data/models/adv_linear_svc_pl4_l1.joblib',
-        "svc_linear_l2": 'data/models/adv_linear_svc_pl4_l2.joblib',
-        "log_reg_l1": 'data/models/adv_log_reg_pl4_l1.joblib',
-        "log_reg_l2": 'data/models/adv_log_reg_pl4_l2.joblib',
-        "inf_svm": 'data/models/adv_inf_svm_pl4_t1.joblib'
-    }
-}
+# Strategia di valutazione (vedi scoring.py); con "single_pass" il verdetto ModSecurity
+# viene dalla stessa passata del CRS delle feature e il motore PL1 non viene costruito
+decision_strategy = os.environ.get("DECISION_STRATEGY", "both")
+
+# Inizializza ModSecurity: i motori sono condivisi tramite pool (PyModSecurity non è thread-safe)
+modsec_rules_dir = "./coreruleset/rules/"
+if decision_strategy != "single_pass":
+    waf_engine.preload(modsec_rules_dir, pl=1)
+
+# Percorsi dei modelli ML (model_catalog.py); index.html chiama svc_linear_* i modelli svm_linear_*
+from model_catalog import model_paths
+model_aliases = {"svc_linear_l1": "svm_linear_l1", "svc_linear_l2": "svm_linear_l2"}
+
+# Registro dei modelli: caricati una sola volta e ricaricati se il file cambia
+# (MODEL_STORE: array dei modelli mappati da file condivisi tra i worker, vedi model_store.py)
+model_registry = ModelRegistry(model_paths, mmap_mode=os.environ.get("MODEL_MMAP_MODE"),
+                               store=ModelStore(os.environ["MODEL_STORE"]) if os.environ.get("MODEL_STORE") else None)
 
 # Estrattore di caratteristiche
-extractor = ModSecurityFeaturesExtractor(crs_ids_path='./data/crs_sqli_ids_4.0.0.json', crs_path='./coreruleset/rules/', crs_pl=4)
+extractor = FeatureService(crs_ids_path='./data/crs_sqli_ids_4.0.0.json', crs_path='./coreruleset/rules/', crs_pl=4,
+                           cache_path=os.environ.get("CRS_RULES_CACHE", "./data/crs_rules_cache.pkl"))
+
+# Metriche esposte da /metrics
+metrics.registry.add_collector(metrics.stats_collector("features", extractor.stats))
+metrics.registry.add_collector(model_registry.collect)
+
+# Coalescer delle richieste (COALESCE_MAX_BATCH > 1): le richieste concorrenti a /predict per lo stesso
+# dataset/modello attendono al massimo COALESCE_MAX_WAIT_MS e vengono valutate come un solo batch
+coalesce_max_batch = int(os.environ.get("COALESCE_MAX_BATCH", "0"))
+coalescer = None
+if coalesce_max_batch > 1:
+    coalescer = RequestCoalescer(
+        lambda key, payloads: scoring.combined_decision_batch(payloads, model_registry.get(*key), extractor,
+                                                              modsec_rules_dir, pl=1, strategy=decision_strategy),
+        max_wait_ms=float(os.environ.get("COALESCE_MAX_WAIT_MS", "2")), max_batch=coalesce_max_batch,
+        name="predict")
+    metrics.registry.add_collector(metrics.stats_collector("coalescer", coalescer.stats, route="/predict"))
 
 models = ["rf", "svm_linear_l1", "svm_linear_l2", "log_reg_l1", "log_reg_l2", "inf_svm"]
 
-# Funzione per caricare il file in base all'estensione
-def load_dataset(file_path):
-    if file_path.endswith(".pkl"):
-        with open(file_path, "rb") as f:
-            data = pd.DataFrame(pickle.load(f), columns=["payload"])
-    elif file_path.endswith(".json"):
-        with open(file_path, "r") as f:
-            data = pd.DataFrame(json.load(f), columns=["payload"])
-    else:
-        raise ValueError(f"Formato non supportato per il file: {file_path}")
-    return data
-
 # Funzione per estrarre i payload dai dataset
 def get_payload_from_index(dataset_choice, model_choice, payload_type, idx):
     if dataset_choice == 'wafamole':       
@@ -73,20 +77,20 @@ def get_payload_from_index(dataset_choice, model_choice, payload_type, idx):
         adv_path_ms = "data/dataset/adv_test_ms_pl1_rs20_100rounds.json"
         adv_path_ml = f"data/dataset/adv_test_{model_choice}_pl4_rs20_100rounds.json"
 
-    # Carica i dataset
+    # Dataset mappati in memoria (payload_store.py): aperti una volta, letti solo per l'indice richiesto
     if payload_type == "legit":
-        data = load_dataset(legit_path)
+        data = open_dataset(legit_path)
     elif payload_type == "malicious":
-        data = load_dataset(mal_path)
+        data = open_dataset(mal_path)
     elif payload_type == "adversarial_modsec":
-        data = load_dataset(adv_path_ms)
+        data = open_dataset(adv_path_ms)
     elif payload_type == "adversarial_ml":
-        data = load_dataset(adv_path_ml)
+        data = open_dataset(adv_path_ml)
     else:
         raise ValueError(f"Tipo di payload non supportato: {payload_type}")
 
     # Seleziona il payload corretto utilizzando l'indice
-    payload = data["payload"].iloc[idx % len(data)]
+    payload = data[idx % len(data)]
     print("Payload: ",payload)
 
     return payload
@@ -106,29 +110,73 @@ def predict():
         payload = get_payload_from_index(dataset_choice, model_choice, payload_type, int(payload_index))
 
     # Controlla se il modello richiesto esiste
-    if model_choice not in model_paths[dataset_choice]:
+    model_key = model_aliases.get(model_choice, model_choice)
+    if model_key not in model_paths[dataset_choice]:
         return jsonify({"error": f"Modello '{model_choice}' non valido per il dataset '{dataset_choice}'."}), 400
 
-    # Carica il modello
-    model = joblib.load(model_paths[dataset_choice][model_choice])
-
-    # Predizione ModSecurity
-    modsec_result = "Blocked" if modsec.predict(np.array([payload]))[0] > 0 else "Allowed"
+    # Modello già in memoria
+    model = model_registry.get(dataset_choice, model_key)
 
-    # Predizione modello ML
-    features = extractor.extract_features(pd.DataFrame([{"payload": payload}]))
-    prediction = model.predict([features[0]])[0]
-    ml_result = "Blocked" if prediction == 1 else "Allowed"
+    # Predizione ModSecurity e modello ML
+    metrics.registry.inc("requests", route="/predict")
+    with metrics.timed("request", route="/predict"):
+        if coalescer is not None:
+            result = coalescer.submit((dataset_choice, model_key), payload)
+        else:
+            result = scoring.combined_decision_batch([payload], model, extractor, modsec_rules_dir, pl=1,
+                                                     strategy=decision_strategy)[0]
+    for engine in ("waf", "ml", "combined"):
+        metrics.count_verdict(engine, result[f"{engine}_decision"], model=model_key, dataset=dataset_choice)
 
     # Restituisci entrambe le predizioni
     return jsonify({
-        "modsec_prediction": modsec_result,
-        "ml_prediction": ml_result,
+        "modsec_prediction": result["waf_decision"],
+        "ml_prediction": result["ml_decision"],
         "payload": payload,
         "model_used": model_choice,
         "dataset_used": dataset_choice
     })
 
+# Endpoint per la predizione combinata di un batch di payload
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    data = request.json
+    payloads = data.get("payloads", [])
+    model_choice = data.get("model")
+    dataset_choice = data.get("dataset")
+
+    # Controlla se il modello richiesto esiste
+    model_key = model_aliases.get(model_choice, model_choice)
+    if model_key not in model_paths[dataset_choice]:
+        return jsonify({"error": f"Modello '{model_choice}' non valido per il dataset '{dataset_choice}'."}), 400
+
+    model = model_registry.get(dataset_choice, model_key)
+    metrics.registry.inc("requests", route="/predict_batch")
+    with metrics.timed("request", route="/predict_batch"):
+        results = scoring.combined_decision_batch(payloads, model, extractor, modsec_rules_dir, pl=1,
+                                                  strategy=decision_strategy)
+    for result in results:
+        for engine in ("waf", "ml", "combined"):
+            metrics.count_verdict(engine, result[f"{engine}_decision"], model=model_key, dataset=dataset_choice)
+
+    return jsonify({
+        "modsec_prediction": [result["waf_decision"] for result in results],
+        "ml_prediction": [result["ml_decision"] for result in results],
+        "combined_decision": [result["combined_decision"] for result in results],
+        "model_used": model_choice,
+        "dataset_used": dataset_choice
+    })
+
+# Metriche in formato testo Prometheus
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Tempi di caricamento e memoria dei modelli
+@app.route("/models", methods=["GET"])
+def models_stats():
+    return jsonify(model_registry.stats())
+
 # Endpoint per la pagina principale
 @app.route("/")
 def index():
@@ -136,4 +184,13 @@ def index():
 
 if __name__ == "__main__":
     print("🚀 Avviando il server Flask con ModSecurity e modello ML...")
-    app.run(port=5000)
\ No newline at end of file
+    # Carica tutti i modelli prima di accettare richieste (MODEL_PRELOAD=0 per caricarli al primo uso)
+    if os.environ.get("MODEL_PRELOAD", "1") != "0":
+        model_registry.preload()
+    # SERVER_WORKERS=N: N worker pre-fork che condividono modelli ed estrattore già caricati (vedi prefork.py)
+    workers = int(os.environ.get("SERVER_WORKERS", "0"))
+    if workers > 0:
+        import prefork
+        prefork.serve(app, port=5000, workers=workers, on_reload=model_registry.preload)
+    else:
+        app.run(port=5000)
\ No newline at end of file
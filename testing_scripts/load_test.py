@@ -0,0 +1,308 @@
+"""
+Test di carico del reverse proxy Apache (apache_reverse_proxy/).
+
+Rigioca i payload legittimi, malevoli e avversari su /test (ModSecurity e
+modello ML attivi) e su /hidden_test (WAF disattivato), con N richieste
+concorrenti (anello chiuso) oppure a un tasso fisso di richieste al secondo
+(anello aperto: la latenza è misurata dall'istante in cui la richiesta era
+pianificata, così le code del server non vengono nascoste). Per ogni
+endpoint e tipo di payload riporta throughput, tasso di errore, stati HTTP
+e latenze p50/p95/p99; il confronto tra /test e /hidden_test isola il costo
+di WAF + ML.
+
+    python3 load_test.py --base-url http://127.0.0.1 --concurrency 16 --requests 2000
+    python3 load_test.py --rate 200 --duration 30 --payload-types malicious legitimate
+
+Senza Apache né rete, --local avvia in-process degli stand-in: il server di
+origine di apache_reverse_proxy/server.py e un proxy che, come la
+configurazione di Apache, su /test chiede la decisione al demone
+(decision_daemon.py, --waf daemon) oppure simula un ritardo fisso
+(--waf delay --waf-delay-ms 5) prima di inoltrare, e su /hidden_test inoltra
+direttamente.
+
+    python3 load_test.py --local --waf delay --waf-delay-ms 5 --synthetic 500
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+
+payload_types = ["legitimate", "malicious", "adv_ms", "adv_ml"]
+
+
+def load_payloads(args):
+    """Payload per tipo: dai dataset di test (my_utils), da un file o sintetici."""
+    if args.payload_file:
+        with open(args.payload_file) as f:
+            if args.payload_file.endswith(".json"):
+                payloads = [str(p) for p in json.load(f)]
+            else:
+                payloads = [line.rstrip("\n") for line in f if line.strip()]
+        return {"file": payloads}
+    if args.synthetic:
+        rng = random.Random(42)
+        legitimate = [f"SELECT name FROM products WHERE id = {rng.randint(1, 10000)}" for _ in range(args.synthetic)]
+        malicious = [f"admin' OR '{i}'='{i}' -- " for i in range(args.synthetic)]
+        return {"legitimate": legitimate, "malicious": malicious}
+
+    from my_utils import construct_path
+    from payload_store import open_dataset
+
+    # Dataset mappati in memoria (payload_store.py): le richieste leggono i payload per indice
+    return {payload_type: open_dataset(construct_path(args.dataset, args.model, payload_type=payload_type))
+            for payload_type in args.payload_types}
+
+
+def run_load(url, payloads, concurrency, rate, total_requests, duration, timeout):
+    """Invia le richieste e restituisce (campioni [(latenza_s, stato | None)], durata_s)."""
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=0)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    samples = []
+    lock = threading.Lock()
+    counter = iter(range(total_requests if total_requests else sys.maxsize))
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            scheduled = start + i / rate if rate else time.perf_counter()
+            if deadline is not None and scheduled >= deadline:
+                break
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            sent = scheduled if rate else time.perf_counter()
+            try:
+                response = session.post(url, data={"query": payloads[i % len(payloads)]}, timeout=timeout)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            local.append((time.perf_counter() - sent, status))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    session.close()
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    latencies = np.array([latency for latency, _ in samples]) * 1000.0
+    statuses = {}
+    for _, status in samples:
+        key = str(status) if status is not None else "error"
+        statuses[key] = statuses.get(key, 0) + 1
+    # 403 è il verdetto Blocked di ModSecurity, non un errore
+    errors = sum(count for key, count in statuses.items() if key == "error" or key.startswith("5"))
+    n = len(samples)
+    summary = {"requests": n, "seconds": round(elapsed, 3), "throughput_rps": round(n / elapsed, 2) if elapsed else 0.0,
+               "error_rate": round(errors / n, 4) if n else 0.0, "statuses": statuses}
+    if n:
+        summary.update({f"p{p}_ms": round(float(np.percentile(latencies, p)), 3) for p in (50, 95, 99)})
+        summary["mean_ms"] = round(float(latencies.mean()), 3)
+        summary["max_ms"] = round(float(latencies.max()), 3)
+    return summary
+
+
+def print_summary(endpoint, payload_type, summary):
+    statuses = ", ".join(f"{key}: {count}" for key, count in sorted(summary["statuses"].items()))
+    print(f"🔹 {endpoint:<12} {payload_type:<10} {summary['requests']:>6} req | "
+          f"{summary['throughput_rps']:>8.1f} req/s | errors {summary['error_rate'] * 100:5.2f}% | "
+          f"p50 {summary.get('p50_ms', 0):8.2f} ms | p95 {summary.get('p95_ms', 0):8.2f} ms | "
+          f"p99 {summary.get('p99_ms', 0):8.2f} ms | {statuses}")
+
+
+# --- Stand-in locali (senza Apache né rete) ---
+
+class _StandInProxyHandler(BaseHTTPRequestHandler):
+    """Come 000-default.conf: /test passa dalla decisione ModSecurity+ML, /hidden_test no."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Intestazioni e corpo sono scritti separatamente: senza TCP_NODELAY Nagle + delayed ACK aggiungono ~40 ms
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        if path not in ("/test", "/hidden_test"):
+            return self._reply(404, b"Not Found\n")
+        if path == "/test":
+            payload = parse_qs(body.decode("utf-8", errors="replace")).get("query", [""])[0]
+            decision = self.server.decide(payload)
+            if decision == "Blocked":
+                return self._reply(403, b"Forbidden\n")
+            if decision != "Allowed":
+                return self._reply(502, b"Decision error\n")
+        connection = http.client.HTTPConnection(*self.server.origin, timeout=30)
+        try:
+            connection.request("POST", path, body=body,
+                               headers={"Content-Type": self.headers.get("Content-Type", "")})
+            response = connection.getresponse()
+            self._reply(response.status, response.read())
+        except OSError:
+            self._reply(502, b"Bad Gateway\n")
+        finally:
+            connection.close()
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _make_decide(waf, waf_delay_ms, socket_path):
+    if waf == "daemon":
+        from decision_client import query
+
+        def decide(payload):
+            try:
+                return query({"payload": payload}, socket_path).get("combined_decision", "Error")
+            except (OSError, ValueError):
+                return "Error"
+        return decide
+    if waf == "delay":
+        def decide(payload):
+            time.sleep(waf_delay_ms / 1000.0)
+            # Regola fittizia, solo per avere risposte 403 nel test del proxy
+            return "Blocked" if "'" in payload and " or " in payload.lower() else "Allowed"
+        return decide
+    return lambda payload: "Allowed"
+
+
+def start_local_standins(waf, waf_delay_ms, socket_path):
+    """Avvia origine e proxy su porte locali libere; restituisce (base_url, stop)."""
+    from werkzeug.serving import make_server
+
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_reverse_proxy'))
+    from server import app
+
+    # Niente log di accesso del server di sviluppo durante il test
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    origin = make_server("127.0.0.1", 0, app, threaded=True)
+    proxy = ThreadingHTTPServer(("127.0.0.1", 0), _StandInProxyHandler)
+    proxy.daemon_threads = True
+    proxy.origin = ("127.0.0.1", origin.server_port)
+    proxy.decide = _make_decide(waf, waf_delay_ms, socket_path)
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in (origin, proxy)]
+    for thread in threads:
+        thread.start()
+
+    def stop():
+        for server in (proxy, origin):
+            server.shutdown()
+            server.server_close()
+
+    print(f"🧪 Local stand-ins: proxy 127.0.0.1:{proxy.server_port} -> origin 127.0.0.1:{origin.server_port} (WAF: {waf})")
+    return f"http://127.0.0.1:{proxy.server_port}", stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the Apache reverse proxy: /test (WAF+ML) vs /hidden_test")
+    parser.add_argument("--base-url", default="http://127.0.0.1")
+    parser.add_argument("--endpoints", nargs="+", default=["/test", "/hidden_test"])
+    parser.add_argument("--dataset", choices=["modsec", "wafamole"], default="modsec")
+    parser.add_argument("--model", default="inf_svm", help="model of the adv_ml test set")
+    parser.add_argument("--payload-types", nargs="+", choices=payload_types, default=payload_types)
+    parser.add_argument("--payload-file", default=None, help="JSON list or one payload per line, instead of the datasets")
+    parser.add_argument("--synthetic", type=int, default=0, help="N synthetic legitimate/malicious payloads, no datasets")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent connections")
+    parser.add_argument("--rate", type=float, default=0, help="open-loop requests per second (0 = closed loop)")
+    parser.add_argument("--requests", type=int, default=None,
+                        help="requests per endpoint and payload type (default 1000, or no limit with --duration; 0 = no limit)")
+    parser.add_argument("--duration", type=float, default=0, help="seconds per endpoint and payload type (0 = no limit)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--warmup", type=int, default=20, help="requests per endpoint before measuring")
+    parser.add_argument("--local", action="store_true", help="run against in-process stand-ins of Apache and server.py")
+    parser.add_argument("--waf", choices=["daemon", "delay", "none"], default="delay", help="stand-in decision on /test")
+    parser.add_argument("--waf-delay-ms", type=float, default=5.0)
+    parser.add_argument("--socket", default=os.environ.get("MODSEC_DECISION_SOCKET", "/tmp/modsec_decision.sock"))
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    args = parser.parse_args()
+    # Con --duration la durata limita la prova: il numero di richieste non la interrompe prima
+    if args.requests is None:
+        args.requests = 0 if args.duration else 1000
+    if not args.requests and not args.duration:
+        parser.error("--requests 0 needs --duration")
+
+    payloads = load_payloads(args)
+    base_url, stop = args.base_url, None
+    if args.local:
+        base_url, stop = start_local_standins(args.waf, args.waf_delay_ms, args.socket)
+
+    mode = f"{args.rate:.0f} req/s open loop" if args.rate else "closed loop"
+    print(f"🚀 Load test on {base_url}: {args.concurrency} connections, {mode}")
+    report = {}
+    try:
+        for endpoint in args.endpoints:
+            url = base_url.rstrip("/") + endpoint
+            if args.warmup:
+                run_load(url, next(iter(payloads.values())), args.concurrency, 0, args.warmup, 0, args.timeout)
+            for payload_type, items in payloads.items():
+                samples, elapsed = run_load(url, items, args.concurrency, args.rate, args.requests, args.duration,
+                                            args.timeout)
+                summary = summarize(samples, elapsed)
+                report.setdefault(endpoint, {})[payload_type] = summary
+                print_summary(endpoint, payload_type, summary)
+    finally:
+        if stop is not None:
+            stop()
+
+    # Overhead di WAF + ML: differenza tra l'endpoint protetto e quello senza WAF
+    if "/test" in report and "/hidden_test" in report:
+        print("\n⚖️ /test vs /hidden_test (WAF + ML overhead):")
+        for payload_type in payloads:
+            protected, bypass = report["/test"][payload_type], report["/hidden_test"][payload_type]
+            if "p50_ms" not in protected or "p50_ms" not in bypass:
+                continue
+            ratio = (f"x{protected['throughput_rps'] / bypass['throughput_rps']:.2f}"
+                     if bypass["throughput_rps"] else "n/a")
+            print(f"🔹 {payload_type:<10} p50 {protected['p50_ms'] - bypass['p50_ms']:+.2f} ms | "
+                  f"p95 {protected['p95_ms'] - bypass['p95_ms']:+.2f} ms | "
+                  f"p99 {protected['p99_ms'] - bypass['p99_ms']:+.2f} ms | "
+                  f"throughput {ratio}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""
+Percorsi dei modelli ML ({dataset: {modello: file joblib}}), definiti una sola volta.
+
+Modulo senza dipendenze, importato da complete_client_eval (e quindi dai
+benchmark), da server_vulnerable e da server_demo.
+
+    from model_catalog import model_paths
+    model_paths["modsec"]["inf_svm"]
+"""
+
+model_paths = {
+    "wafamole": {
+        "rf": 'data/models_wafamole/adv_rf_pl4.joblib',
+        "svm_linear_l1": 'data/models_wafamole/adv_linear_svc_pl4_l1.joblib',
+        "svm_linear_l2": 'data/models_wafamole/adv_linear_svc_pl4_l2.joblib',
+        "log_reg_l1": 'data/models_wafamole/adv_log_reg_pl4_l1.joblib',
+        "log_reg_l2": 'data/models_wafamole/adv_log_reg_pl4_l2.joblib',
+        "inf_svm": 'data/models_wafamole/adv_inf_svm_pl4_t1.joblib'
+    },
+    "modsec": {
+        "rf": 'data/models/adv_rf_pl4.joblib',
+        "svm_linear_l1": 'data/models/adv_linear_svc_pl4_l1.joblib',
+        "svm_linear_l2": 'data/models/adv_linear_svc_pl4_l2.joblib',
+        "log_reg_l1": 'data/models/adv_log_reg_pl4_l1.joblib',
+        "log_reg_l2": 'data/models/adv_log_reg_pl4_l2.joblib',
+        "inf_svm": 'data/models/adv_inf_svm_pl4_t1.joblib'
+    }
+}
@@ -0,0 +1,164 @@
+"""
+Formato compatto e indicizzato per i dataset di payload.
+
+Un file .pstore contiene un'intestazione, un array di offset (uint64, N+1
+valori) e il blob UTF-8 di tutti i payload concatenati. Il file viene
+mappato in memoria (mmap): l'accesso per indice è O(1) e legge solo i byte
+di quel payload, l'iterazione a blocchi non carica mai l'intero dataset e la
+memoria resta piatta (le pagine sono condivise con la page cache).
+
+Conversione dei dataset .pkl/.json (il file .pstore viene scritto accanto):
+
+    python3 payload_store.py data/dataset/*.json data/dataset_wafamole/*.pkl
+
+    store = open_dataset("data/dataset/malicious_test.json")   # usa/crea malicious_test.pstore
+    store[idx % len(store)]
+    for chunk in store.iter_chunks(1024):
+        ...
+"""
+
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+
+import numpy as np
+
+MAGIC = b"PSTORE01"
+_HEADER = struct.Struct("<8sQ")
+# Gli payload sono scritti con surrogatepass, così anche stringhe non valide in UTF-8 tornano identiche
+_ENCODING_ERRORS = "surrogatepass"
+
+
+def read_source(path):
+    """Payload di un dataset .pkl o .json (lista di stringhe)."""
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+    elif path.endswith(".json"):
+        with open(path, "r") as f:
+            data = json.load(f)
+    else:
+        raise ValueError(f"Formato non supportato per il file: {path}")
+    if hasattr(data, "columns"):
+        data = data["payload"].tolist()
+    return [str(payload) for payload in data]
+
+
+def store_path(path):
+    return path if path.endswith(".pstore") else path.rsplit(".", 1)[0] + ".pstore"
+
+
+def write_store(payloads, output_path):
+    """Scrive una sequenza di payload nel formato .pstore (in modo atomico)."""
+    blobs = [payload.encode("utf-8", _ENCODING_ERRORS) for payload in payloads]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(blob) for blob in blobs], dtype=np.uint64)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(blobs)))
+        f.write(offsets.tobytes())
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def convert(source_path, output_path=None):
+    """Converte un dataset .pkl/.json in .pstore e restituisce il percorso del file scritto."""
+    output_path = output_path or store_path(source_path)
+    payloads = read_source(source_path)
+    write_store(payloads, output_path)
+    print(f"📦 {source_path} -> {output_path} ({len(payloads)} payloads, {os.path.getsize(output_path)} bytes)")
+    return output_path
+
+
+class PayloadStore:
+    """Dataset di payload mappato in memoria, con accesso O(1) per indice."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} non è un file .pstore")
+        self._count = count
+        self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=count + 1, offset=_HEADER.size)
+        self._base = _HEADER.size + (count + 1) * 8
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError(f"Indice {idx} fuori dal dataset ({self._count} payload)")
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._mmap[self._base + start:self._base + end].decode("utf-8", _ENCODING_ERRORS)
+
+    def slice(self, start, stop):
+        """Payload [start, stop) con una sola lettura contigua del blob."""
+        start, stop = max(0, start), min(stop, self._count)
+        if start >= stop:
+            return []
+        offsets = self._offsets[start:stop + 1].astype(np.int64) - int(self._offsets[start])
+        data = self._mmap[self._base + int(self._offsets[start]):self._base + int(self._offsets[stop])]
+        return [data[offsets[i]:offsets[i + 1]].decode("utf-8", _ENCODING_ERRORS) for i in range(stop - start)]
+
+    def iter_chunks(self, chunk_size=1024, start=0):
+        """Itera a blocchi di `chunk_size` payload, a partire dall'indice `start`."""
+        for i in range(start, self._count, chunk_size):
+            yield self.slice(i, i + chunk_size)
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def close(self):
+        # Le viste numpy sugli offset devono essere rilasciate prima di chiudere la mappa
+        self._offsets = None
+        self._mmap.close()
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _signature(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def open_dataset(path, convert_missing=True):
+    """PayloadStore per un dataset (.pstore, oppure .pkl/.json con il .pstore accanto).
+
+    Gli store aperti restano in cache per percorso e vengono riaperti se il file cambia;
+    se il .pstore manca o è più vecchio del dataset sorgente viene (ri)generato.
+    """
+    target = store_path(path)
+    with _cache_lock:
+        if convert_missing and target != path and os.path.exists(path):
+            if not os.path.exists(target) or os.stat(target).st_mtime_ns < os.stat(path).st_mtime_ns:
+                convert(path, target)
+        signature = _signature(target)
+        cached = _cache.get(target)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        store = PayloadStore(target)
+        # Lo store precedente non viene chiuso: un altro thread potrebbe ancora leggerlo
+        _cache[target] = (signature, store)
+        return store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 payload_store.py dataset.json|dataset.pkl [...]")
+        sys.exit(1)
+    for source in sys.argv[1:]:
+        convert(source)
@@ -1,95 +1,201 @@
+"""
+Report dei risultati salvati da complete_client_eval.py (results/<dataset>/<model>/y_true.npy, y_pred.npy).
+
+Per ogni modello tutte le metriche vengono da una sola matrice di confusione
+(np.bincount) e la curva ROC da un solo ordinamento dei punteggi; i risultati
+sono salvati in metrics_cache.json accanto ai file .npy e riusati finché i
+file non cambiano. Le cartelle vengono elaborate in parallelo (--workers).
+Con --csv-only viene scritto solo performance_summary.csv, senza importare
+matplotlib.
+
+    python3 result_plot.py
+    python3 result_plot.py --csv-only --workers 8
+"""
+
+import argparse
+import csv
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from sklearn.metrics import roc_curve, auc, precision_score, recall_score, f1_score, accuracy_score
-import pandas as pd
-
-# Directory structure (modify if needed)
-results_dir = "./results"
-output_dir = "./new_results/roc_combined_decision"
-os.makedirs(output_dir, exist_ok=True)
-
-# Dataframe to store the performance summary
-summary_data = []
-roc_data = {}  # Store ROC data to plot multiple models together
-pdf_path = os.path.join(output_dir, "combined_roc_curves.pdf")
-
-# Initialize PDF file
-with PdfPages(pdf_path) as pdf:
-    # Walk through the directory
-    for dataset in os.listdir(results_dir):
-        dataset_path = os.path.join(results_dir, dataset)
-        if os.path.isdir(dataset_path):
-            roc_data[dataset] = {}  # Initialize dataset key
-            for model in os.listdir(dataset_path):
-                model_path = os.path.join(dataset_path, model)
-                if os.path.isdir(model_path):
-                    # Load y_true and y_pred
-                    y_true = np.load(os.path.join(model_path, "y_true.npy"))
-                    y_pred = np.load(os.path.join(model_path, "y_pred.npy"))
-
-                    # Calculate ROC curve and AUC
-                    fpr, tpr, _ = roc_curve(y_true, y_pred)
-                    roc_auc = auc(fpr, tpr)
-
-                    # Store ROC data for later combined plot
-                    roc_data[dataset][model] = (fpr, tpr, roc_auc)
-
-                    # Calculate performance metrics directly
-                    y_pred_binary = (y_pred > 0.5).astype(int)
-                    accuracy = accuracy_score(y_true, y_pred_binary)
-                    f1 = f1_score(y_true, y_pred_binary, average='weighted')
-                    precision_blocked = precision_score(y_true, y_pred_binary, pos_label=1, zero_division=0)
-                    recall_blocked = recall_score(y_true, y_pred_binary, pos_label=1, zero_division=0)
-
-                    # Append to summary table
-                    summary_data.append({
-                        "Dataset": dataset,
-                        "Model": model,
-                        "AUC": roc_auc,
-                        "Accuracy": accuracy,
-                        "F1-Score": f1,
-                        "Precision (Blocked)": precision_blocked,
-                        "Recall (Blocked)": recall_blocked
-                    })
-
-    # Create a figure and subplots
-    fig, axes = plt.subplots(nrows=(len(roc_data) + 1) // 2, ncols=2, figsize=(14, 6 * ((len(roc_data) + 1) // 2)), squeeze=False)  # Adjust subplot grid dynamically
-
-    handles_labels = {}  # Use dictionary to collect unique handles and labels for shared legend
-    labels = []  # To collect unique labels for the shared legend
-
-    # Iterate through datasets and models
-    for i, (dataset, models) in enumerate(roc_data.items()):
-        ax = axes[i // 2, i % 2]  # Correctly position the subplot
-        for model, (fpr, tpr, roc_auc) in models.items():
-            line, = ax.plot(fpr, tpr, lw=2, label=f'{model} (AUC = {roc_auc:.2f})')
-            if model not in handles_labels:
-                handles_labels[model] = line
-            if model not in labels:
-                labels.append(f'{model}')
-        ax.plot([0, 1], [0, 1], color='gray', linestyle='--')  # Diagonal line
-        #ax.set_xscale('log')  # Log scale for FPR
-        ax.set_xlabel('False Positive Rate (Log Scale)')
-        ax.set_ylabel('True Positive Rate')
-        ax.set_xlim([0.2, 1.0])
-        ax.set_ylim([0.9, 1.0])  # Zoom on the y-axis between 0.8 and 1
-        ax.set_title(f'{dataset}', fontsize=14)
-        ax.grid(True)
-
-    # Adjust layout and add shared legend below the plots
-    fig.legend(handles_labels.values(), handles_labels.keys(), loc='lower center', bbox_to_anchor=(0.5, -0.05), ncol=4, fontsize='large', frameon=False)
-    plt.tight_layout(rect=[0, 0.1, 1, 1])  # Leave space for the legend
-
-    # Save the combined figure to the PDF
-    pdf.savefig(fig)
-    plt.close(fig)
-
-# Create a summary table and save it
-summary_df = pd.DataFrame(summary_data)
-summary_table_path = os.path.join(output_dir, "performance_summary.csv")
-summary_df.to_csv(summary_table_path, index=False)
-
-print(f"Summary table saved to: {summary_table_path}")
-print(f"Combined ROC curves saved to: {pdf_path}")
+
+CACHE_NAME = "metrics_cache.json"
+CACHE_VERSION = 1
+
+SUMMARY_COLUMNS = ["Dataset", "Model", "AUC", "Accuracy", "F1-Score", "Precision (Blocked)", "Recall (Blocked)"]
+
+
+def _ratio(num, den):
+    # Come zero_division=0 di sklearn
+    return num / den if den else 0.0
+
+
+def roc_points(y_true, y_score):
+    """Punti (fpr, tpr) della curva ROC per ogni soglia distinta, con un solo ordinamento."""
+    order = np.argsort(-y_score, kind="mergesort")
+    y_score, y_true = y_score[order], y_true[order]
+    last = np.r_[np.flatnonzero(np.diff(y_score)), len(y_score) - 1]
+    tps = np.cumsum(y_true)[last]
+    fps = last + 1 - tps
+    tps, fps = np.r_[0, tps], np.r_[0, fps]
+    return fps / max(fps[-1], 1), tps / max(tps[-1], 1)
+
+
+def compute_metrics(y_true, y_pred):
+    """Metriche del riepilogo da una sola matrice di confusione; AUC dalla curva ROC."""
+    y_true = np.asarray(y_true).astype(np.int64)
+    y_pred = np.asarray(y_pred)
+    y_binary = (y_pred > 0.5).astype(np.int64)
+    tn, fp, fn, tp = (int(v) for v in np.bincount(2 * y_true + y_binary, minlength=4))
+    n = tn + fp + fn + tp
+
+    fpr, tpr = roc_points(y_true, y_pred.astype(np.float64))
+    roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    # F1 pesato sul supporto delle due classi (average='weighted')
+    f1_blocked = _ratio(2 * tp, 2 * tp + fp + fn)
+    f1_allowed = _ratio(2 * tn, 2 * tn + fn + fp)
+    return {
+        "confusion": {"tn": tn, "fp": fp, "fn": fn, "tp": tp},
+        "AUC": roc_auc,
+        "Accuracy": _ratio(tp + tn, n),
+        "F1-Score": _ratio(f1_blocked * (tp + fn) + f1_allowed * (tn + fp), n),
+        "Precision (Blocked)": _ratio(tp, tp + fp),
+        "Recall (Blocked)": _ratio(tp, tp + fn),
+        "fpr": fpr.tolist(),
+        "tpr": tpr.tolist(),
+    }
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def model_metrics(model_path, use_cache=True):
+    """Metriche di una cartella results/<dataset>/<model>, dalla cache se i .npy non sono cambiati."""
+    true_path = os.path.join(model_path, "y_true.npy")
+    pred_path = os.path.join(model_path, "y_pred.npy")
+    cache_path = os.path.join(model_path, CACHE_NAME)
+    signature = {"version": CACHE_VERSION, "y_true": _signature(true_path), "y_pred": _signature(pred_path)}
+
+    if use_cache and os.path.isfile(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get("signature") == signature:
+                return cached["metrics"]
+        except (OSError, ValueError):
+            pass
+
+    metrics = compute_metrics(np.load(true_path), np.load(pred_path))
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"signature": signature, "metrics": metrics}, f)
+    os.replace(tmp_path, cache_path)
+    return metrics
+
+
+def _job(args):
+    dataset, model, model_path, use_cache = args
+    return dataset, model, model_metrics(model_path, use_cache)
+
+
+def find_results(results_dir):
+    """(dataset, model, cartella) per ogni cartella con y_true.npy e y_pred.npy."""
+    jobs = []
+    for dataset_entry in sorted(os.scandir(results_dir), key=lambda e: e.name):
+        if not dataset_entry.is_dir():
+            continue
+        for model_entry in sorted(os.scandir(dataset_entry.path), key=lambda e: e.name):
+            if (model_entry.is_dir() and os.path.isfile(os.path.join(model_entry.path, "y_true.npy"))
+                    and os.path.isfile(os.path.join(model_entry.path, "y_pred.npy"))):
+                jobs.append((dataset_entry.name, model_entry.name, model_entry.path))
+    return jobs
+
+
+def collect(results_dir, workers=1, use_cache=True):
+    """{dataset: {model: metriche}} per tutte le cartelle dei risultati."""
+    jobs = [(dataset, model, path, use_cache) for dataset, model, path in find_results(results_dir)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_job, jobs))
+    else:
+        results = [_job(job) for job in jobs]
+    report = {}
+    for dataset, model, metrics in results:
+        report.setdefault(dataset, {})[model] = metrics
+    return report
+
+
+def write_summary(report, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        for dataset, models in report.items():
+            for model, metrics in models.items():
+                writer.writerow([dataset, model] + [metrics[column] for column in SUMMARY_COLUMNS[2:]])
+
+
+def plot_roc_curves(report, pdf_path):
+    # matplotlib è importato solo qui, così --csv-only non lo carica
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    with PdfPages(pdf_path) as pdf:
+        # Create a figure and subplots
+        fig, axes = plt.subplots(nrows=(len(report) + 1) // 2, ncols=2, figsize=(14, 6 * ((len(report) + 1) // 2)), squeeze=False)  # Adjust subplot grid dynamically
+
+        handles_labels = {}  # Use dictionary to collect unique handles and labels for shared legend
+
+        # Iterate through datasets and models
+        for i, (dataset, models) in enumerate(report.items()):
+            ax = axes[i // 2, i % 2]  # Correctly position the subplot
+            for model, metrics in models.items():
+                line, = ax.plot(metrics["fpr"], metrics["tpr"], lw=2, label=f'{model} (AUC = {metrics["AUC"]:.2f})')
+                if model not in handles_labels:
+                    handles_labels[model] = line
+            ax.plot([0, 1], [0, 1], color='gray', linestyle='--')  # Diagonal line
+            #ax.set_xscale('log')  # Log scale for FPR
+            ax.set_xlabel('False Positive Rate (Log Scale)')
+            ax.set_ylabel('True Positive Rate')
+            ax.set_xlim([0.2, 1.0])
+            ax.set_ylim([0.9, 1.0])  # Zoom on the y-axis between 0.8 and 1
+            ax.set_title(f'{dataset}', fontsize=14)
+            ax.grid(True)
+
+        # Adjust layout and add shared legend below the plots
+        fig.legend(handles_labels.values(), handles_labels.keys(), loc='lower center', bbox_to_anchor=(0.5, -0.05), ncol=4, fontsize='large', frameon=False)
+        plt.tight_layout(rect=[0, 0.1, 1, 1])  # Leave space for the legend
+
+        # Save the combined figure to the PDF
+        pdf.savefig(fig)
+        plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance summary and combined ROC curves of the evaluation results")
+    parser.add_argument("--results-dir", default="./results")
+    parser.add_argument("--output-dir", default="./new_results/roc_combined_decision")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes computing the metrics")
+    parser.add_argument("--csv-only", action="store_true", help="write only the CSV summary (no matplotlib)")
+    parser.add_argument("--no-cache", action="store_true", help="recompute the metrics even if cached")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report = collect(args.results_dir, workers=args.workers, use_cache=not args.no_cache)
+
+    # Create a summary table and save it
+    summary_table_path = os.path.join(args.output_dir, "performance_summary.csv")
+    write_summary(report, summary_table_path)
+    print(f"Summary table saved to: {summary_table_path}")
+
+    if not args.csv_only:
+        pdf_path = os.path.join(args.output_dir, "combined_roc_curves.pdf")
+        plot_roc_curves(report, pdf_path)
+        print(f"Combined ROC curves saved to: {pdf_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,58 +1,273 @@
 import os
 import sys
-from flask import Flask, request, jsonify
+import threading
+from flask import Flask, request, jsonify, Response
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from src.extractor import ModSecurityFeaturesExtractor
-import joblib
-import pandas as pd
-import requests
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'apache_server_waf'))
+from verdict_cache import VerdictCache, config_identity, file_identity
+from cascade import Cascade
+from feature_service import FeatureService
+from model_registry import ModelRegistry
+from model_store import ModelStore
+from request_coalescer import RequestCoalescer
+import waf_engine
+import scoring
+import metrics
+import numpy as np
 
 # Percorsi dei modelli ML
-model_paths = {
-    "wafamole": {
-        "rf": 'data/models_wafamole/adv_rf_pl4.joblib',
-        "svm_linear_l1": 'data/models_wafamole/adv_linear_svc_pl4_l1.joblib',
-        "svm_linear_l2": 'data/models_wafamole/adv_linear_svc_pl4_l2.joblib',
-        "log_reg_l1": 'data/models_wafamole/adv_log_reg_pl4_l1.joblib',
-        "log_reg_l2": 'data/models_wafamole/adv_log_reg_pl4_l2.joblib',
-        "inf_svm": 'data/models_wafamole/adv_inf_svm_pl4_t1.joblib'
-    },
-    "modsec": {
-        "rf": 'data/models/adv_rf_pl4.joblib',
-        "svm_linear_l1": 'data/models/adv_linear_svc_pl4_l1.joblib',
-        "svm_linear_l2": 'data/models/adv_linear_svc_pl4_l2.joblib',
-        "log_reg_l1": 'data/models/adv_log_reg_pl4_l1.joblib',
-        "log_reg_l2": 'data/models/adv_log_reg_pl4_l2.joblib',
-        "inf_svm": 'data/models/adv_inf_svm_pl4_t1.joblib'
-    }
-}
+from model_catalog import model_paths
+
+crs_rules_dir = './coreruleset/rules'
+
+# Registro dei modelli: ogni modello viene caricato una sola volta e ricaricato se il file cambia;
+# con MODEL_STORE (es. /dev/shm/modsec_model_store-<uid>, cartella privata) gli array dei modelli sono mappati da file
+# condivisi tra i worker invece di essere copiati in ogni processo
+models = ModelRegistry(model_paths, mmap_mode=os.environ.get("MODEL_MMAP_MODE"),
+                       fast_linear=os.environ.get("FAST_LINEAR", "0") == "1",
+                       store=ModelStore(os.environ["MODEL_STORE"]) if os.environ.get("MODEL_STORE") else None)
+
+# Cache dei verdetti: il namespace include il file del modello, quindi
+# cambiare modello/dataset non restituisce mai un verdetto di un altro modello
+verdict_cache = VerdictCache(max_entries=10000, ttl=3600, shared_path=os.environ.get("MODSEC_VERDICT_CACHE"))
 
 # Inizializza il server Flask
 app = Flask(__name__)
 
+# Estrattore di caratteristiche caricato una sola volta (metadati CRS in cache su disco)
+feature_service = FeatureService(crs_ids_path='./data/crs_sqli_ids_4.0.0.json', crs_path=crs_rules_dir, crs_pl=4,
+                                 cache_path=os.environ.get("CRS_RULES_CACHE", "./data/crs_rules_cache.pkl"))
+print(f"🧩 Features extractor ready in {feature_service.cold_start_seconds * 1000:.0f} ms")
+
 # Funzione per estrarre le caratteristiche dal payload
 def extract_features(payload):
-    extractor = ModSecurityFeaturesExtractor(crs_ids_path='./data/crs_sqli_ids_4.0.0.json', crs_path='./coreruleset/rules', crs_pl=4)
-    features = extractor.extract_features(pd.DataFrame([{"payload": payload}]))
+    features = feature_service.extract_features([payload])
     return features[0]
 
 
+# Backend WAF in-process: PyModSecurity valutato direttamente, motori presi dal pool di waf_engine
+class InProcessWafBackend:
+    name = "inprocess"
+
+    def __init__(self, rules_dir, pl=1):
+        self.rules_dir = rules_dir
+        self.pl = pl
+        waf_engine.preload(rules_dir, pl=pl)
+
+    def predict(self, payloads):
+        with waf_engine.waf_engine(self.rules_dir, pl=self.pl) as waf:
+            scores = waf.predict(np.array(payloads))
+        return ["Blocked" if score > 0 else "Allowed" for score in scores]
+
+
+# Backend WAF via HTTP: il payload passa da Apache+ModSecurity, con una sessione keep-alive condivisa.
+# Le POST di un batch (es. dal coalescer) partono in parallelo, fino a pool_size connessioni, come
+# farebbero le richieste separate: il batch attende circa un round-trip e non uno per payload
+class HttpWafBackend:
+    name = "http"
+
+    def __init__(self, url="http://127.0.0.1/", timeout=5.0, retries=3, pool_size=16):
+        # requests serve solo a questo backend: importato qui, non all'avvio del server
+        import requests
+        from concurrent.futures import ThreadPoolExecutor
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.url = url
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                      allowed_methods=frozenset(["POST"]))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # I thread partono al primo batch, quindi anche dopo il fork dei worker pre-fork
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="waf-http")
+
+    def _post(self, payload):
+        result = self.session.post(self.url, data={"query": payload}, timeout=self.timeout)
+        return "Blocked" if result.status_code == 403 else "Allowed"
+
+    def predict(self, payloads):
+        if len(payloads) <= 1:
+            return [self._post(payload) for payload in payloads]
+        return list(self._executor.map(self._post, payloads))
+
+
+def make_waf_backend(name):
+    """Backend WAF selezionato da configurazione (variabile d'ambiente WAF_BACKEND)."""
+    if name == "inprocess":
+        return InProcessWafBackend(crs_rules_dir, pl=1)
+    if name == "http":
+        return HttpWafBackend(os.environ.get("WAF_URL", "http://127.0.0.1/"),
+                              timeout=float(os.environ.get("WAF_TIMEOUT", "5")))
+    raise ValueError(f"Backend WAF non supportato: {name}")
+
+
+# Passata singola del CRS (SINGLE_PASS=1): verdetto ModSecurity PL1 e feature del modello
+# ricavati dalla stessa valutazione delle regole, senza un secondo motore PyModSecurity
+single_pass = os.environ.get("SINGLE_PASS", "0") == "1"
+
+# Di default il verdetto ModSecurity viene da Apache via HTTP, come nelle valutazioni originali;
+# WAF_BACKEND=inprocess usa PyModSecurity PL1 nel processo (più veloce, ma misura un motore diverso)
+waf_backend = None if single_pass else make_waf_backend(os.environ.get("WAF_BACKEND", "http"))
+
+# Cascata (CASCADE_DIR): se esiste la calibrazione cascade_<dataset>_<modello>.json di
+# calibrate_cascade.py, un modello lineare economico decide i payload certi e solo quelli
+# incerti passano a ModSecurity e al modello richiesto (non con SINGLE_PASS)
+cascade_dir = os.environ.get("CASCADE_DIR")
+cascades = {}
+cascades_lock = threading.Lock()
+
+
+def cascade_path(dataset_choice, model_choice):
+    return os.path.join(cascade_dir, f"cascade_{dataset_choice}_{model_choice}.json")
+
+
+def get_cascade(dataset_choice, model_choice):
+    if not cascade_dir or single_pass:
+        return None
+    key = (dataset_choice, model_choice)
+    with cascades_lock:
+        if key not in cascades:
+            path = cascade_path(dataset_choice, model_choice)
+            cascades[key] = Cascade.load(path) if os.path.isfile(path) else None
+            if cascades[key] is not None:
+                print(f"🪜 Cascade for {dataset_choice}/{model_choice}: {path}")
+                metrics.registry.add_collector(metrics.stats_collector("cascade", cascades[key].stats,
+                                                                       model=model_choice, dataset=dataset_choice))
+        return cascades[key]
+
+
+# Metriche esposte da /metrics: stadi, verdetti per modello/dataset, cache, estrattore e modelli
+metrics.registry.add_collector(metrics.stats_collector("verdict_cache", verdict_cache.stats))
+metrics.registry.add_collector(metrics.stats_collector("features", feature_service.stats))
+metrics.registry.add_collector(models.collect)
+
+
+def count_verdicts(result, model_choice, dataset_choice):
+    for engine, key in (("waf", "modsec_prediction"), ("ml", "ml_prediction"), ("combined", "combined_decision")):
+        metrics.count_verdict(engine, result[key], model=model_choice, dataset=dataset_choice)
+
+
 # Funzione per il test con ModSecurity
 def test_with_modsecurity(payload):
-    result = requests.post("http://127.0.0.1/", data={"query": payload})
-    print("Result ModSec:", result)
-    return "Blocked" if result.status_code == 403 else "Allowed"
+    with metrics.timed("waf"):
+        result = waf_backend.predict([payload])[0]
+    print(f"Result ModSec ({waf_backend.name}):", result)
+    return result
 
 
 # Funzione per il test con il modello ML
 def test_with_ml(payload, model_choice, dataset_choice):
-    features = extract_features(payload)
-    # Caricamento dei modelli all'avvio del server
-    model = joblib.load(model_paths[dataset_choice][model_choice])
+    # Modello già in memoria (caricato all'avvio o al primo uso)
+    model = models.get(dataset_choice, model_choice)
     print(f"Model: {dataset_choice}/{model_choice}/{model}")
-    prediction = model.predict([features])[0]
+    with metrics.timed("features"):
+        active = feature_service.extract_active([payload])
+    with metrics.timed("ml_predict"):
+        if hasattr(model, "predict_active"):
+            # Modello lineare veloce: somma dei pesi delle sole regole attivate
+            prediction = model.predict_active(active)[0]
+        else:
+            prediction = model.predict(feature_service.features_for(model, active))[0]
     return "Blocked" if prediction == 1 else "Allowed"
 
+# Test con il modello ML su un batch di payload: una sola matrice di feature e una sola predict
+def test_with_ml_batch(payloads, model_choice, dataset_choice):
+    model = models.get(dataset_choice, model_choice)
+    with metrics.timed("features"):
+        active = feature_service.extract_active(payloads)
+    with metrics.timed("ml_predict"):
+        if hasattr(model, "predict_active"):
+            predictions = model.predict_active(active)
+        else:
+            predictions = model.predict(feature_service.features_for(model, active))
+    return ["Blocked" if prediction == 1 else "Allowed" for prediction in predictions]
+
+# Passata singola: ModSecurity e modello ML valutati da un'unica esecuzione delle regole CRS
+def test_single_pass(payloads, model_choice, dataset_choice):
+    model = models.get(dataset_choice, model_choice)
+    waf_pred, ml_pred, combined_pred = scoring.score_batch(payloads, model, feature_service, crs_rules_dir,
+                                                           pl=1, strategy="single_pass")
+    return [
+        {
+            "modsec_prediction": scoring.verdict(w),
+            "ml_prediction": scoring.verdict(m),
+            "combined_decision": scoring.verdict(c)
+        }
+        for w, m, c in zip(waf_pred, ml_pred, combined_pred)
+    ]
+
+# Cascata: il modello lineare decide i payload certi, ModSecurity e il modello richiesto solo quelli incerti
+def test_cascade(payloads, model_choice, dataset_choice, cascade):
+    model = models.get(dataset_choice, model_choice)
+
+    def escalate(subset, active):
+        with metrics.timed("waf"):
+            waf = [int(result == "Blocked") for result in waf_backend.predict(subset)]
+        with metrics.timed("ml_predict"):
+            if hasattr(model, "predict_active"):
+                predictions = model.predict_active(active)
+            else:
+                predictions = model.predict(feature_service.features_for(model, active))
+        return waf, [int(prediction == 1) for prediction in predictions]
+
+    waf_pred, ml_pred, combined_pred = cascade.score_batch(payloads, feature_service, escalate)
+    return [
+        {
+            "modsec_prediction": scoring.verdict(w),
+            "ml_prediction": scoring.verdict(m),
+            "combined_decision": scoring.verdict(c)
+        }
+        for w, m, c in zip(waf_pred, ml_pred, combined_pred)
+    ]
+
+# Decisione combinata di un batch di payload con la strategia configurata (passata singola, cascata o entrambi i motori)
+def score_payloads(payloads, model_choice, dataset_choice):
+    cascade = get_cascade(dataset_choice, model_choice)
+    if single_pass or cascade is not None:
+        if single_pass:
+            results = test_single_pass(payloads, model_choice, dataset_choice)
+        else:
+            results = test_cascade(payloads, model_choice, dataset_choice, cascade)
+        return results
+    with metrics.timed("waf"):
+        modsec_results = waf_backend.predict(payloads)
+    ml_results = test_with_ml_batch(payloads, model_choice, dataset_choice)
+    results = [
+        {
+            "modsec_prediction": modsec_result,
+            "ml_prediction": ml_result,
+            "combined_decision": "Blocked" if modsec_result == "Blocked" or ml_result == "Blocked" else "Allowed"
+        }
+        for modsec_result, ml_result in zip(modsec_results, ml_results)
+    ]
+    return results
+
+# Coalescer delle richieste (COALESCE_MAX_BATCH > 1): le richieste concorrenti a /vulnerable per lo
+# stesso dataset/modello attendono al massimo COALESCE_MAX_WAIT_MS e vengono valutate come un solo batch
+coalesce_max_batch = int(os.environ.get("COALESCE_MAX_BATCH", "0"))
+coalescer = None
+if coalesce_max_batch > 1:
+    coalescer = RequestCoalescer(lambda key, payloads: score_payloads(payloads, *key),
+                                 max_wait_ms=float(os.environ.get("COALESCE_MAX_WAIT_MS", "2")),
+                                 max_batch=coalesce_max_batch, name="vulnerable")
+    metrics.registry.add_collector(metrics.stats_collector("coalescer", coalescer.stats, route="/vulnerable"))
+
+# Namespace della cache dei verdetti: modello, ruleset, sorgente del verdetto ModSecurity
+# (passata singola o backend WAF) e, se usata, calibrazione e modello economico della cascata
+def cache_namespace(model_choice, dataset_choice):
+    namespace = verdict_cache.namespace(model_paths[dataset_choice][model_choice], crs_rules_dir)
+    if single_pass:
+        namespace += config_identity("single_pass")
+    else:
+        namespace += config_identity(waf_backend.name, getattr(waf_backend, "url", ""))
+    cascade = get_cascade(dataset_choice, model_choice)
+    if cascade is not None:
+        namespace += file_identity(cascade_path(dataset_choice, model_choice)) + file_identity(cascade.cheap_model_path)
+    return namespace
+
 # Endpoint principale per la predizione
 @app.route("/vulnerable", methods=["POST"])
 def vulnerable():
@@ -62,32 +277,138 @@ def vulnerable():
 
     print(f"🔍 Ricevuto payload: {payload}")
     #print(f"🔍 Modello scelto: {model_choice} | Dataset: {dataset_choice}")
+    metrics.registry.inc("requests", route="/vulnerable")
 
-    try:
-        # Test con ModSecurity
-        modsec_result = test_with_modsecurity(payload)
-        print(f"\n🔐 ModSecurity prediction: {modsec_result}")
-        # Test con il modello ML
-        ml_result = test_with_ml(payload, model_choice, dataset_choice)
-        print(f"\n🔐 ML Model prediction: {ml_result}")
+    with metrics.timed("request", route="/vulnerable"):
+        return score_vulnerable(payload, model_choice, dataset_choice)
 
-        # Decisione combinata: OR (Blocked se almeno uno dei due rileva il payload come malevolo)
-        combined_decision = "Blocked" if modsec_result == "Blocked" or ml_result == "Blocked" else "Allowed"
-        print(f"\n⚖️ Combined Decision: {combined_decision}")
 
+# Decisione combinata di /vulnerable; i verdetti sono contati per ogni decisione, anche dalla cache
+# (come in decision_script), così la serie `verdicts` ha lo stesso significato per tutti i server
+def score_vulnerable(payload, model_choice, dataset_choice):
+    try:
+        result = decide_vulnerable(payload, model_choice, dataset_choice)
+        count_verdicts(result, model_choice, dataset_choice)
         # Restituisce il risultato al client
+        return jsonify(dict(result, payload=payload))
+
+    except Exception as e:
+        print(f"❌ Errore interno del server: {str(e)}")
+        metrics.registry.inc("errors", route="/vulnerable")
+        return jsonify({"error": "Errore interno del server"}), 500
+
+
+# Verdetti di un payload: cache dei verdetti, poi ModSecurity e modello ML
+def decide_vulnerable(payload, model_choice, dataset_choice):
+    namespace = cache_namespace(model_choice, dataset_choice)
+    cached = verdict_cache.get(namespace, payload)
+    if cached is not None:
+        print(f"\n♻️ Cached decision: {cached['combined_decision']}")
+        return cached
+
+    if coalescer is not None:
+        result = coalescer.submit((model_choice, dataset_choice), payload)
+        print(f"\n⚖️ Combined Decision (coalesced): {result['combined_decision']}")
+        verdict_cache.put(namespace, payload, result)
+        return result
+
+    if single_pass:
+        result = test_single_pass([payload], model_choice, dataset_choice)[0]
+        print(f"\n⚖️ Combined Decision (single pass): {result['combined_decision']}")
+        verdict_cache.put(namespace, payload, result)
+        return result
+
+    cascade = get_cascade(dataset_choice, model_choice)
+    if cascade is not None:
+        result = test_cascade([payload], model_choice, dataset_choice, cascade)[0]
+        print(f"\n⚖️ Combined Decision (cascade): {result['combined_decision']}")
+        verdict_cache.put(namespace, payload, result)
+        return result
+
+    # Test con ModSecurity
+    modsec_result = test_with_modsecurity(payload)
+    print(f"\n🔐 ModSecurity prediction: {modsec_result}")
+    # Test con il modello ML
+    ml_result = test_with_ml(payload, model_choice, dataset_choice)
+    print(f"\n🔐 ML Model prediction: {ml_result}")
+
+    # Decisione combinata: OR (Blocked se almeno uno dei due rileva il payload come malevolo)
+    combined_decision = "Blocked" if modsec_result == "Blocked" or ml_result == "Blocked" else "Allowed"
+    print(f"\n⚖️ Combined Decision: {combined_decision}")
+
+    result = {
+        "modsec_prediction": modsec_result,
+        "ml_prediction": ml_result,
+        "combined_decision": combined_decision
+    }
+    verdict_cache.put(namespace, payload, result)
+    return result
+
+# Endpoint per la predizione di un batch di payload (JSON: {"payloads": [...], "model_choice": ..., "dataset_choice": ...})
+@app.route("/vulnerable_batch", methods=["POST"])
+def vulnerable_batch():
+    data = request.get_json(force=True)
+    payloads = data.get("payloads", [])
+    model_choice = data.get("model_choice", "")
+    dataset_choice = data.get("dataset_choice", "")
+
+    print(f"🔍 Ricevuto batch di {len(payloads)} payload")
+    metrics.registry.inc("requests", route="/vulnerable_batch")
+
+    try:
+        namespace = cache_namespace(model_choice, dataset_choice)
+        with metrics.timed("request", route="/vulnerable_batch"):
+            results = verdict_cache.lookup_batch(namespace, payloads, lambda missing: score_payloads(
+                missing, model_choice, dataset_choice))
+        # Tutti i verdetti del batch, anche quelli dalla cache
+        for result in results:
+            count_verdicts(result, model_choice, dataset_choice)
         return jsonify({
-            "modsec_prediction": modsec_result,
-            "ml_prediction": ml_result,
-            "combined_decision": combined_decision,
-            "payload": payload
+            "modsec_prediction": [result["modsec_prediction"] for result in results],
+            "ml_prediction": [result["ml_prediction"] for result in results],
+            "combined_decision": [result["combined_decision"] for result in results]
         })
 
     except Exception as e:
         print(f"❌ Errore interno del server: {str(e)}")
+        metrics.registry.inc("errors", route="/vulnerable_batch")
         return jsonify({"error": "Errore interno del server"}), 500
 
+# Metriche in formato testo Prometheus
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+# Contatori della cache dei verdetti
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify(verdict_cache.stats())
+
+# Tempi di avvio e per richiesta dell'estrattore di caratteristiche
+@app.route("/features_stats", methods=["GET"])
+def features_stats():
+    return jsonify(feature_service.stats())
+
+# Tempi di caricamento e memoria dei modelli
+@app.route("/models", methods=["GET"])
+def models_stats():
+    return jsonify(models.stats())
+
+# Dimensione media dei batch e attesa del coalescer delle richieste
+@app.route("/coalescer_stats", methods=["GET"])
+def coalescer_stats():
+    return jsonify(coalescer.stats() if coalescer is not None else {"enabled": False})
+
 
 if __name__ == "__main__":
     print("🚀 Avviando il server Flask con decisione combinata...")
-    app.run(port=6000)
+    # Carica tutti i modelli prima di accettare richieste (MODEL_PRELOAD=0 per caricarli al primo uso)
+    if os.environ.get("MODEL_PRELOAD", "1") != "0":
+        models.preload()
+    # SERVER_WORKERS=N: N worker pre-fork che condividono modelli ed estrattore già caricati (vedi prefork.py)
+    workers = int(os.environ.get("SERVER_WORKERS", "0"))
+    if workers > 0:
+        import prefork
+        prefork.serve(app, port=6000, workers=workers, on_reload=models.preload)
+    else:
+        app.run(port=6000)